@@ -0,0 +1,260 @@
+import asyncio
+import math
+import os
+from collections import deque
+from time import monotonic
+
+from prometheus_client import Counter
+
+from auth.tokens import token_user
+from db.codec import ORJSONResponse
+from db.pool import DB_POOL_MAX_SIZE
+
+# Concurrency limits and rate limits in front of every HTTP route; see README.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# Requests of each class served at once per worker. Point reads are short and several are answered from
+# memory; list scans hold a connection for a whole page, and streams for a whole table.
+ADMISSION_POINT_CONCURRENCY = int(os.getenv("ADMISSION_POINT_CONCURRENCY", str(2 * DB_POOL_MAX_SIZE)))
+ADMISSION_LIST_CONCURRENCY = int(os.getenv("ADMISSION_LIST_CONCURRENCY", str(max(1, DB_POOL_MAX_SIZE // 4))))
+ADMISSION_STREAM_CONCURRENCY = int(os.getenv("ADMISSION_STREAM_CONCURRENCY", str(max(1, DB_POOL_MAX_SIZE // 10))))
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY", str(max(1, DB_POOL_MAX_SIZE // 2))))
+# Longest a request waits for a slot before a 503. It gets one at once if its expected wait (waiters
+# ahead of it times the class's recent service time, over its slots) is already longer, or past
+# ADMISSION_MAX_QUEUE waiters.
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "500"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+# Token buckets per caller and route class as "requests per second/burst", e.g. "20/40"; empty = no limit.
+# The caller is the bearer token's user, or the client address without one.
+RATE_LIMIT_POINT = os.getenv("RATE_LIMIT_POINT", "")
+RATE_LIMIT_LIST = os.getenv("RATE_LIMIT_LIST", "")
+RATE_LIMIT_STREAM = os.getenv("RATE_LIMIT_STREAM", "")
+RATE_LIMIT_WRITE = os.getenv("RATE_LIMIT_WRITE", "")
+# Callers tracked per worker; the least recently seen bucket is dropped past this.
+RATE_LIMIT_MAX_CALLERS = int(os.getenv("RATE_LIMIT_MAX_CALLERS", "100000"))
+SHED_RETRY_AFTER_SECONDS = 1
+# Weight of the latest request in a class's moving average service time.
+SERVICE_TIME_WEIGHT = 0.1
+
+ROUTE_CLASSES = ("point", "list", "stream", "write")
+# Routes that are never limited: health, docs and the counters you need while tuning this. Only
+# stats served from memory belong here; /scheduler/stats queries the database and is a point read.
+EXEMPT_PATHS = {
+    "/", "/metrics", "/docs", "/redoc", "/openapi.json",
+    "/db/stats", "/db/replicas/stats", "/admission/stats", "/auth/stats", "/buildings/cache/stats",
+    "/events/stats", "/leaderboards/stats", "/planets/index/stats", "/user_fleets/write_behind/stats",
+}
+# Last path segments of GET routes that build a large response.
+LIST_SEGMENTS = {"empire"}
+# Resources whose GET /<resource>/<name> is a page, not a single row.
+PAGED_RESOURCES = {"leaderboards"}
+
+ADMISSION_REJECTED = Counter(
+    "http_requests_rejected_total", "Requests turned away by admission control.", ["route_class", "reason"],
+)
+
+
+def route_class(method: str, path: str):
+    # The middleware runs before routing, so classes come from the method and path shape:
+    # GET /<resource>/ is a list page, GET /<resource>/<id> a point read. None means exempt.
+    if path in EXEMPT_PATHS:
+        return None
+    if method not in ("GET", "HEAD"):
+        return "write"
+    segments = path.strip("/").split("/")
+    if segments[-1] == "stream":
+        return "stream"
+    if len(segments) == 1 or segments[-1] in LIST_SEGMENTS:
+        return "list"
+    if len(segments) == 2 and segments[0] in PAGED_RESOURCES:
+        return "list"
+    return "point"
+
+
+def parse_rate(value: str):
+    if not value:
+        return None
+    rate, _, burst = value.partition("/")
+    rate = float(rate)
+    return (rate, float(burst or rate)) if rate > 0 else None
+
+
+class ConcurrencyLimit:
+    # A counting semaphore with a bounded FIFO queue. A released slot is handed straight to the
+    # oldest waiter, so a burst cannot overtake callers that have been queueing.
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.service_seconds = 0.0
+
+    def expected_wait(self) -> float:
+        return (len(self.waiters) + 1) * self.service_seconds / max(self.limit, 1)
+
+    async def acquire(self):
+        # None once a slot is held, else why the request is turned away.
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self.waiters) >= self.max_queue or self.expected_wait() > self.timeout:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        except asyncio.CancelledError:
+            # The client went away; a slot handed over in the meantime goes to the next waiter.
+            if waiter.done() and not waiter.cancelled():
+                self.release(self.service_seconds)
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            waited = monotonic() - started
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.queued += 1
+        self.admitted += 1
+        return None
+
+    def release(self, served: float):
+        self.service_seconds += (served - self.service_seconds) * SERVICE_TIME_WEIGHT
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "wait_ms_total": round(self.wait_seconds * 1000, 1),
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+            "service_ms": round(self.service_seconds * 1000, 1),
+        }
+
+
+class TokenBuckets:
+    # One bucket per caller, refilled lazily on each take. Dict order doubles as recency order.
+    def __init__(self, rate: float, burst: float, max_callers: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_callers = max_callers
+        self.buckets = {}
+
+    def take(self, caller) -> float:
+        # 0 when a token was taken, else seconds until one is available.
+        now = monotonic()
+        tokens, last = self.buckets.pop(caller, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[caller] = (tokens, now)
+        if len(self.buckets) > self.max_callers:
+            del self.buckets[next(iter(self.buckets))]
+        return wait
+
+
+limits = {
+    name: ConcurrencyLimit(limit, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+    for name, limit in (
+        ("point", ADMISSION_POINT_CONCURRENCY), ("list", ADMISSION_LIST_CONCURRENCY),
+        ("stream", ADMISSION_STREAM_CONCURRENCY), ("write", ADMISSION_WRITE_CONCURRENCY),
+    )
+}
+rate_limits = {
+    name: TokenBuckets(*rate, RATE_LIMIT_MAX_CALLERS)
+    for name, rate in (
+        ("point", parse_rate(RATE_LIMIT_POINT)), ("list", parse_rate(RATE_LIMIT_LIST)),
+        ("stream", parse_rate(RATE_LIMIT_STREAM)), ("write", parse_rate(RATE_LIMIT_WRITE)),
+    )
+    if rate is not None
+}
+_rejected = {name: {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0} for name in ROUTE_CLASSES}
+
+
+def caller_of(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                user_id = token_user(token)
+                if user_id is not None:
+                    return user_id
+            break
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _reject(name: str, reason: str, status: int, retry_after: float, detail: str):
+    _rejected[name][reason] += 1
+    ADMISSION_REJECTED.labels(name, reason).inc()
+    return ORJSONResponse(
+        {"detail": detail}, status_code=status, headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    # Plain ASGI like MetricsMiddleware. A rejected request is answered before routing, dependencies or
+    # a pool checkout, so turning one away costs microseconds; admitted ones keep their slot until the
+    # last body chunk is sent, streams included. WebSockets are not limited here.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        buckets = rate_limits.get(name)
+        if buckets is not None:
+            wait = buckets.take(caller_of(scope))
+            if wait:
+                response = _reject(name, "rate_limited", 429, wait, "Rate limit exceeded, slow down.")
+                return await response(scope, receive, send)
+
+        limit = limits[name]
+        reason = await limit.acquire()
+        if reason is not None:
+            response = _reject(name, reason, 503, SHED_RETRY_AFTER_SECONDS, "Server busy, try again shortly.")
+            return await response(scope, receive, send)
+        started = monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release(monotonic() - started)
+
+
+def admission_stats():
+    return {
+        name: {
+            **limits[name].stats(),
+            **_rejected[name],
+            "rate_limit": None if name not in rate_limits else {
+                "rate": rate_limits[name].rate, "burst": rate_limits[name].burst, "callers": len(rate_limits[name].buckets),
+            },
+        }
+        for name in ROUTE_CLASSES
+    }
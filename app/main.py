@@ -1,25 +1,109 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
+from app.admission import ADMISSION_CONTROL, AdmissionMiddleware, admission_stats
+from app.metrics import MetricsMiddleware, metrics_response
+from db.codec import ORJSONResponse
+from db.metrics import METRICS_ENABLED
+from db.pool import open_pool, close_pool, pool_stats
+from db.replicas import ReplicaMiddleware, replica_stats, replicas, start_replicas, stop_replicas
+from buildings.cache import start_catalog, stop_catalog
+from planets.spatial import start_planet_index, stop_planet_index
+from leaderboards.ranking import start_leaderboards, stop_leaderboards
+from battles.batch import start_battle_workers, stop_battle_workers
+from battles.partitions import start_battle_partitions, stop_battle_partitions
+from events.broker import start_events, stop_events
+from auth.passwords import start_password_workers, stop_password_workers
+from auth.tokens import AUTH_REQUIRED, current_user, start_auth, stop_auth
+from user_fleets.write_behind import start_write_behind, stop_write_behind
+from scheduler.runner import start_scheduler, stop_scheduler
+from auth.endpoints import router as auth_router
 from users.endpoints import router as users_router
 from planets.endpoints import router as planets_router
 from buildings.endpoints import router as buildings_router
 from user_buildings.endpoints import router as user_buildings_router
 from user_fleets.endpoints import router as user_fleets_router
 from battles.endpoints import router as battles_router
+from events.endpoints import router as events_router
+from leaderboards.endpoints import router as leaderboards_router
+from scheduler.endpoints import router as scheduler_router
 
-app = FastAPI()
 
-app.include_router(users_router, prefix="/users", tags=["Users"])
-app.include_router(planets_router, prefix="/planets", tags=["Planets"])
-app.include_router(buildings_router, prefix="/buildings", tags=["Buildings"])
-app.include_router(user_buildings_router, prefix="/user_buildings", tags=["User Buildings"])
-app.include_router(user_fleets_router, prefix="/user_fleets", tags=["User Fleets"])
-app.include_router(battles_router, prefix="/battles", tags=["Battles"])
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_pool()
+    await start_replicas()
+    await start_write_behind()
+    await start_catalog()
+    await start_planet_index()
+    await start_leaderboards()
+    await start_battle_partitions()
+    await start_events()
+    await start_auth()
+    start_battle_workers()
+    start_password_workers()
+    await start_scheduler()
+    try:
+        yield
+    finally:
+        await stop_scheduler()
+        stop_password_workers()
+        stop_battle_workers()
+        await stop_auth()
+        await stop_events()
+        await stop_battle_partitions()
+        await stop_leaderboards()
+        await stop_planet_index()
+        await stop_catalog()
+        await stop_write_behind()
+        await stop_replicas()
+        await close_pool()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# Added first so it runs inside MetricsMiddleware, which then counts the 429s and 503s it returns.
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
+if replicas:
+    app.add_middleware(ReplicaMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# With AUTH_REQUIRED every resource route needs a bearer token; /auth itself stays open.
+protected = [Depends(current_user)] if AUTH_REQUIRED else []
+
+app.include_router(auth_router, prefix="/auth", tags=["Auth"])
+app.include_router(users_router, prefix="/users", tags=["Users"], dependencies=protected)
+app.include_router(planets_router, prefix="/planets", tags=["Planets"], dependencies=protected)
+app.include_router(buildings_router, prefix="/buildings", tags=["Buildings"], dependencies=protected)
+app.include_router(user_buildings_router, prefix="/user_buildings", tags=["User Buildings"], dependencies=protected)
+app.include_router(user_fleets_router, prefix="/user_fleets", tags=["User Fleets"], dependencies=protected)
+app.include_router(battles_router, prefix="/battles", tags=["Battles"], dependencies=protected)
+app.include_router(events_router, prefix="/events", tags=["Events"], dependencies=protected)
+app.include_router(leaderboards_router, prefix="/leaderboards", tags=["Leaderboards"], dependencies=protected)
+app.include_router(scheduler_router, prefix="/scheduler", tags=["Scheduler"], dependencies=protected)
 
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the Crimson Dominion API"}
 
+@app.get("/db/stats")
+def db_stats():
+    return pool_stats()
+
+@app.get("/db/replicas/stats")
+def db_replica_stats():
+    return replica_stats()
+
+@app.get("/admission/stats")
+def read_admission_stats():
+    return admission_stats()
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return metrics_response()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
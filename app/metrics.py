@@ -0,0 +1,60 @@
+import os
+from time import perf_counter
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route template.", ["method", "route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HTTP_REQUESTS = Counter("http_requests_total", "Responses by route template and status.", ["method", "route", "status"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served.", multiprocess_mode="livesum")
+
+
+def route_template(scope) -> str:
+    # Label by the matched route's template, never the raw path, so ids stay out of the labels.
+    # FastAPI versions that resolve included routers lazily keep the prefixed template in the
+    # effective route context; older ones copy the prefix into the route itself.
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    return getattr(context, "path_format", None) or getattr(route, "path_format", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task or body buffering per request.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        started = perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = route_template(scope)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route).observe(perf_counter() - started)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status)).inc()
+
+
+def metrics_response():
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Several uvicorn workers: merge every worker's files rather than report just this one.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
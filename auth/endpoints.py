@@ -0,0 +1,69 @@
+from uuid import uuid4
+
+import psycopg
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from auth.passwords import check_password, hash_password, password_stats
+from auth.tokens import create_access_token, current_user, revocations, token_stats, unauthorized
+from db.pool import acquire, get_db
+from users.endpoints import get_user_by_id
+
+class Signup(BaseModel):
+    username: str
+    email: str
+    password: str
+
+class Login(BaseModel):
+    username: str
+    password: str
+
+router = APIRouter()
+
+def token_response(user: dict):
+    return {**user, "access_token": create_access_token(str(user["id"])), "token_type": "bearer"}
+
+@router.post("/signup")
+async def signup(body: Signup):
+    # bcrypt runs in the password pool with no database connection held; one is taken only for the insert.
+    password_hash = await hash_password(body.password)
+    user_id = str(uuid4())
+    try:
+        async with acquire() as conn:
+            await conn.execute("""
+                INSERT INTO users (id, username, email, password_hash)
+                VALUES (%s, %s, %s, %s)
+            """, (user_id, body.username, body.email, password_hash))
+    except psycopg.errors.UniqueViolation:
+        raise HTTPException(status_code=409, detail="Username or email already taken")
+    return token_response({"id": user_id, "username": body.username, "email": body.email})
+
+@router.post("/login")
+async def login(body: Login):
+    async with acquire() as conn:
+        cursor = await conn.execute("SELECT id, username, email, password_hash FROM users WHERE username = %s", (body.username,))
+        row = await cursor.fetchone()
+    if not await check_password(body.password, row[3] if row else None):
+        raise unauthorized("Incorrect username or password")
+    return token_response({"id": str(row[0]), "username": row[1], "email": row[2]})
+
+@router.post("/logout")
+async def logout(user_id: str = Depends(current_user), conn: psycopg.AsyncConnection = Depends(get_db)):
+    # Revokes every token issued to the user so far, on all devices. The cutoff comes from the
+    # database clock, as it does when a password change moves it, so the two can't disagree.
+    async with conn.cursor() as cursor:
+        await cursor.execute("UPDATE users SET tokens_revoked_at = now() WHERE id = %s", (user_id,))
+    await conn.commit()
+    revocations.discard(user_id)
+    return {"message": "Logged out"}
+
+@router.get("/me")
+async def me(user_id: str = Depends(current_user), conn: psycopg.AsyncConnection = Depends(get_db)):
+    user = await get_user_by_id(conn, user_id)
+    if user:
+        return user
+    raise unauthorized("Unknown user.")
+
+@router.get("/stats")
+def auth_stats():
+    return {"passwords": password_stats(), **token_stats()}
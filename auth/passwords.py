@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException
+
+# bcrypt cost factor; each step doubles the work (12 is ~250 ms of one core).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes per API worker that hash and check passwords; 0 runs them on a thread instead.
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hashes queued or running per API worker before signup and login answer 503.
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", str(4 * max(AUTH_HASH_WORKERS, 1))))
+HASH_RETRY_AFTER_SECONDS = 1
+# bcrypt only looks at the first 72 bytes and refuses longer input.
+MAX_PASSWORD_BYTES = 72
+
+_executor = None
+_pending = 0
+_dummy_hash = None
+_stats = {"hashed": 0, "checked": 0, "rejected": 0}
+
+
+def hash_password_sync(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password_sync(password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    except ValueError:
+        # Not a bcrypt hash, e.g. a placeholder written through POST /users/.
+        return False
+
+
+def start_password_workers():
+    global _executor
+    if _executor is None and AUTH_HASH_WORKERS > 0:
+        # spawn, not fork: forking a process that holds an event loop and pooled sockets is unsafe.
+        _executor = ProcessPoolExecutor(max_workers=AUTH_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def stop_password_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def _run(fn, *args):
+    # bcrypt is deliberately slow; past AUTH_HASH_MAX_PENDING a caller gets a fast 503
+    # instead of queueing behind hashes that would outlast its own timeout.
+    global _pending
+    if _pending >= AUTH_HASH_MAX_PENDING:
+        _stats["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-ins in progress, try again shortly.",
+            headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)},
+        )
+    _pending += 1
+    try:
+        if _executor is None:
+            return await asyncio.to_thread(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+
+
+def check_password_length(password: str):
+    if len(password.encode()) > MAX_PASSWORD_BYTES:
+        raise HTTPException(status_code=422, detail=f"Password must be at most {MAX_PASSWORD_BYTES} bytes.")
+
+
+async def hash_password(password: str) -> str:
+    check_password_length(password)
+    password_hash = await _run(hash_password_sync, password, BCRYPT_ROUNDS)
+    _stats["hashed"] += 1
+    return password_hash
+
+
+async def check_password(password: str, password_hash: str | None) -> bool:
+    global _dummy_hash
+    if len(password.encode()) > MAX_PASSWORD_BYTES:
+        return False
+    if password_hash is None:
+        # Unknown user: check against a throwaway hash anyway, so the response time
+        # doesn't tell an attacker which usernames exist.
+        if _dummy_hash is None:
+            _dummy_hash = await _run(hash_password_sync, "", BCRYPT_ROUNDS)
+        await _run(check_password_sync, password, _dummy_hash)
+        return False
+    matched = await _run(check_password_sync, password, password_hash)
+    _stats["checked"] += 1
+    return matched
+
+
+def password_stats():
+    return {
+        "workers": AUTH_HASH_WORKERS if _executor is not None else 0,
+        "rounds": BCRYPT_ROUNDS,
+        "pending": _pending,
+        "max_pending": AUTH_HASH_MAX_PENDING,
+        **_stats,
+    }
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+import jwt
+import psycopg
+from fastapi import Header, HTTPException
+
+from db.pool import DATABASE_URL, acquire
+
+logger = logging.getLogger(__name__)
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+JWT_ALGORITHM = "HS256"
+# Verified tokens and per-user revocation cutoffs kept per worker; 0 verifies and checks every request.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Seconds a cached cutoff is trusted. Revocations normally arrive over NOTIFY well before that;
+# this bounds how long a missed notification can keep a revoked token alive.
+AUTH_REVOCATION_TTL = float(os.getenv("AUTH_REVOCATION_TTL", "300"))
+# Every request needs a valid bearer token when set; see app/main.py.
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "yes")
+REVOCATIONS_CHANNEL = "token_revocations"
+LISTEN_RETRY_SECONDS = 5
+
+# A random key is only good for one worker in development: its tokens fail on every other worker
+# and die with it. start_auth refuses to run without a real key once AUTH_REQUIRED is set.
+RANDOM_SECRET_KEY = not SECRET_KEY
+if RANDOM_SECRET_KEY:
+    SECRET_KEY = secrets.token_urlsafe(32)
+    logger.warning("SECRET_KEY is not set; tokens are signed with a random key and die with this worker")
+
+
+class LRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# token -> (user id, iat, exp); the signature and claims were checked once when it was added.
+verified_tokens = LRU(AUTH_TOKEN_CACHE_SIZE)
+# user id -> (tokens_revoked_at as epoch seconds or None, monotonic time it was read)
+revocations = LRU(AUTH_TOKEN_CACHE_SIZE)
+_listener_task = None
+
+
+def create_access_token(user_id: str) -> str:
+    # iat keeps its fraction, so a login right after a logout isn't caught by the same-second cutoff.
+    now = time.time()
+    return jwt.encode(
+        {"sub": user_id, "iat": now, "exp": int(now + ACCESS_TOKEN_EXPIRE_MINUTES * 60)},
+        SECRET_KEY,
+        algorithm=JWT_ALGORITHM,
+    )
+
+
+def unauthorized(detail: str):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+def _decode(token: str):
+    claims = verified_tokens.get(token)
+    if claims is not None:
+        if claims[2] <= time.time():
+            verified_tokens.discard(token)
+            raise unauthorized("Token expired.")
+        return claims
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM], options={"require": ["sub", "iat", "exp"]})
+    except jwt.ExpiredSignatureError:
+        raise unauthorized("Token expired.")
+    except jwt.InvalidTokenError:
+        raise unauthorized("Invalid token.")
+    claims = (payload["sub"], float(payload["iat"]), payload["exp"])
+    verified_tokens.put(token, claims)
+    return claims
+
+
+async def _revoked_before(user_id: str):
+    # The user's cutoff, from cache when fresh; raises 401 if the user no longer exists.
+    entry = revocations.get(user_id)
+    if entry is not None and time.monotonic() - entry[1] < AUTH_REVOCATION_TTL:
+        cutoff = entry[0]
+    else:
+        async with acquire() as conn:
+            cursor = await conn.execute(
+                "SELECT extract(epoch FROM tokens_revoked_at)::float8 FROM users WHERE id = %s", (user_id,),
+            )
+            row = await cursor.fetchone()
+        if row is None:
+            revocations.discard(user_id)
+            raise unauthorized("Unknown user.")
+        cutoff = row[0]
+        revocations.put(user_id, (cutoff, time.monotonic()))
+    return cutoff
+
+
+async def authenticate(token: str) -> str:
+    user_id, issued_at, _ = _decode(token)
+    cutoff = await _revoked_before(user_id)
+    if cutoff is not None and issued_at < cutoff:
+        raise unauthorized("Token revoked.")
+    return user_id
+
+
+async def current_user(authorization: str | None = Header(None)) -> str:
+    # A warm token costs no database round trip: its claims and the user's cutoff come from memory.
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise unauthorized("Not authenticated.")
+    return await authenticate(token)
+
+
+def token_user(token: str):
+    # The token's user if it is validly signed and unexpired, else None. No revocation check:
+    # this only names the caller for rate limiting, current_user still guards the route.
+    try:
+        return _decode(token)[0]
+    except HTTPException:
+        return None
+
+
+def forget_user(user_id: str):
+    revocations.discard(user_id)
+
+
+async def _connect_listener():
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f"LISTEN {REVOCATIONS_CHANNEL}")
+    return conn
+
+
+async def _listen(conn):
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = await _connect_listener()
+                    # Revocations sent while we were not listening are unknown, so forget every cutoff.
+                    revocations.entries.clear()
+                async for notify in conn.notifies():
+                    forget_user(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Token revocation listener failed, retrying in %s s", LISTEN_RETRY_SECONDS)
+                if conn is not None:
+                    await conn.close()
+                    conn = None
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+async def start_auth():
+    global _listener_task
+    if AUTH_REQUIRED and RANDOM_SECRET_KEY:
+        raise RuntimeError("AUTH_REQUIRED is set but SECRET_KEY is not; set the same SECRET_KEY on every worker")
+    _listener_task = asyncio.create_task(_listen(await _connect_listener()))
+
+
+async def stop_auth():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+def token_stats():
+    return {"tokens": verified_tokens.stats(), "revocations": revocations.stats()}
@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from uuid import UUID, uuid4
+
+import psycopg
+
+from battles.engine import ships_to_counts, simulate_many
+from battles.log_codec import pack_log
+from db.bulk import copy_rows
+from user_fleets.endpoints import get_user_fleets_for_update, set_user_fleet_ships
+
+BATTLE_WORKERS = int(os.getenv("BATTLE_WORKERS", str(os.cpu_count() or 1)))
+# A battle takes ~0.1 ms, so small batches are cheaper to run inline than to ship to another process.
+INLINE_BATCH_SIZE = int(os.getenv("BATTLE_INLINE_BATCH_SIZE", "64"))
+CHUNKS_PER_WORKER = 4
+
+_executor = None
+
+
+def start_battle_workers():
+    global _executor
+    if _executor is None and BATTLE_WORKERS > 0:
+        # spawn, not fork: forking a process that holds an event loop and pooled sockets is unsafe.
+        _executor = ProcessPoolExecutor(max_workers=BATTLE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def stop_battle_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def run_simulations(jobs: list, executor: ProcessPoolExecutor | None = None, workers: int = BATTLE_WORKERS) -> list:
+    executor = executor or _executor
+    if executor is None or len(jobs) <= INLINE_BATCH_SIZE:
+        return simulate_many(jobs)
+    # Each job carries its own seed, so chunking (and therefore worker count) never changes a result.
+    chunk_size = max(1, -(-len(jobs) // (workers * CHUNKS_PER_WORKER)))
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(executor, simulate_many, jobs[i:i + chunk_size])
+        for i in range(0, len(jobs), chunk_size)
+    ))
+    return [result for chunk in chunks for result in chunk]
+
+
+def _normalize(fleet_id: str):
+    try:
+        return str(UUID(fleet_id))
+    except ValueError:
+        return None
+
+
+async def resolve_battles(conn: psycopg.AsyncConnection, battles: list[tuple[str, str, int | None]]):
+    # battles are (attacker_fleet_id, defender_fleet_id, seed) tuples; a None seed picks a random one.
+    results = [None] * len(battles)
+    pairs = []
+    for index, (attacker_fleet_id, defender_fleet_id, _) in enumerate(battles):
+        pair = (_normalize(attacker_fleet_id), _normalize(defender_fleet_id))
+        if None in pair:
+            results[index] = {"status": "error", "detail": "Fleet ids must be UUIDs."}
+        elif pair[0] == pair[1]:
+            results[index] = {"status": "error", "detail": "A fleet cannot attack itself."}
+        pairs.append(pair)
+
+    # A fleet's survivors from one battle would be the input to the next, so a fleet may only fight once per batch.
+    seen = {}
+    for index, pair in enumerate(pairs):
+        if results[index] is not None:
+            continue
+        for fleet_id in pair:
+            if fleet_id in seen:
+                results[index] = {"status": "error", "detail": f"Fleet {fleet_id} already fights in item {seen[fleet_id]}."}
+                break
+        else:
+            for fleet_id in pair:
+                seen[fleet_id] = index
+
+    fleets = await get_user_fleets_for_update(conn, list(seen))
+    jobs = []
+    job_indexes = []
+    for index, (_, _, seed) in enumerate(battles):
+        if results[index] is not None:
+            continue
+        attacker, defender = fleets.get(pairs[index][0]), fleets.get(pairs[index][1])
+        if not attacker or not defender:
+            results[index] = {"status": "error", "detail": "User fleet not found"}
+            continue
+        try:
+            ships_to_counts(attacker["ships"])
+            ships_to_counts(defender["ships"])
+        except ValueError as e:
+            results[index] = {"status": "error", "detail": str(e)}
+            continue
+        if seed is None:
+            seed = secrets.randbits(63)
+        jobs.append((attacker["ships"], defender["ships"], seed))
+        job_indexes.append(index)
+
+    outcomes = await run_simulations(jobs)
+
+    battle_rows = []
+    survivors = {}
+    for index, (attacker_ships, defender_ships, seed), outcome in zip(job_indexes, jobs, outcomes):
+        attacker_fleet_id, defender_fleet_id = pairs[index]
+        attacker, defender = fleets[attacker_fleet_id], fleets[defender_fleet_id]
+        battle_id = str(uuid4())
+        winner_id = {"attacker": attacker["user_id"], "defender": defender["user_id"]}.get(outcome["winner"])
+        battle_rows.append((battle_id, attacker["user_id"], defender["user_id"], defender["planet_id"], winner_id, pack_log(outcome["battle_log"])))
+        survivors[attacker_fleet_id] = outcome["attacker_remaining"]
+        survivors[defender_fleet_id] = outcome["defender_remaining"]
+        results[index] = {
+            "status": "resolved",
+            "id": battle_id,
+            "winner": outcome["winner"],
+            "rounds": outcome["battle_log"]["rounds"],
+            "seed": seed,
+        }
+
+    if battle_rows:
+        await copy_rows(conn, "battles", ["id", "attacker_id", "defender_id", "planet_id", "winner_id", "battle_log_packed"], battle_rows)
+        await set_user_fleet_ships(conn, survivors)
+    return results
@@ -1,8 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 import psycopg
 from pydantic import BaseModel
-from uuid import uuid4
-from psycopg.types.json import Json  # Ensure JSON compatibility
+from uuid import UUID, uuid4
+import secrets
+from psycopg.rows import dict_row
+from db.pool import get_db
+from db.replicas import get_read_db
+from db.bulk import bulk_error, check_bulk_size, copy_rows, delete_ids, execute_returning
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, stream_ndjson
+from db.versioning import etag_for, etag_matches, not_modified, since_filter
+from battles.batch import resolve_battles
+from battles.engine import simulate
+from battles.log_codec import pack_log, unpack_row
+from user_fleets.endpoints import get_user_fleets_for_update, set_user_fleet_ships
 
 class Battle(BaseModel):
     attacker_id: str
@@ -10,96 +21,194 @@ class Battle(BaseModel):
     planet_id: str
     battle_log: dict
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
+class BattleUpdate(Battle):
+    id: str
 
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
+class BattleResolution(BaseModel):
+    attacker_fleet_id: str
+    defender_fleet_id: str
+    seed: int | None = None  # Replaying a seed reproduces the battle exactly
+
+# battle_log_packed is folded back into battle_log by unpack_row before a row is returned.
+BATTLE_COLUMNS = "id, attacker_id, defender_id, planet_id, winner_id, battle_log, battle_log_packed, version, updated_at"
+
+# One round trip: the Append runs its branches in order and LIMIT 1 stops it
+# at the first hit, so battles_archive is only searched for ids not in battles.
+FIND_BATTLE_SQL = """
+    (SELECT {columns} FROM battles WHERE id = %(id)s)
+    UNION ALL
+    (SELECT {columns} FROM battles_archive WHERE id = %(id)s)
+    LIMIT 1
+"""
+
+def battle_winner_id(battle: Battle) -> str | None:
+    # winner_id feeds the wins leaderboard; it follows the log's "winner" as the engine writes it.
+    return {"attacker": battle.attacker_id, "defender": battle.defender_id}.get(battle.battle_log.get("winner"))
+
+async def insert_battle(conn: psycopg.AsyncConnection, battle: Battle):
+    battle_id = str(uuid4())
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO battles (id, attacker_id, defender_id, planet_id, winner_id, battle_log_packed)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id;
+        """, (battle_id, battle.attacker_id, battle.defender_id, battle.planet_id, battle_winner_id(battle), pack_log(battle.battle_log)))
+    return battle_id
 
 router = APIRouter()
 
 @router.post("/")
-def create_battle(battle: Battle):
-    conn = connect_to_db()
-    if conn:
-        battle_id = str(uuid4())
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO battles (id, attacker_id, defender_id, planet_id, battle_log) 
-                VALUES (%s, %s, %s, %s, %s) 
-                RETURNING id;
-            """, (battle_id, battle.attacker_id, battle.defender_id, battle.planet_id, Json(battle.battle_log)))
-            conn.commit()
-        conn.close()
-        return {"id": battle_id, "attacker_id": battle.attacker_id, "defender_id": battle.defender_id}
-    raise HTTPException(status_code=500, detail="Error creating battle.")
+async def create_battle(battle: Battle, conn: psycopg.AsyncConnection = Depends(get_db)):
+    battle_id = await insert_battle(conn, battle)
+    await conn.commit()
+    return {"id": battle_id, "attacker_id": battle.attacker_id, "defender_id": battle.defender_id}
+
+@router.post("/resolve")
+async def resolve_battle(resolution: BattleResolution, conn: psycopg.AsyncConnection = Depends(get_db)):
+    try:
+        attacker_fleet_id = str(UUID(resolution.attacker_fleet_id))
+        defender_fleet_id = str(UUID(resolution.defender_fleet_id))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Fleet ids must be UUIDs.")
+    if attacker_fleet_id == defender_fleet_id:
+        raise HTTPException(status_code=422, detail="A fleet cannot attack itself.")
+
+    fleets = await get_user_fleets_for_update(conn, [attacker_fleet_id, defender_fleet_id])
+    attacker, defender = fleets.get(attacker_fleet_id), fleets.get(defender_fleet_id)
+    if not attacker or not defender:
+        raise HTTPException(status_code=404, detail="User fleet not found")
+
+    seed = resolution.seed if resolution.seed is not None else secrets.randbits(63)
+    try:
+        result = simulate(attacker["ships"], defender["ships"], seed)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # The battle is fought at the defender's location.
+    battle_id = await insert_battle(conn, Battle(
+        attacker_id=str(attacker["user_id"]),
+        defender_id=str(defender["user_id"]),
+        planet_id=str(defender["planet_id"]),
+        battle_log=result["battle_log"],
+    ))
+    await set_user_fleet_ships(conn, {
+        attacker_fleet_id: result["attacker_remaining"],
+        defender_fleet_id: result["defender_remaining"],
+    })
+    await conn.commit()
+    return {
+        "id": battle_id,
+        "winner": result["winner"],
+        "rounds": result["battle_log"]["rounds"],
+        "seed": seed,
+        "attacker_remaining": result["attacker_remaining"],
+        "defender_remaining": result["defender_remaining"],
+    }
+
+@router.post("/resolve_batch")
+async def resolve_battles_batch(resolutions: list[BattleResolution], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(resolutions)
+    results = await resolve_battles(conn, [
+        (resolution.attacker_fleet_id, resolution.defender_fleet_id, resolution.seed) for resolution in resolutions
+    ])
+    await conn.commit()
+    return results
+
+@router.post("/bulk")
+async def create_battles_bulk(battles: list[Battle], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(battles)
+    ids = [str(uuid4()) for _ in battles]
+    try:
+        await copy_rows(conn, "battles", ["id", "attacker_id", "defender_id", "planet_id", "winner_id", "battle_log_packed"], [
+            (battle_id, b.attacker_id, b.defender_id, b.planet_id, battle_winner_id(b), pack_log(b.battle_log))
+            for battle_id, b in zip(ids, battles)
+        ])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": battle_id, "status": "created"} for battle_id in ids]
+
+@router.patch("/bulk")
+async def update_battles_bulk(battles: list[BattleUpdate], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(battles)
+    try:
+        matched = await execute_returning(conn, """
+            UPDATE battles
+            SET attacker_id = %s, defender_id = %s, planet_id = %s, winner_id = %s, battle_log = NULL, battle_log_packed = %s,
+                version = version + 1, updated_at = now()
+            WHERE id = %s
+            RETURNING id
+        """, [(b.attacker_id, b.defender_id, b.planet_id, battle_winner_id(b), pack_log(b.battle_log), b.id) for b in battles])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": b.id, "status": "updated" if found else "not_found"} for b, found in zip(battles, matched)]
+
+@router.delete("/bulk")
+async def delete_battles_bulk(battle_ids: list[str], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(battle_ids)
+    results = await delete_ids(conn, "battles", battle_ids)
+    await conn.commit()
+    return results
+
+@router.get("/stream")
+async def stream_battles(after: str | None = None, since: datetime | None = None):
+    conditions, params = since_filter(since)
+    return stream_ndjson(f"SELECT {BATTLE_COLUMNS} FROM battles", conditions, params, after, unpack_row)
 
 @router.get("/{battle_id}")
-def read_battle(battle_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM battles WHERE id = %s", (battle_id,))
-            battle = cursor.fetchone()
-        conn.close()
-        if battle:
-            return {
-                "id": battle[0],
-                "attacker_id": battle[1],
-                "defender_id": battle[2],
-                "planet_id": battle[3],
-                "battle_log": battle[4]
-            }
-    raise HTTPException(status_code=404, detail="Battle not found.")
+async def read_battle(
+    battle_id: str,
+    response: Response,
+    if_none_match: str | None = Header(None),
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    # A revalidation reads only the version, never the packed log.
+    if if_none_match:
+        async with conn.cursor() as cursor:
+            await cursor.execute(FIND_BATTLE_SQL.format(columns="version"), {"id": battle_id})
+            row = await cursor.fetchone()
+        if row and etag_matches(if_none_match, row[0]):
+            return not_modified(row[0])
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(FIND_BATTLE_SQL.format(columns=BATTLE_COLUMNS), {"id": battle_id})
+        battle = await cursor.fetchone()
+    if not battle:
+        raise HTTPException(status_code=404, detail="Battle not found.")
+    response.headers["ETag"] = etag_for(battle["version"])
+    return unpack_row(battle)
 
 @router.get("/")
-def read_all_battles():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM battles")
-            battles = cursor.fetchall()
-        conn.close()
-        return [
-            {
-                "id": battle[0],
-                "attacker_id": battle[1],
-                "defender_id": battle[2],
-                "planet_id": battle[3],
-                "battle_log": battle[4]
-            } for battle in battles
-        ]
-    raise HTTPException(status_code=500, detail="Error fetching battles.")
+async def read_all_battles(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    since: datetime | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    conditions, params = since_filter(since)
+    return await fetch_page(conn, f"SELECT {BATTLE_COLUMNS} FROM battles", conditions, params, after, limit, unpack_row)
 
 @router.put("/{battle_id}")
-def update_battle(battle_id: str, battle: Battle):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE battles 
-                SET attacker_id = %s, defender_id = %s, planet_id = %s, battle_log = %s 
-                WHERE id = %s
-            """, (battle.attacker_id, battle.defender_id, battle.planet_id, Json(battle.battle_log), battle_id))
-            conn.commit()
-        conn.close()
-        return {"message": "Battle updated successfully."}
-    raise HTTPException(status_code=500, detail="Error updating battle.")
+async def update_battle(battle_id: str, battle: Battle, response: Response, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            UPDATE battles
+            SET attacker_id = %s, defender_id = %s, planet_id = %s, winner_id = %s, battle_log = NULL, battle_log_packed = %s,
+                version = version + 1, updated_at = now()
+            WHERE id = %s
+            RETURNING version
+        """, (battle.attacker_id, battle.defender_id, battle.planet_id, battle_winner_id(battle), pack_log(battle.battle_log), battle_id))
+        updated = await cursor.fetchone()
+        await conn.commit()
+    if updated:
+        response.headers["ETag"] = etag_for(updated[0])
+    return {"message": "Battle updated successfully."}
 
 @router.delete("/{battle_id}")
-def delete_battle(battle_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM battles WHERE id = %s", (battle_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "Battle deleted successfully."}
-    raise HTTPException(status_code=500, detail="Error deleting battle.")
+async def delete_battle(battle_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM battles WHERE id = %s", (battle_id,))
+        await conn.commit()
+    return {"message": "Battle deleted successfully."}
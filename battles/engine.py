@@ -0,0 +1,91 @@
+import numpy as np
+
+# Per-class combat stats. Everything in the simulation is an array indexed by
+# class, so the cost of a round depends on the number of classes, not ships.
+SHIP_CLASSES = ("fighter", "bomber", "corvette", "frigate", "cruiser", "battleship", "carrier", "dreadnought")
+CLASS_INDEX = {name: i for i, name in enumerate(SHIP_CLASSES)}
+ATTACK = np.array([5.0, 12.0, 20.0, 45.0, 90.0, 250.0, 60.0, 900.0])
+HULL = np.array([20.0, 35.0, 80.0, 180.0, 400.0, 1100.0, 900.0, 4000.0])
+# EFFECTIVENESS[shooter, target] scales damage, e.g. bombers hit capital ships hard.
+EFFECTIVENESS = np.ones((len(SHIP_CLASSES), len(SHIP_CLASSES)))
+EFFECTIVENESS[CLASS_INDEX["fighter"], [CLASS_INDEX["bomber"], CLASS_INDEX["corvette"]]] = 2.0
+EFFECTIVENESS[CLASS_INDEX["bomber"], [CLASS_INDEX["cruiser"], CLASS_INDEX["battleship"], CLASS_INDEX["dreadnought"]]] = 2.5
+EFFECTIVENESS[CLASS_INDEX["frigate"], CLASS_INDEX["fighter"]] = 3.0
+EFFECTIVENESS[CLASS_INDEX["cruiser"], [CLASS_INDEX["corvette"], CLASS_INDEX["frigate"]]] = 2.0
+EFFECTIVENESS[CLASS_INDEX["carrier"], [CLASS_INDEX["bomber"], CLASS_INDEX["fighter"]]] = 2.0
+EFFECTIVENESS[CLASS_INDEX["dreadnought"], [CLASS_INDEX["fighter"], CLASS_INDEX["bomber"]]] = 0.25
+
+MAX_ROUNDS = 6
+
+
+def ships_to_counts(ships: dict) -> np.ndarray:
+    counts = np.zeros(len(SHIP_CLASSES), dtype=np.int64)
+    for name, count in ships.items():
+        if name not in CLASS_INDEX:
+            raise ValueError(f"Unknown ship class: {name}")
+        # bool passes isinstance(int); floats and strings would fail inside numpy with a TypeError.
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise ValueError(f"Ship count for {name} must be a non-negative integer")
+        counts[CLASS_INDEX[name]] = count
+    return counts
+
+
+def counts_to_ships(counts: np.ndarray) -> dict:
+    return {SHIP_CLASSES[i]: int(c) for i, c in enumerate(counts) if c}
+
+
+def _losses(rng: np.random.Generator, shooters: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    total = targets.sum()
+    if total == 0:
+        return np.zeros_like(targets)
+    # Shots spread over the target fleet in proportion to ship counts.
+    damage = (shooters * ATTACK) @ EFFECTIVENESS * (targets / total)
+    pool = targets * HULL
+    kill_chance = np.divide(damage, pool, out=np.zeros_like(damage), where=pool > 0)
+    return rng.binomial(targets, np.minimum(kill_chance, 1.0))
+
+
+def simulate(attacker_ships: dict, defender_ships: dict, seed: int, max_rounds: int = MAX_ROUNDS) -> dict:
+    rng = np.random.default_rng(seed)
+    attacker = ships_to_counts(attacker_ships)
+    defender = ships_to_counts(defender_ships)
+    attacker_losses = []
+    defender_losses = []
+
+    for _ in range(max_rounds):
+        if not attacker.any() or not defender.any():
+            break
+        # Both sides fire simultaneously, so losses are drawn from the pre-round fleets.
+        lost_by_defender = _losses(rng, attacker, defender)
+        lost_by_attacker = _losses(rng, defender, attacker)
+        defender = defender - lost_by_defender
+        attacker = attacker - lost_by_attacker
+        attacker_losses.append(lost_by_attacker.tolist())
+        defender_losses.append(lost_by_defender.tolist())
+
+    if attacker.any() and not defender.any():
+        winner = "attacker"
+    elif defender.any() and not attacker.any():
+        winner = "defender"
+    else:
+        winner = "draw"
+
+    return {
+        "winner": winner,
+        "attacker_remaining": counts_to_ships(attacker),
+        "defender_remaining": counts_to_ships(defender),
+        # Compact log: per-round loss vectors indexed by "classes" instead of one entry per ship.
+        "battle_log": {
+            "seed": seed,
+            "winner": winner,
+            "rounds": len(attacker_losses),
+            "classes": list(SHIP_CLASSES),
+            "attacker": {"initial": ships_to_counts(attacker_ships).tolist(), "losses": attacker_losses},
+            "defender": {"initial": ships_to_counts(defender_ships).tolist(), "losses": defender_losses},
+        },
+    }
+
+
+def simulate_many(battles: list) -> list:
+    # Entry point for worker processes: one pickled round trip per chunk of (attacker, defender, seed).
+    return [simulate(attacker, defender, seed) for attacker, defender, seed in battles]
@@ -0,0 +1,98 @@
+import os
+import struct
+
+import numpy as np
+import zstandard
+
+from battles.engine import SHIP_CLASSES
+from db.codec import dumps, loads
+
+# battle_log is stored in battles.battle_log_packed as one kind byte followed by the body.
+# Logs shaped exactly like simulate() output become a small binary record of their
+# loss vectors; anything else (hand-written logs from POST/PUT) is kept as JSON.
+ENGINE_LOG = 0x01
+JSON_LOG = 0x02
+# Set on the kind byte when the body is a zstd frame; tiny logs are left raw when that is smaller.
+ZSTD = 0x80
+BATTLE_LOG_ZSTD_LEVEL = int(os.getenv("BATTLE_LOG_ZSTD_LEVEL", "3"))
+
+WINNERS = ("attacker", "defender", "draw")
+ENGINE_KEYS = {"seed", "winner", "rounds", "classes", "attacker", "defender"}
+SIDE_KEYS = {"initial", "losses"}
+# seed, winner index, rounds, bytes per count. The counts follow as a (side, 1 + rounds, class)
+# array of unsigned ints, initial fleet first. ENGINE_LOG always means today's SHIP_CLASSES;
+# a change to the classes needs a new kind so older rows still decode.
+ENGINE_HEADER = struct.Struct("<qBBB")
+
+_compressor = zstandard.ZstdCompressor(level=BATTLE_LOG_ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def _engine_counts(log: dict):
+    # The log's counts as one array if it round-trips exactly through ENGINE_LOG, else None.
+    if log.keys() != ENGINE_KEYS or log["classes"] != list(SHIP_CLASSES) or log["winner"] not in WINNERS:
+        return None
+    seed, rounds = log["seed"], log["rounds"]
+    if type(seed) is not int or not -2 ** 63 <= seed < 2 ** 63 or type(rounds) is not int or not 0 <= rounds <= 255:
+        return None
+    rows = []
+    for side in (log["attacker"], log["defender"]):
+        if not isinstance(side, dict) or side.keys() != SIDE_KEYS or not isinstance(side["losses"], list):
+            return None
+        rows.append(side["initial"])
+        rows.extend(side["losses"])
+    if len(rows) != 2 * (rounds + 1):
+        return None
+    for row in rows:
+        if not isinstance(row, list) or len(row) != len(SHIP_CLASSES):
+            return None
+        for count in row:
+            if type(count) is not int or not 0 <= count < 2 ** 64:
+                return None
+    return np.array(rows, dtype=np.uint64)
+
+
+def pack_log(log: dict) -> bytes:
+    counts = _engine_counts(log)
+    if counts is not None:
+        dtype = np.min_scalar_type(int(counts.max()) if counts.size else 0).newbyteorder("<")
+        kind = ENGINE_LOG
+        body = ENGINE_HEADER.pack(log["seed"], WINNERS.index(log["winner"]), log["rounds"], dtype.itemsize)
+        body += counts.astype(dtype).tobytes()
+    else:
+        kind = JSON_LOG
+        body = dumps(log)
+    compressed = _compressor.compress(body)
+    if len(compressed) < len(body):
+        return bytes([kind | ZSTD]) + compressed
+    return bytes([kind]) + body
+
+
+def unpack_log(packed: bytes) -> dict:
+    kind, body = packed[0], packed[1:]
+    if kind & ZSTD:
+        body = _decompressor.decompress(body)
+        kind &= ~ZSTD
+    if kind == JSON_LOG:
+        return loads(body)
+    if kind != ENGINE_LOG:
+        raise ValueError(f"Unknown battle log encoding {kind:#04x}")
+    seed, winner, rounds, itemsize = ENGINE_HEADER.unpack_from(body)
+    counts = np.frombuffer(body, dtype=f"<u{itemsize}", offset=ENGINE_HEADER.size)
+    attacker, defender = counts.reshape(2, rounds + 1, len(SHIP_CLASSES)).tolist()
+    return {
+        "seed": seed,
+        "winner": WINNERS[winner],
+        "rounds": rounds,
+        "classes": list(SHIP_CLASSES),
+        "attacker": {"initial": attacker[0], "losses": attacker[1:]},
+        "defender": {"initial": defender[0], "losses": defender[1:]},
+    }
+
+
+def unpack_row(row: dict) -> dict:
+    # Rows written before battle_log_packed existed still carry their log as JSONB.
+    packed = row.pop("battle_log_packed")
+    if packed is not None:
+        row["battle_log"] = unpack_log(packed)
+    return row
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+
+from battles.log_codec import pack_log
+from db.bulk import copy_rows
+from db.pool import connection
+
+logger = logging.getLogger(__name__)
+
+# battles is range-partitioned on created_at (migration 008), one partition per unit: day, week or month.
+BATTLE_PARTITION_UNIT = os.getenv("BATTLE_PARTITION_UNIT", "month")
+# Partitions kept ready past the current one, so an insert never finds its range missing.
+BATTLE_PARTITIONS_AHEAD = int(os.getenv("BATTLE_PARTITIONS_AHEAD", "2"))
+# Partitions that stay in battles, the current one included. Older ones are detached; 0 keeps every partition.
+BATTLE_HOT_PARTITIONS = int(os.getenv("BATTLE_HOT_PARTITIONS", "0"))
+# Archive mode: a detached partition is rewritten with packed logs and attached to
+# battles_archive, where GET /battles/{id} still finds it. Without it the partition
+# is left as a standalone table for whoever exports or drops it.
+BATTLE_ARCHIVE = os.getenv("BATTLE_ARCHIVE", "true").lower() in ("1", "true", "yes")
+BATTLE_MAINTENANCE_INTERVAL = float(os.getenv("BATTLE_MAINTENANCE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = 1000
+# Session advisory lock key, so only one worker maintains partitions at a time.
+MAINTENANCE_LOCK_KEY = 7_190_019
+# How long the swap waits for locks on battles before giving up until the next run;
+# a queued exclusive lock would otherwise stall every battle query behind it.
+SWAP_LOCK_TIMEOUT = "5s"
+
+BATTLE_COLUMNS = [
+    "id", "attacker_id", "defender_id", "planet_id", "winner_id", "battle_log", "battle_log_packed", "created_at", "version", "updated_at",
+]
+
+# Partitions of a table with their bounds, parsed from the catalog's FOR VALUES FROM (...) TO (...).
+PARTITIONS_SQL = """
+    SELECT c.relname,
+           substring(pg_get_expr(c.relpartbound, c.oid) FROM 'FROM \\(''([^'']+)''\\)')::timestamp,
+           substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \\(''([^'']+)''\\)')::timestamp
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    ORDER BY 2
+"""
+
+
+async def ensure_partitions(conn, unit: str = BATTLE_PARTITION_UNIT, ahead: int = BATTLE_PARTITIONS_AHEAD) -> int:
+    async with conn.transaction():
+        cursor = await conn.execute(
+            "SELECT ensure_battle_partitions(%s, now()::timestamp, now()::timestamp + %s * ('1 ' || %s)::interval)",
+            (unit, ahead, unit),
+        )
+        return (await cursor.fetchone())[0]
+
+
+async def list_partitions(conn, table: str = "battles"):
+    cursor = await conn.execute(PARTITIONS_SQL, (table,))
+    return await cursor.fetchall()
+
+
+async def cold_partitions(conn, unit: str = BATTLE_PARTITION_UNIT, hot: int = BATTLE_HOT_PARTITIONS):
+    # Partitions that ended before the oldest of the `hot` most recent units began.
+    cursor = await conn.execute(
+        "SELECT date_trunc(%s, now()::timestamp) - %s * ('1 ' || %s)::interval",
+        (unit, max(hot - 1, 0), unit),
+    )
+    cutoff = (await cursor.fetchone())[0]
+    return [(name, lower, upper) for name, lower, upper in await list_partitions(conn) if upper <= cutoff]
+
+
+async def detach_partition(conn, name: str):
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+        await conn.execute(f'ALTER TABLE battles DETACH PARTITION "{name}"')
+
+
+async def _copy_packed(conn, name: str, target: str):
+    # Copies the partition into target in id order, packing any JSONB battle_log on the way.
+    last_id = None
+    copied = packed = 0
+    while True:
+        async with conn.transaction():
+            cursor = await conn.execute(
+                f'SELECT {", ".join(BATTLE_COLUMNS)} FROM "{name}"'
+                + (" WHERE id > %s" if last_id else "") + " ORDER BY id LIMIT %s",
+                (last_id, ARCHIVE_BATCH_SIZE) if last_id else (ARCHIVE_BATCH_SIZE,),
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                return copied, packed
+            batch = []
+            for battle_id, attacker_id, defender_id, planet_id, winner_id, log, log_packed, created_at, version, updated_at in rows:
+                if log is not None:
+                    log, log_packed = None, pack_log(log)
+                    packed += 1
+                batch.append((battle_id, attacker_id, defender_id, planet_id, winner_id, log, log_packed, created_at, version, updated_at))
+            await copy_rows(conn, f'"{target}"', BATTLE_COLUMNS, batch)
+        copied += len(rows)
+        last_id = rows[-1][0]
+        # Packing is CPU work on the event loop; let requests in between batches.
+        await asyncio.sleep(0)
+
+
+async def archive_partition(conn, name: str, lower, upper):
+    # Rewrites a cold partition packed into a new table while it is still attached and
+    # readable, then swaps it into battles_archive in one short transaction. Rows written
+    # to the partition during the copy abort the swap; the next run starts over.
+    staging = f"{name}_packed"
+    async with conn.transaction():
+        await conn.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        await conn.execute(f'CREATE TABLE "{staging}" (LIKE battles_archive INCLUDING DEFAULTS)')
+        # Proves the range to ATTACH PARTITION, which then skips scanning the table.
+        # DDL takes no bind parameters; the bounds are timestamps read back from the catalog.
+        await conn.execute(
+            f'ALTER TABLE "{staging}" ADD CONSTRAINT "{name}_range" '
+            f"CHECK (created_at >= '{lower}' AND created_at < '{upper}')"
+        )
+        cursor = await conn.execute(f'SELECT count(*), max(updated_at) FROM "{name}"')
+        snapshot = await cursor.fetchone()
+    try:
+        copied, packed = await _copy_packed(conn, name, staging)
+        async with conn.transaction():
+            await conn.execute(f'ALTER TABLE "{staging}" ADD PRIMARY KEY (id, created_at)')
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+            # Stop writes to the partition first; reads of it and of every other partition go on.
+            await conn.execute(f'LOCK TABLE "{name}" IN SHARE MODE')
+            cursor = await conn.execute(f'SELECT count(*), max(updated_at) FROM "{name}"')
+            if await cursor.fetchone() != snapshot:
+                raise RuntimeError(f"{name} changed while it was being archived")
+            await conn.execute(f'ALTER TABLE battles DETACH PARTITION "{name}"')
+            await conn.execute(f'DROP TABLE "{name}"')
+            await conn.execute(f'ALTER TABLE "{staging}" RENAME TO "{name}"')
+            await conn.execute(f'ALTER INDEX "{staging}_pkey" RENAME TO "{name}_pkey"')
+            await conn.execute(
+                f'ALTER TABLE battles_archive ATTACH PARTITION "{name}" '
+                f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+            )
+    except Exception:
+        await conn.rollback()
+        async with conn.transaction():
+            await conn.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        raise
+    logger.info("Archived battle partition %s: %s rows, %s logs packed", name, copied, packed)
+    return copied
+
+
+async def maintain_partitions(conn, hot: int = BATTLE_HOT_PARTITIONS, archive: bool = BATTLE_ARCHIVE):
+    # Returns False when another worker holds the maintenance lock.
+    cursor = await conn.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+    if not (await cursor.fetchone())[0]:
+        await conn.rollback()
+        return False
+    await conn.commit()
+    try:
+        created = await ensure_partitions(conn)
+        if created:
+            logger.info("Created %s battle partitions", created)
+        if hot > 0:
+            for name, lower, upper in await cold_partitions(conn, hot=hot):
+                await conn.commit()
+                if archive:
+                    await archive_partition(conn, name, lower, upper)
+                else:
+                    await detach_partition(conn, name)
+                    logger.info("Detached battle partition %s", name)
+    finally:
+        await conn.rollback()
+        await conn.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_KEY,))
+        await conn.commit()
+    return True
+
+
+_maintenance_task = None
+
+
+async def _maintain():
+    while True:
+        try:
+            async with connection() as conn:
+                await maintain_partitions(conn)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Battle partition maintenance failed, retrying in %s s", BATTLE_MAINTENANCE_INTERVAL)
+        await asyncio.sleep(BATTLE_MAINTENANCE_INTERVAL)
+
+
+async def start_battle_partitions():
+    global _maintenance_task
+    # Partitions for the coming units exist before the first request; archiving runs in the background.
+    async with connection() as conn:
+        await ensure_partitions(conn)
+    _maintenance_task = asyncio.create_task(_maintain())
+
+
+async def stop_battle_partitions():
+    global _maintenance_task
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
@@ -0,0 +1,123 @@
+"""Goodput past saturation with admission control off and on.
+
+    python -m benchmarks.admission --concurrency 20 100 400 --duration 10
+
+Starts two uvicorn servers on --port and --port + 1, with
+ADMISSION_CONTROL=false and true, against DATABASE_URL. At each level N
+clients spend --duration seconds sending a mix of list pages
+(GET /planets/?limit=--page-size, a --list-share of requests) and point
+reads of rows seeded through the API. A client gives up on a request
+after --timeout seconds, as a real one would, and backs off --backoff
+seconds after a 429 or 503.
+
+Reports, per class, successful responses per second and their p50/p99,
+how many were shed and how many failed or timed out. Without admission
+control, queued work piles up in front of the pool until requests time out
+after the server has spent effort on them; with it, the excess is turned
+away up front and goodput stays at what the database can serve. Point
+reads keep their own slots, so a storm of list scans cannot starve them.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from benchmarks.common import percentile, start_server, wait_ready
+from benchmarks.load import seed
+
+SETTINGS = {"off": "false", "on": "true"}
+
+
+async def run_level(base_url, paths, args, concurrency):
+    results = {name: {"latencies": [], "shed": 0, "failed": 0} for name in ("list", "point")}
+    deadline = time.perf_counter() + args.duration
+    rng = random.Random(args.seed)
+
+    async def worker():
+        # A client, and connection, per simulated user: one shared httpx pool spends more CPU
+        # scanning its own idle connections than the server does once clients back off.
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+            await run_worker(client)
+
+    async def run_worker(client):
+        while time.perf_counter() < deadline:
+            if rng.random() < args.list_share:
+                name, path = "list", f"/planets/?limit={args.page_size}"
+            else:
+                name, path = "point", rng.choice(paths)
+            result = results[name]
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+            except httpx.HTTPError:
+                result["failed"] += 1
+                continue
+            if response.status_code in (429, 503):
+                result["shed"] += 1
+                await asyncio.sleep(args.backoff)
+            elif response.status_code >= 400:
+                result["failed"] += 1
+            else:
+                result["latencies"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    for result in results.values():
+        latencies = sorted(result.pop("latencies"))
+        result["ok_rps"] = len(latencies) / elapsed
+        result["p50_ms"] = percentile(latencies, 50) * 1000
+        result["p99_ms"] = percentile(latencies, 99) * 1000
+    return results
+
+
+async def main(args):
+    ports = {name: args.port + i for i, name in enumerate(SETTINGS)}
+    servers = [start_server(ports[name], ADMISSION_CONTROL=enabled) for name, enabled in SETTINGS.items()]
+    rows = []
+    counters = {}
+    try:
+        for name, port in ports.items():
+            base_url = f"http://127.0.0.1:{port}"
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+                await wait_ready(client)
+                paths = await seed(client, args.planets)
+                for concurrency in args.concurrency:
+                    # Let the previous level's abandoned requests drain first.
+                    await asyncio.sleep(args.timeout)
+                    rows.append((name, concurrency, await run_level(base_url, paths, args, concurrency)))
+                if name == "on":
+                    counters = (await client.get("/admission/stats")).json()
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+
+    print(f"{'admission':>9} {'clients':>8} {'class':>6} {'ok/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'shed':>7} {'failed':>7}")
+    for name, concurrency, results in rows:
+        for route_class, r in results.items():
+            print(
+                f"{name:>9} {concurrency:>8} {route_class:>6} {r['ok_rps']:>9.1f} {r['p50_ms']:>9.1f}"
+                f" {r['p99_ms']:>9.1f} {r['shed']:>7} {r['failed']:>7}"
+            )
+    print()
+    print("GET /admission/stats after the run:")
+    print(json.dumps(counters, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--list-share", type=float, default=0.5, help="fraction of requests that are list pages")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=5.0, help="client timeout per request, seconds")
+    parser.add_argument("--backoff", type=float, default=0.1, help="seconds a client waits after a 429 or 503")
+    parser.add_argument("--planets", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
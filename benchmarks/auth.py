@@ -0,0 +1,133 @@
+"""Authenticated reads, alone and under a login storm, per auth setup.
+
+    python -m benchmarks.auth --users 50 --readers 20 --reads 5000 --logins 200
+
+Starts one uvicorn server per mode on --port, --port + 1, ... with
+AUTH_REQUIRED=true and BCRYPT_ROUNDS=--bcrypt-rounds:
+
+    thread  bcrypt on a thread (AUTH_HASH_WORKERS=0), every token verified
+            and its user's revocation cutoff read per request
+    pool    bcrypt in the process pool, no token cache
+    cached  bcrypt in the process pool, token and revocation caches on
+
+Each server gets --users accounts through POST /auth/signup. --readers
+clients then send --reads GET /users/{id} with their bearer token, once on
+their own and once while --login-concurrency clients send --logins
+POST /auth/login. Reports read req/s and latency for both runs, and
+logins/s plus how many logins were shed with a 503. Needs DATABASE_URL
+with migrations applied.
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+import httpx
+
+from benchmarks.common import start_server, throughput, wait_ready
+
+MODES = {
+    "thread": {"AUTH_HASH_WORKERS": "0", "AUTH_TOKEN_CACHE_SIZE": "0"},
+    "pool": {"AUTH_TOKEN_CACHE_SIZE": "0"},
+    "cached": {},
+}
+PASSWORD = "correct horse battery staple"
+SECRET_KEY = "auth-benchmark-signing-key-not-for-production"
+
+
+async def signup(client, users):
+    suffix = uuid4().hex[:8]
+    accounts = []
+    for i in range(users):
+        response = await client.post("/auth/signup", json={
+            "username": f"auth_{suffix}_{i}",
+            "email": f"auth_{suffix}_{i}@example.com",
+            "password": PASSWORD,
+        })
+        response.raise_for_status()
+        body = response.json()
+        accounts.append((body["id"], body["username"], body["access_token"]))
+    return accounts
+
+
+async def read(client, accounts, readers, reads):
+    latencies = []
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < reads:
+            user_id, _, token = accounts[next_index % len(accounts)]
+            next_index += 1
+            started = time.perf_counter()
+            response = await client.get(f"/users/{user_id}", headers={"Authorization": f"Bearer {token}"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(readers)))
+    return throughput(latencies, time.perf_counter() - started)
+
+
+async def storm(client, accounts, concurrency, logins):
+    done = shed = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal done, shed, next_index
+        while next_index < logins:
+            _, username, _ = accounts[next_index % len(accounts)]
+            next_index += 1
+            response = await client.post("/auth/login", json={"username": username, "password": PASSWORD})
+            if response.status_code == 503:
+                shed += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+                continue
+            response.raise_for_status()
+            done += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"logins_per_s": done / (time.perf_counter() - started), "shed": shed}
+
+
+async def main(args):
+    ports = {name: args.port + i for i, name in enumerate(MODES)}
+    shared = {"AUTH_REQUIRED": "true", "BCRYPT_ROUNDS": str(args.bcrypt_rounds), "SECRET_KEY": SECRET_KEY}
+    servers = [start_server(ports[name], **shared, **settings) for name, settings in MODES.items()]
+    limits = httpx.Limits(max_connections=args.readers + args.login_concurrency)
+    results = {}
+    try:
+        for name, port in ports.items():
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+                await wait_ready(client)
+                accounts = await signup(client, args.users)
+                alone = await read(client, accounts, args.readers, args.reads)
+                during, logins = await asyncio.gather(
+                    read(client, accounts, args.readers, args.reads),
+                    storm(client, accounts, args.login_concurrency, args.logins),
+                )
+                results[name] = (alone, during, logins)
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+
+    print(f"{'mode':>7} {'reads':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'logins/s':>9} {'shed':>6}")
+    for name, (alone, during, logins) in results.items():
+        print(f"{name:>7} {'alone':>7} {alone['rps']:>9.1f} {alone['p50_ms']:>8.2f} {alone['p99_ms']:>8.2f}")
+        print(f"{name:>7} {'storm':>7} {during['rps']:>9.1f} {during['p50_ms']:>8.2f} {during['p99_ms']:>8.2f}"
+              f" {logins['logins_per_s']:>9.1f} {logins['shed']:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=5000, help="GET /users/{id} per run")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--login-concurrency", type=int, default=50)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+"""Throughput of batch battle resolution as the worker process count grows.
+
+    python -m benchmarks.battle_batch --battles 50000 --workers 1 2 4 8
+
+Runs battles.batch.run_simulations on a fixed set of random battles for each
+worker count, reports battles/sec, and checks every run produced exactly the
+same results as the single-worker run. Needs no database.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from battles.batch import run_simulations
+from battles.engine import SHIP_CLASSES
+
+
+def random_fleet(rng: random.Random, max_ships: int):
+    classes = rng.sample(SHIP_CLASSES, rng.randint(1, len(SHIP_CLASSES)))
+    return {name: rng.randint(1, max_ships) for name in classes}
+
+
+async def measure(jobs, workers):
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Warm the pool so process start-up isn't counted.
+        await run_simulations(jobs[:workers * 100], executor, workers)
+        started = time.perf_counter()
+        results = await run_simulations(jobs, executor, workers)
+        return time.perf_counter() - started, results
+    finally:
+        executor.shutdown()
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    jobs = [(random_fleet(rng, args.max_ships), random_fleet(rng, args.max_ships), i) for i in range(args.battles)]
+    baseline = None
+    print(f"{'workers':>8} {'battles/s':>11} {'speedup':>8} {'identical':>10}")
+    for workers in args.workers:
+        elapsed, results = await measure(jobs, workers)
+        rate = len(jobs) / elapsed
+        if baseline is None:
+            baseline = (rate, results)
+        print(f"{workers:>8} {rate:>11.0f} {rate / baseline[0]:>7.2f}x {str(results == baseline[1]):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--battles", type=int, default=50000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, multiprocessing.cpu_count()])
+    parser.add_argument("--max-ships", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,51 @@
+"""Timing of battles.engine.simulate across fleet sizes and class mixes.
+
+    python -m benchmarks.battle_engine --sizes 1000 100000 1000000 --repeat 200
+
+Needs no database; it calls the engine directly.
+"""
+import argparse
+import time
+
+from battles.engine import SHIP_CLASSES, simulate
+from benchmarks.common import summarize
+
+MIXES = {
+    "single": {"fighter": 1.0},
+    "balanced": {name: 1 / len(SHIP_CLASSES) for name in SHIP_CLASSES},
+    "swarm": {"fighter": 0.7, "bomber": 0.25, "corvette": 0.05},
+    "capital": {"cruiser": 0.4, "battleship": 0.4, "carrier": 0.15, "dreadnought": 0.05},
+}
+
+
+def fleet(size, mix):
+    return {name: max(1, int(size * share)) for name, share in mix.items()}
+
+
+def main(args):
+    print(f"{'ships/side':>11} {'attacker':>9} {'defender':>9} {'mean ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        for attacker_mix, defender_mix in args.pairs:
+            attacker = fleet(size, MIXES[attacker_mix])
+            defender = fleet(size, MIXES[defender_mix])
+            timings = []
+            for seed in range(args.repeat):
+                started = time.perf_counter()
+                simulate(attacker, defender, seed)
+                timings.append(time.perf_counter() - started)
+            mean, p99 = summarize(timings)
+            print(f"{size:>11} {attacker_mix:>9} {defender_mix:>9} {mean:>9.3f} {p99:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--pairs",
+        type=lambda value: tuple(value.split(":")),
+        nargs="+",
+        default=[("single", "single"), ("balanced", "balanced"), ("swarm", "capital"), ("capital", "swarm")],
+        help="attacker:defender mixes, from " + ", ".join(MIXES),
+    )
+    main(parser.parse_args())
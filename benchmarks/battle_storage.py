@@ -0,0 +1,186 @@
+"""Battle storage before and after migration 008: size and GET /battles/{id} latency.
+
+    python -m benchmarks.battle_storage --battles 1000000 --days 365 --hot 2
+
+Loads the same --battles battles, spread over the last --days days, into two
+scratch schemas:
+
+    flat         the old layout, one table with battle_log as JSONB
+    partitioned  battles partitioned by BATTLE_PARTITION_UNIT with packed logs,
+                 then maintained like a worker does with BATTLE_HOT_PARTITIONS=--hot,
+                 which moves every older partition to battles_archive
+
+Logs come from the battle engine. Reports the size of the table list routes
+scan and of everything stored, then times --reads lookups by id of recent
+and of old battles, through the read_battle route for the partitioned
+layout. Both schemas are dropped at the end unless --keep. Needs
+DATABASE_URL with migrations applied.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import timedelta
+from uuid import UUID
+
+import psycopg
+from fastapi import Response
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from battles.endpoints import read_battle
+from battles.engine import SHIP_CLASSES, simulate
+from battles.log_codec import pack_log
+from battles.partitions import BATTLE_PARTITION_UNIT, maintain_partitions
+from benchmarks.common import summarize
+from db.codec import register_json
+from db.pool import DATABASE_URL
+
+FLAT = "battle_bench_flat"
+PARTITIONED = "battle_bench_partitioned"
+COLUMNS = ("id", "attacker_id", "defender_id", "planet_id", "created_at")
+LOG_POOL = 1000
+LOAD_BATCH_SIZE = 50000
+
+# A partitioned table's own size is zero; its partitions hold the rows.
+SIZE_SQL = "SELECT coalesce(sum(pg_total_relation_size(relid)), 0) FROM pg_partition_tree(%s::regclass)"
+
+
+def random_id(rng: random.Random) -> str:
+    return str(UUID(int=rng.getrandbits(128), version=4))
+
+
+async def create_schemas(conn):
+    for schema in (FLAT, PARTITIONED):
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {schema}")
+    await conn.execute(f"""
+        CREATE TABLE {FLAT}.battles (
+            id UUID PRIMARY KEY, attacker_id UUID, defender_id UUID, planet_id UUID, battle_log JSONB,
+            created_at TIMESTAMP NOT NULL, version BIGINT NOT NULL DEFAULT 1, updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    await conn.execute(f"CREATE INDEX ON {FLAT}.battles (updated_at)")
+    # Same shape as migration 008, without the foreign keys so neither copy needs users or planets.
+    await conn.execute(f"""
+        CREATE TABLE {PARTITIONED}.battles (LIKE public.battles INCLUDING DEFAULTS, PRIMARY KEY (id, created_at))
+        PARTITION BY RANGE (created_at)
+    """)
+    await conn.execute(f"CREATE INDEX ON {PARTITIONED}.battles (updated_at)")
+    await conn.execute(f"""
+        CREATE TABLE {PARTITIONED}.battles_archive (LIKE public.battles INCLUDING DEFAULTS, PRIMARY KEY (id, created_at))
+        PARTITION BY RANGE (created_at)
+    """)
+    await conn.commit()
+
+
+async def load(conn, table, log_column, logs, rows):
+    started = time.perf_counter()
+    for start in range(0, len(rows), LOAD_BATCH_SIZE):
+        async with conn.cursor() as cursor:
+            async with cursor.copy(f"COPY {table} ({', '.join(COLUMNS)}, {log_column}) FROM STDIN") as copy:
+                for row in rows[start:start + LOAD_BATCH_SIZE]:
+                    await copy.write_row((*row[:-1], logs[row[-1]]))
+        await conn.commit()
+    await conn.execute(f"ANALYZE {table}")
+    await conn.commit()
+    return time.perf_counter() - started
+
+
+async def time_reads(read, ids):
+    timings = []
+    for battle_id in ids:
+        started = time.perf_counter()
+        await read(battle_id)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def main(args):
+    register_json()
+    rng = random.Random(args.seed)
+
+    def fleet():
+        return {name: rng.randint(1, 10 ** 4) for name in rng.sample(SHIP_CLASSES, 3)}
+
+    log_pool = [simulate(fleet(), fleet(), i)["battle_log"] for i in range(LOG_POOL)]
+
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        now = (await (await conn.execute("SELECT now()::timestamp")).fetchone())[0]
+        rows = [
+            (random_id(rng), random_id(rng), random_id(rng), random_id(rng),
+             now - timedelta(seconds=rng.uniform(0, args.days * 86400)), rng.randrange(LOG_POOL))
+            for _ in range(args.battles)
+        ]
+        await create_schemas(conn)
+        try:
+            seconds = await load(conn, f"{FLAT}.battles", "battle_log", [Jsonb(log) for log in log_pool], rows)
+            print(f"loaded {args.battles} battles into {FLAT} in {seconds:.1f}s")
+
+            await conn.execute(f"SET search_path TO {PARTITIONED}, public")
+            await conn.execute(
+                "SELECT ensure_battle_partitions(%s, %s, %s)", (BATTLE_PARTITION_UNIT, now - timedelta(days=args.days), now),
+            )
+            await conn.commit()
+            seconds = await load(conn, "battles", "battle_log_packed", [pack_log(log) for log in log_pool], rows)
+            print(f"loaded {args.battles} battles into {PARTITIONED} in {seconds:.1f}s")
+            started = time.perf_counter()
+            await maintain_partitions(conn, hot=args.hot, archive=True)
+            print(f"archived all but {args.hot} partitions in {time.perf_counter() - started:.1f}s")
+
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT pg_total_relation_size(%s::regclass)", (f"{FLAT}.battles",))
+                flat_size = (await cursor.fetchone())[0]
+                await cursor.execute(SIZE_SQL, ("battles",))
+                hot_size = (await cursor.fetchone())[0]
+                await cursor.execute(SIZE_SQL, ("battles_archive",))
+                archive_size = (await cursor.fetchone())[0]
+                await cursor.execute("SELECT id::text FROM battles ORDER BY random() LIMIT %s", (args.reads,))
+                recent = [row[0] for row in await cursor.fetchall()]
+                await cursor.execute("SELECT id::text FROM battles_archive ORDER BY random() LIMIT %s", (args.reads,))
+                old = [row[0] for row in await cursor.fetchall()]
+            await conn.commit()
+
+            mb = 1024 * 1024
+            print()
+            print(f"{'layout':>12} {'list scans MB':>14} {'total MB':>9}")
+            print(f"{'flat':>12} {flat_size / mb:>14.1f} {flat_size / mb:>9.1f}")
+            print(f"{'partitioned':>12} {hot_size / mb:>14.1f} {(hot_size + archive_size) / mb:>9.1f}")
+
+            async def read_flat(battle_id):
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    await cursor.execute(
+                        f"SELECT id, attacker_id, defender_id, planet_id, battle_log, version, updated_at FROM {FLAT}.battles WHERE id = %s",
+                        (battle_id,),
+                    )
+                    return await cursor.fetchone()
+
+            async def read_partitioned(battle_id):
+                return await read_battle(battle_id, Response(), None, conn)
+
+            print()
+            print(f"{'read_battle':>12} {'battles':>8} {'reads':>6} {'mean ms':>8} {'p99 ms':>8}")
+            for label, ids in (("recent", recent), ("old", old)):
+                if not ids:
+                    continue
+                for layout, read in (("flat", read_flat), ("partitioned", read_partitioned)):
+                    mean, p99 = summarize(await time_reads(read, ids))
+                    print(f"{layout:>12} {label:>8} {len(ids):>6} {mean:>8.3f} {p99:>8.3f}")
+                await conn.commit()
+        finally:
+            await conn.rollback()
+            if not args.keep:
+                for schema in (FLAT, PARTITIONED):
+                    await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+                await conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--battles", type=int, default=1000000)
+    parser.add_argument("--days", type=float, default=365, help="battles are spread over this many past days")
+    parser.add_argument("--hot", type=int, default=2, help="partitions left in battles, the current one included")
+    parser.add_argument("--reads", type=int, default=2000, help="lookups by id per case")
+    parser.add_argument("--keep", action="store_true", help="leave both scratch schemas in place")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
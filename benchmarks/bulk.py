@@ -0,0 +1,86 @@
+"""Rows/sec of the bulk write routes against their single-row counterparts.
+
+    python -m benchmarks.bulk --base-url http://127.0.0.1:8000 --rows 5000 --batch-size 1000
+
+Single-row writes are issued with --concurrency requests in flight, the way
+a game tick fanning out over HTTP would. Bulk writes send --batch-size items
+per request, one request at a time.
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+import httpx
+
+
+async def setup(client):
+    suffix = uuid4().hex[:8]
+    user = (await client.post("/users/", json={
+        "username": f"bulk_{suffix}",
+        "email": f"bulk_{suffix}@example.com",
+        "password": "x",
+    })).json()
+    planet = (await client.post("/planets/", json={
+        "name": "Bulk bench",
+        "owner_id": user["id"],
+        "resources": {},
+        "discovered_at": "2024-01-01T00:00:00",
+        "claimed_at": "2024-01-01T00:00:00",
+    })).json()
+    building = (await client.post("/buildings/", json={
+        "name": f"Bench mine {suffix}",
+        "type": "production",
+        "resource_cost": {"metal": 10},
+    })).json()
+    return user["id"], planet["id"], building["id"]
+
+
+def payloads(kind, rows, user_id, planet_id, building_id):
+    if kind == "user_fleets":
+        return [{"user_id": user_id, "planet_id": planet_id, "ships": {"fighter": i % 50, "bomber": i % 7}} for i in range(rows)]
+    if kind == "user_buildings":
+        return [{"user_id": user_id, "building_id": building_id, "planet_id": planet_id, "level": 1 + i % 10} for i in range(rows)]
+    return [{"attacker_id": user_id, "defender_id": user_id, "planet_id": planet_id, "battle_log": {"rounds": i % 5}} for i in range(rows)]
+
+
+async def single(client, kind, items, concurrency):
+    queue = list(items)
+
+    async def worker():
+        while queue:
+            response = await client.post(f"/{kind}/", json=queue.pop())
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(items) / (time.perf_counter() - started)
+
+
+async def bulk(client, kind, items, batch_size):
+    started = time.perf_counter()
+    for i in range(0, len(items), batch_size):
+        response = await client.post(f"/{kind}/bulk", json=items[i:i + batch_size])
+        response.raise_for_status()
+    return len(items) / (time.perf_counter() - started)
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+        user_id, planet_id, building_id = await setup(client)
+        print(f"{'route':<16} {'single rows/s':>14} {'bulk rows/s':>12} {'speedup':>8}")
+        for kind in args.kinds:
+            items = payloads(kind, args.rows, user_id, planet_id, building_id)
+            single_rate = await single(client, kind, items, args.concurrency)
+            bulk_rate = await bulk(client, kind, items, args.batch_size)
+            print(f"{kind:<16} {single_rate:>14.0f} {bulk_rate:>12.0f} {bulk_rate / single_rate:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--kinds", nargs="+", default=["user_fleets", "user_buildings", "battles"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,49 @@
+"""Helpers shared by the benchmarks: latency percentiles and uvicorn servers."""
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(timings):
+    # (mean, p99) in milliseconds; sorts timings in place.
+    timings.sort()
+    return sum(timings) / len(timings) * 1000, percentile(timings, 99) * 1000
+
+
+def throughput(latencies, elapsed):
+    # Requests per second over elapsed seconds, with p50 and p99 latency in milliseconds; sorts latencies in place.
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def start_server(port, **settings):
+    # One uvicorn worker against DATABASE_URL, with settings as extra environment variables.
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, **settings),
+    )
+
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server at {client.base_url} did not start")
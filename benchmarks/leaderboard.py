@@ -0,0 +1,183 @@
+"""Leaderboard reads at scale, and what keeping scores current costs writes.
+
+    python -m benchmarks.leaderboard --users 1000000 --queries 2000 --writes 2000
+
+Reads: fills a RankIndex with --users random scores, as a worker holds
+them, and times top-100 pages at random offsets, "my rank" lookups and
+score updates. The same scores go into a scratch table with an index on
+score, for the SQL answers: ORDER BY ... LIMIT 100 OFFSET and
+count(*) of higher scores. Also times refresh_leaderboard_scores(), the
+full aggregation ranking users took without the summary table, on the
+seeded tables.
+
+Writes: times --writes single-fleet ship updates, one bulk COPY of
+--bulk fleets and --writes battle inserts against the seeded data, with
+the leaderboard triggers from migration 010 on and off. Each mode runs
+inside a transaction that is rolled back, so the data is left as it was.
+Needs DATABASE_URL with migrations applied and benchmarks.seed data.
+"""
+import argparse
+import asyncio
+import random
+import resource
+import time
+from uuid import uuid4
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from battles.engine import SHIP_CLASSES
+from benchmarks.common import summarize
+from db.codec import register_json
+from db.pool import DATABASE_URL
+from leaderboards.ranking import RankIndex
+
+SCRATCH = "leaderboard_bench"
+PAGE_SIZE = 100
+TRIGGERS = {
+    "user_fleets": ("user_fleets_leaderboard_insert", "user_fleets_leaderboard_update", "user_fleets_leaderboard_delete"),
+    "battles": ("battles_leaderboard_insert", "battles_leaderboard_update", "battles_leaderboard_delete"),
+}
+
+
+def time_calls(fn, args):
+    timings = []
+    for arg in args:
+        started = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def time_queries(conn, sql, params):
+    timings = []
+    for param in params:
+        started = time.perf_counter()
+        await (await conn.execute(sql, param)).fetchall()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def reads(conn, args, rng):
+    scores = {rng.getrandbits(128): int(rng.paretovariate(1.2) * 100) for _ in range(args.users)}
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index = RankIndex()
+    index.replace_all(dict(scores))
+    build = time.perf_counter() - started
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+    print(f"RankIndex of {args.users} users built in {build:.2f}s, max RSS +{grown:.0f} MB")
+
+    user_ids = list(scores)
+    offsets = [rng.randrange(len(user_ids)) for _ in range(args.queries)]
+    sample = [rng.choice(user_ids) for _ in range(args.queries)]
+    rows = {}
+    rows["top"] = summarize(time_calls(lambda offset: index.top(PAGE_SIZE, offset), offsets))
+    rows["rank"] = summarize(time_calls(index.rank, sample))
+    rows["update"] = summarize(time_calls(lambda user_id: index.set(user_id, index.scores[user_id] + rng.randint(-50, 50)), sample))
+
+    await conn.execute(f"DROP TABLE IF EXISTS {SCRATCH}")
+    await conn.execute(f"CREATE TABLE {SCRATCH} (user_id UUID PRIMARY KEY, score BIGINT NOT NULL)")
+    async with conn.cursor() as cursor:
+        async with cursor.copy(f"COPY {SCRATCH} (user_id, score) FROM STDIN") as copy:
+            for user_id, score in scores.items():
+                await copy.write_row((f"{user_id:032x}", score))
+    await conn.execute(f"CREATE INDEX ON {SCRATCH} (score DESC, user_id)")
+    await conn.execute(f"ANALYZE {SCRATCH}")
+    await conn.commit()
+    try:
+        rows["sql top"] = summarize(await time_queries(
+            conn, f"SELECT user_id, score FROM {SCRATCH} ORDER BY score DESC, user_id LIMIT {PAGE_SIZE} OFFSET %s",
+            [(offset,) for offset in offsets[:args.sql_queries]],
+        ))
+        rows["sql rank"] = summarize(await time_queries(
+            conn, f"SELECT count(*) + 1 FROM {SCRATCH} WHERE score > (SELECT score FROM {SCRATCH} WHERE user_id = %s)",
+            [(f"{user_id:032x}",) for user_id in sample[:args.sql_queries]],
+        ))
+    finally:
+        await conn.rollback()
+        await conn.execute(f"DROP TABLE IF EXISTS {SCRATCH}")
+        await conn.commit()
+
+    started = time.perf_counter()
+    await conn.execute("SELECT refresh_leaderboard_scores()")
+    refresh = time.perf_counter() - started
+    await conn.rollback()
+
+    print()
+    print(f"{'read':>10} {'mean ms':>9} {'p99 ms':>9}")
+    for name, (mean, p99) in rows.items():
+        print(f"{name:>10} {mean:>9.4f} {p99:>9.4f}")
+    print(f"{'full scan':>10} {refresh * 1000:>9.1f}           every user's scores aggregated from the game tables")
+
+
+async def writes(conn, args, rng, triggers_on):
+    # Everything here is rolled back, the trigger switch included.
+    if not triggers_on:
+        for table, names in TRIGGERS.items():
+            for name in names:
+                await conn.execute(f"ALTER TABLE {table} DISABLE TRIGGER {name}")
+    cursor = await conn.execute("SELECT id, user_id, planet_id FROM user_fleets ORDER BY random() LIMIT %s", (args.writes,))
+    fleets = await cursor.fetchall()
+
+    def ships():
+        return Jsonb({name: rng.randint(1, 10 ** 4) for name in rng.sample(SHIP_CLASSES, 3)})
+
+    results = {}
+    timings = []
+    for fleet_id, _, _ in fleets:
+        started = time.perf_counter()
+        await conn.execute(
+            "UPDATE user_fleets SET ships = %s, version = version + 1, updated_at = now() WHERE id = %s", (ships(), fleet_id),
+        )
+        timings.append(time.perf_counter() - started)
+    results["fleet update"] = summarize(timings)
+
+    started = time.perf_counter()
+    async with conn.cursor() as cursor:
+        async with cursor.copy("COPY user_fleets (id, user_id, planet_id, ships) FROM STDIN") as copy:
+            for i in range(args.bulk):
+                _, user_id, planet_id = fleets[i % len(fleets)]
+                await copy.write_row((uuid4(), user_id, planet_id, ships()))
+    results[f"copy {args.bulk}"] = ((time.perf_counter() - started) * 1000, None)
+
+    timings = []
+    for i, (_, user_id, planet_id) in enumerate(fleets):
+        defender_id = fleets[-1 - i][1]
+        started = time.perf_counter()
+        await conn.execute(
+            "INSERT INTO battles (id, attacker_id, defender_id, planet_id, winner_id) VALUES (%s, %s, %s, %s, %s)",
+            (uuid4(), user_id, defender_id, planet_id, user_id),
+        )
+        timings.append(time.perf_counter() - started)
+    results["battle insert"] = summarize(timings)
+    await conn.rollback()
+    return results
+
+
+async def main(args):
+    register_json()
+    rng = random.Random(args.seed)
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        await reads(conn, args, rng)
+        results = {}
+        for label, triggers_on in (("off", False), ("on", True)):
+            results[label] = await writes(conn, args, random.Random(args.seed), triggers_on)
+
+    print()
+    print(f"{'write':>14} {'triggers':>9} {'mean ms':>9} {'p99 ms':>9}")
+    for name in results["on"]:
+        for label in ("off", "on"):
+            mean, p99 = results[label][name]
+            print(f"{name:>14} {label:>9} {mean:>9.3f} {'-' if p99 is None else f'{p99:.3f}':>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000, help="in-memory reads and updates per case")
+    parser.add_argument("--sql-queries", type=int, default=200, help="SQL reads per case")
+    parser.add_argument("--writes", type=int, default=2000, help="fleet updates and battle inserts per mode")
+    parser.add_argument("--bulk", type=int, default=10000, help="fleets in the COPY")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
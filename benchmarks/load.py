@@ -0,0 +1,99 @@
+"""Concurrent HTTP load benchmark for the API.
+
+Start the server against a local Postgres first, e.g.
+
+    uvicorn app.main:app --workers 1 --log-level warning
+
+then run
+
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --concurrency 100 500 1000
+
+Each level keeps N clients busy issuing point reads against rows seeded
+through the API and reports requests/sec with p50/p99 latency. To A/B two
+builds, run the same command against each server and compare the tables.
+"""
+import argparse
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+import httpx
+
+from benchmarks.common import throughput
+
+
+async def seed(client, planets):
+    suffix = uuid4().hex[:8]
+    user = (await client.post("/users/", json={
+        "username": f"bench_{suffix}",
+        "email": f"bench_{suffix}@example.com",
+        "password": "x",
+    })).json()
+    paths = [f"/users/{user['id']}"]
+    for i in range(planets):
+        planet = (await client.post("/planets/", json={
+            "name": f"Bench {i}",
+            "owner_id": user["id"],
+            "resources": {"metal": 100, "crystal": 50},
+            "discovered_at": "2024-01-01T00:00:00",
+            "claimed_at": "2024-01-01T00:00:00",
+        })).json()
+        fleet = (await client.post("/user_fleets/", json={
+            "user_id": user["id"],
+            "planet_id": planet["id"],
+            "ships": {"fighter": 10, "bomber": 5},
+        })).json()
+        paths.append(f"/planets/{planet['id']}")
+        paths.append(f"/user_fleets/{fleet['id']}")
+    return paths
+
+
+async def run_level(client, paths, concurrency, requests_per_client):
+    latencies = []
+    errors = 0
+
+    async def worker(offset):
+        nonlocal errors
+        for i in range(requests_per_client):
+            path = paths[(offset + i) % len(paths)]
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests": len(latencies), "errors": errors, **throughput(latencies, elapsed)}
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        paths = await seed(client, args.planets)
+        results = []
+        for concurrency in args.concurrency:
+            results.append(await run_level(client, paths, concurrency, args.requests_per_client))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for r in results:
+        print(f"{r['concurrency']:>8} {r['requests']:>9} {r['errors']:>7} {r['rps']:>10.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument("--planets", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,59 @@
+"""Cost of the /metrics instrumentation: the same load with METRICS_ENABLED on and off.
+
+    python -m benchmarks.metrics_overhead --concurrency 50 --rounds 3
+
+Starts two uvicorn servers on --port and --port + 1, one per setting,
+against DATABASE_URL. It seeds rows through each, then alternates rounds
+of benchmarks.load's point-read load between them so drift hits both
+equally. Reports the best round per setting and the relative difference.
+"""
+import argparse
+import asyncio
+
+import httpx
+
+from benchmarks.common import start_server, wait_ready
+from benchmarks.load import run_level, seed
+
+
+async def main(args):
+    settings = {"off": (args.port, False), "on": (args.port + 1, True)}
+    servers = [start_server(port, METRICS_ENABLED="true" if enabled else "false") for port, enabled in settings.values()]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        clients = {
+            name: httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30)
+            for name, (port, _) in settings.items()
+        }
+        for client in clients.values():
+            await wait_ready(client)
+        paths = {name: await seed(client, args.planets) for name, client in clients.items()}
+
+        best = {}
+        for _ in range(args.rounds):
+            for name, client in clients.items():
+                result = await run_level(client, paths[name], args.concurrency, args.requests_per_client)
+                if name not in best or result["rps"] > best[name]["rps"]:
+                    best[name] = result
+        for client in clients.values():
+            await client.aclose()
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+
+    print(f"{'metrics':>8} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, result in best.items():
+        print(f"{name:>8} {result['rps']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+    print(f"throughput change with metrics on: {(best['on']['rps'] / best['off']['rps'] - 1) * 100:+.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests-per-client", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--planets", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
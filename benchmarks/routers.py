@@ -0,0 +1,135 @@
+"""Rows serialized per second for each router's list page.
+
+    python -m benchmarks.routers --rows 10000 --page-size 1000
+
+Seeds every table inside a transaction that is rolled back and fetches the
+rows with each router's column list. It then times turning the rows into a
+list response two ways:
+
+    fast     dict_row mapping + ORJSONResponse, what the list routes do
+    default  the same dicts through jsonable_encoder + JSONResponse,
+             FastAPI's path for a handler that returns a plain dict
+
+Needs DATABASE_URL with migrations applied.
+"""
+import argparse
+import asyncio
+import random
+import time
+from uuid import uuid4
+
+import psycopg
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from battles.endpoints import BATTLE_COLUMNS
+from battles.engine import simulate
+from battles.log_codec import pack_log, unpack_row
+from buildings.cache import BUILDING_COLUMNS
+from db.codec import ORJSONResponse, register_json
+from db.pool import DATABASE_URL
+from planets.endpoints import PLANET_COLUMNS
+from user_buildings.endpoints import USER_BUILDING_COLUMNS
+from user_fleets.endpoints import USER_FLEET_COLUMNS
+from users.endpoints import USER_COLUMNS
+
+ROUTERS = {
+    "users": USER_COLUMNS,
+    "planets": PLANET_COLUMNS,
+    "buildings": BUILDING_COLUMNS,
+    "user_buildings": USER_BUILDING_COLUMNS,
+    "user_fleets": USER_FLEET_COLUMNS,
+    "battles": BATTLE_COLUMNS,
+}
+
+
+async def copy(cursor, table, columns, rows):
+    async with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            await copy.write_row(row)
+
+
+async def seed(conn, rows, rng):
+    suffix = uuid4().hex[:8]
+    users = [(str(uuid4()), f"bench_{suffix}_{i}", f"bench_{suffix}_{i}@example.com", "x") for i in range(rows)]
+    planets = [
+        (str(uuid4()), f"Planet {i}", users[i][0], Jsonb({"metal": rng.randint(0, 10 ** 6), "crystal": rng.randint(0, 10 ** 5)}),
+         Jsonb({"metal": rng.randint(1, 500)}))
+        for i in range(rows)
+    ]
+    buildings = [
+        (str(uuid4()), f"Building {i}", "production", Jsonb({"metal": rng.randint(1, 1000)}), Jsonb({"metal": rng.randint(1, 50)}))
+        for i in range(rows)
+    ]
+    user_buildings = [(str(uuid4()), users[i][0], buildings[i][0], planets[i][0], rng.randint(1, 20)) for i in range(rows)]
+    user_fleets = [
+        (str(uuid4()), users[i][0], planets[i][0], Jsonb({"fighter": rng.randint(1, 10 ** 4), "cruiser": rng.randint(1, 100)}))
+        for i in range(rows)
+    ]
+    logs = [simulate({"fighter": rng.randint(1, 10 ** 4)}, {"frigate": rng.randint(1, 10 ** 3)}, seed)["battle_log"] for seed in range(50)]
+    battles = [(str(uuid4()), users[i][0], users[-i - 1][0], planets[i][0], pack_log(logs[i % len(logs)])) for i in range(rows)]
+
+    async with conn.cursor() as cursor:
+        await copy(cursor, "users", ("id", "username", "email", "password_hash"), users)
+        await copy(cursor, "planets", ("id", "name", "owner_id", "resources", "production_rates"), planets)
+        await copy(cursor, "buildings", ("id", "name", "type", "resource_cost", "production"), buildings)
+        await copy(cursor, "user_buildings", ("id", "user_id", "building_id", "planet_id", "level"), user_buildings)
+        await copy(cursor, "user_fleets", ("id", "user_id", "planet_id", "ships"), user_fleets)
+        await copy(cursor, "battles", ("id", "attacker_id", "defender_id", "planet_id", "battle_log_packed"), battles)
+    seeded = {"users": users, "planets": planets, "buildings": buildings,
+              "user_buildings": user_buildings, "user_fleets": user_fleets, "battles": battles}
+    return {table: [row[0] for row in table_rows] for table, table_rows in seeded.items()}
+
+
+async def fetch(conn, table, columns, ids):
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"SELECT {columns} FROM {table} WHERE id = ANY(%s::uuid[]) ORDER BY id", (ids,))
+        rows = await cursor.fetchall()
+        # Built once per query, the same way fetch_page's cursor builds it.
+        return rows, dict_row(cursor)
+
+
+def render_fast(page, make_row):
+    return ORJSONResponse({"items": [make_row(row) for row in page], "next_cursor": None}).body
+
+
+def render_default(page, make_row):
+    return JSONResponse(jsonable_encoder({"items": [make_row(row) for row in page], "next_cursor": None})).body
+
+
+def measure(rows, make_row, page_size, render):
+    started = time.perf_counter()
+    for start in range(0, len(rows), page_size):
+        render(rows[start:start + page_size], make_row)
+    return len(rows) / (time.perf_counter() - started)
+
+
+async def main(args):
+    register_json()
+    rng = random.Random(args.seed)
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        ids = await seed(conn, args.rows, rng)
+        fetched = {router: await fetch(conn, router, columns, ids[router]) for router, columns in ROUTERS.items()}
+        await conn.rollback()
+
+    print(f"{'router':>15} {'fast rows/s':>12} {'default rows/s':>15} {'speedup':>8}")
+    for router in args.routers:
+        rows, make_row = fetched[router]
+        if router == "battles":
+            # The battles routes unpack battle_log_packed into each row, so that is timed too.
+            make_row = lambda row, make_dict=make_row: unpack_row(make_dict(row))
+        fast = max(measure(rows, make_row, args.page_size, render_fast) for _ in range(args.repeat))
+        default = max(measure(rows, make_row, args.page_size, render_default) for _ in range(args.repeat))
+        print(f"{router:>15} {fast:>12.0f} {default:>15.0f} {fast / default:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--routers", nargs="+", default=list(ROUTERS), choices=list(ROUTERS))
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
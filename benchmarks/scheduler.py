@@ -0,0 +1,202 @@
+"""Scheduled events fired per minute, and how late they fire.
+
+    python -m benchmarks.scheduler --events 100000 --spread 60 --servers 2
+
+Starts --servers uvicorn servers on --port and up against DATABASE_URL, all
+firing events. Seeds --users users with --planets planets each, a defending
+fleet on every planet, a user building per building upgrade and a fleet per
+fleet move (--arrival-share of the events); half the moves head for another
+user's planet and fight the fleet parked there. Every event is scheduled through the bulk routes, spread
+round-robin over the servers, due uniformly over --spread seconds starting
+--lead seconds after scheduling begins.
+
+Reports the rate events fired at, the lag from due_at to the commit that
+fired them per server (p50/p99/max), and the largest backlog of overdue
+events seen while polling /scheduler/stats. Then checks the database:
+every building went up exactly one level, every fleet is at its
+destination and no event is left, so nothing fired twice or not at all.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from uuid import uuid4
+
+import httpx
+import psycopg
+
+from benchmarks.common import start_server, wait_ready
+
+BULK_SIZE = 5000
+
+
+async def post_bulk(client, path, items):
+    ids = []
+    for i in range(0, len(items), BULK_SIZE):
+        response = await client.post(path, json=items[i:i + BULK_SIZE], timeout=120)
+        response.raise_for_status()
+        ids.extend(item["id"] for item in response.json())
+    return ids
+
+
+async def seed(client, args, upgrades, moves):
+    suffix = uuid4().hex[:8]
+    planets = {}
+    for n in range(args.users):
+        user_id = (await client.post("/users/", json={
+            "username": f"sched_{n}_{suffix}", "email": f"sched_{n}_{suffix}@example.com", "password": "x",
+        })).json()["id"]
+        planets[user_id] = [(await client.post("/planets/", json={
+            "name": f"Sched {n}.{i}", "owner_id": user_id, "resources": {"metal": 100},
+            "discovered_at": "2024-01-01T00:00:00", "claimed_at": "2024-01-01T00:00:00",
+        })).json()["id"] for i in range(args.planets)]
+    building = (await client.post("/buildings/", json={
+        "name": f"Sched {suffix}", "type": "production", "resource_cost": {"metal": 10},
+    })).json()["id"]
+    users = list(planets)
+    homes = [(user_id, planet_id) for user_id in users for planet_id in planets[user_id]]
+    # A defender on every planet, strong enough to survive a few waves.
+    await post_bulk(client, "/user_fleets/bulk", [
+        {"user_id": user_id, "planet_id": planet_id, "ships": {"fighter": 200, "cruiser": 20}} for user_id, planet_id in homes
+    ])
+    user_buildings = await post_bulk(client, "/user_buildings/bulk", [
+        {"user_id": homes[i % len(homes)][0], "building_id": building, "planet_id": homes[i % len(homes)][1], "level": 1}
+        for i in range(upgrades)
+    ])
+    fleets = await post_bulk(client, "/user_fleets/bulk", [
+        {"user_id": homes[i % len(homes)][0], "planet_id": homes[i % len(homes)][1], "ships": {"fighter": 5}}
+        for i in range(moves)
+    ])
+    rng = random.Random(args.seed)
+    # Half the moves stay in their owner's empire, half attack someone else's planet.
+    destinations = []
+    for i in range(moves):
+        owner = homes[i % len(homes)][0]
+        target = owner if i % 2 or len(users) == 1 else rng.choice([user_id for user_id in users if user_id != owner])
+        destinations.append(rng.choice(planets[target]))
+    return users, [planet_id for _, planet_id in homes], user_buildings, fleets, destinations
+
+
+async def poll(clients, events, timeout):
+    # Waits until every event has fired; returns the final stats per server and the largest backlog seen.
+    max_overdue = 0
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        stats = [(await client.get("/scheduler/stats")).json() for client in clients]
+        max_overdue = max(max_overdue, stats[0]["overdue"])
+        fired = sum(sum(s["fired"].values()) for s in stats)
+        if fired >= events and stats[0]["overdue"] == 0:
+            return stats, max_overdue
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Only {fired} of {events} events fired within {timeout} s")
+
+
+def verify(conn, user_buildings, fleets, destinations):
+    problems = []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FILTER (WHERE level <> 2), count(*) FROM user_buildings WHERE id = ANY(%s::uuid[])", (user_buildings,))
+        wrong, total = cursor.fetchone()
+        if wrong or total != len(user_buildings):
+            problems.append(f"{wrong} of {total} buildings not at level 2")
+        cursor.execute("""
+            SELECT count(*) FROM user_fleets f
+            JOIN unnest(%s::uuid[], %s::uuid[]) AS m(id, planet_id) ON m.id = f.id
+            WHERE f.planet_id <> m.planet_id
+        """, (fleets, destinations))
+        if cursor.fetchone()[0]:
+            problems.append("some fleets are not at their destination")
+        cursor.execute(
+            "SELECT count(*) FROM scheduled_events WHERE user_fleet_id = ANY(%s::uuid[]) OR user_building_id = ANY(%s::uuid[])",
+            (fleets, user_buildings),
+        )
+        left = cursor.fetchone()[0]
+        if left:
+            problems.append(f"{left} events never fired")
+    return problems
+
+
+def cleanup(conn, users, planets):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM battles WHERE planet_id = ANY(%s::uuid[])", (planets,))
+        cursor.execute("DELETE FROM user_fleets WHERE user_id = ANY(%s::uuid[])", (users,))
+        cursor.execute("DELETE FROM user_buildings WHERE user_id = ANY(%s::uuid[])", (users,))
+        cursor.execute("DELETE FROM planets WHERE id = ANY(%s::uuid[])", (planets,))
+        cursor.execute("DELETE FROM users WHERE id = ANY(%s::uuid[])", (users,))
+    conn.commit()
+
+
+async def main(args):
+    moves = int(args.events * args.arrival_share)
+    upgrades = args.events - moves
+    ports = [args.port + i for i in range(args.servers)]
+    servers = [start_server(port, SCHEDULER_ENABLED="true") for port in ports]
+    clients = [httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) for port in ports]
+    conn = psycopg.connect(os.environ["DATABASE_URL"])
+    users = planets = None
+    try:
+        for client in clients:
+            await wait_ready(client)
+        started = time.perf_counter()
+        users, planets, user_buildings, fleets, destinations = await seed(clients[0], args, upgrades, moves)
+        print(f"seeded {upgrades} buildings and {moves} fleets in {time.perf_counter() - started:.1f} s")
+
+        # Durations are taken just before each chunk is posted, so every event is due at its slot in
+        # the spread however long scheduling the ones before it took.
+        items = [("/scheduler/building_upgrades/bulk", "build_seconds", {"user_building_id": ub}) for ub in user_buildings]
+        items += [
+            ("/scheduler/fleet_moves/bulk", "travel_seconds", {"user_fleet_id": f, "planet_id": p})
+            for f, p in zip(fleets, destinations)
+        ]
+        random.Random(args.seed).shuffle(items)
+        scheduled_at = time.perf_counter()
+        first_due = scheduled_at + args.lead
+        for n, start in enumerate(range(0, len(items), BULK_SIZE)):
+            now = time.perf_counter()
+            by_path = {}
+            for i in range(start, min(start + BULK_SIZE, len(items))):
+                path, key, body = items[i]
+                by_path.setdefault(path, []).append({**body, key: max(0.0, first_due + args.spread * i / len(items) - now)})
+            for path, chunk in by_path.items():
+                await post_bulk(clients[n % len(clients)], path, chunk)
+        print(f"scheduled {len(items)} events in {time.perf_counter() - scheduled_at:.1f} s")
+
+        stats, max_overdue = await poll(clients, len(items), args.lead + args.spread + args.timeout)
+        elapsed = time.perf_counter() - first_due
+        print(f"fired {len(items)} events in {elapsed:.1f} s after the first was due: {len(items) / elapsed * 60:,.0f} events/min")
+        print(f"largest overdue backlog seen: {max_overdue}")
+        print(f"{'server':>6} {'arrivals':>9} {'upgrades':>9} {'battles':>8} {'batches':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for port, s in zip(ports, stats):
+            lag = s["lag_seconds"]
+            print(
+                f"{port:>6} {s['fired']['fleet_arrival']:>9} {s['fired']['building_upgrade']:>9} {s['battles']:>8}"
+                f" {s['batches']:>8} {(lag['p50'] or 0) * 1000:>8.1f} {(lag['p99'] or 0) * 1000:>8.1f} {lag['max'] * 1000:>8.1f}"
+            )
+        problems = verify(conn, user_buildings, fleets, destinations)
+        print("check:", "; ".join(problems) if problems else "every event fired exactly once")
+    finally:
+        for client in clients:
+            await client.aclose()
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+        if users and not args.keep:
+            cleanup(conn, users, planets)
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--arrival-share", type=float, default=0.2, help="fraction of events that are fleet moves")
+    parser.add_argument("--spread", type=float, default=60.0, help="seconds over which events fall due")
+    parser.add_argument("--lead", type=float, default=15.0, help="seconds from scheduling to the first due event")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--planets", type=int, default=50, help="planets per user")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds allowed past the last due time")
+    parser.add_argument("--keep", action="store_true", help="leave the seeded rows in place")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
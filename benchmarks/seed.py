@@ -0,0 +1,160 @@
+"""Seed a local Postgres with benchmark data at a chosen volume.
+
+    python -m benchmarks.seed --scale 100000 --reset
+
+--scale sets the row count for users, planets, user_buildings, fleets and
+battles; each can be overridden, e.g. --battles 1000000. The building
+catalog is capped at --buildings (default 200) since it is a small lookup
+table in the game. Planets are scattered over a square galaxy at constant
+density, --unowned of them without an owner. Battles carry packed engine
+logs and are spread over the last --battle-days days, so they fill several
+partitions; the missing ones are created. Rows are written with COPY in
+--batch-size chunks. The same --seed always produces the same ids and
+values, so two runs of benchmarks.suite against two builds see identical
+data. --reset truncates every game table first and drops archived battle
+partitions. Leaderboard scores are recomputed at the end. Talks to
+DATABASE_URL directly, migrations applied.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from battles.engine import SHIP_CLASSES, simulate
+from battles.log_codec import pack_log
+from battles.partitions import BATTLE_PARTITION_UNIT, list_partitions
+from db.codec import register_json
+from db.pool import DATABASE_URL
+
+TABLES = ("users", "planets", "buildings", "user_buildings", "user_fleets", "battles")
+RESOURCES = ("metal", "crystal", "deuterium")
+# Distinct battle logs simulated up front; battles cycle through them.
+BATTLE_LOG_POOL = 1000
+
+
+def make_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def ids_for(table: str, count: int, seed: int) -> list:
+    # Each table draws from its own stream, so changing one volume leaves the others' ids alone.
+    rng = random.Random(f"{seed}:{table}")
+    return [make_id(rng) for _ in range(count)]
+
+
+async def copy_batches(conn, table, columns, count, make_row, batch_size):
+    started = time.perf_counter()
+    for start in range(0, count, batch_size):
+        async with conn.cursor() as cursor:
+            async with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                for i in range(start, min(start + batch_size, count)):
+                    await copy.write_row(make_row(i))
+        await conn.commit()
+    print(f"{table:>15} {count:>9} rows {time.perf_counter() - started:>7.1f}s")
+
+
+def battle_logs(rng: random.Random, count: int) -> list:
+    # (packed log, winning side) pairs.
+    def fleet():
+        return {name: rng.randint(1, 10 ** 4) for name in rng.sample(SHIP_CLASSES, 3)}
+
+    outcomes = [simulate(fleet(), fleet(), i) for i in range(count)]
+    return [(pack_log(outcome["battle_log"]), outcome["winner"]) for outcome in outcomes]
+
+
+async def main(args):
+    register_json()
+    volume = {table: args.scale for table in TABLES}
+    volume["buildings"] = args.buildings
+    for table in TABLES:
+        override = getattr(args, table)
+        if override is not None:
+            volume[table] = override
+    ids = {table: ids_for(table, count, args.seed) for table, count in volume.items()}
+    rng = random.Random(args.seed)
+
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        if args.reset:
+            await conn.execute(f"TRUNCATE {', '.join(TABLES)} CASCADE")
+            for name, _, _ in await list_partitions(conn, "battles_archive"):
+                await conn.execute(f'DROP TABLE "{name}"')
+        # Skip triggers (change notifications) and FK checks while bulk loading; needs superuser.
+        try:
+            await conn.execute("SET session_replication_role = replica")
+        except psycopg.errors.InsufficientPrivilege:
+            await conn.rollback()
+            print("not a superuser: loading with triggers and FK checks on")
+        await conn.commit()
+
+        users, planets, buildings = ids["users"], ids["planets"], ids["buildings"]
+        await copy_batches(conn, "users", ("id", "username", "email", "password_hash"), volume["users"], lambda i: (
+            users[i], f"user_{users[i].replace('-', '')}", f"user_{users[i].replace('-', '')}@example.com", "x",
+        ), args.batch_size)
+        # Square galaxy at a constant density of one planet per 100 square units.
+        side = 10 * math.sqrt(volume["planets"])
+        await copy_batches(conn, "planets", ("id", "name", "owner_id", "resources", "discovered_at", "claimed_at", "x", "y"), volume["planets"], lambda i: (
+            planets[i], f"Planet {i}", users[i % len(users)] if users and rng.random() >= args.unowned else None,
+            Jsonb({name: rng.randint(0, 10 ** 6) for name in RESOURCES}), "2024-01-01", "2024-01-01",
+            rng.uniform(0, side), rng.uniform(0, side),
+        ), args.batch_size)
+        await copy_batches(conn, "buildings", ("id", "name", "type", "resource_cost", "production"), volume["buildings"], lambda i: (
+            buildings[i], f"Building {i}", rng.choice(("production", "storage", "defense")),
+            Jsonb({name: rng.randint(10, 10 ** 4) for name in RESOURCES}),
+            Jsonb({rng.choice(RESOURCES): rng.randint(1, 100)}),
+        ), args.batch_size)
+        await copy_batches(conn, "user_buildings", ("id", "user_id", "building_id", "planet_id", "level"), volume["user_buildings"], lambda i: (
+            ids["user_buildings"][i], users[i % len(users)], buildings[i % len(buildings)], planets[i % len(planets)], rng.randint(1, 20),
+        ), args.batch_size)
+        await copy_batches(conn, "user_fleets", ("id", "user_id", "planet_id", "ships"), volume["user_fleets"], lambda i: (
+            ids["user_fleets"][i], users[i % len(users)], planets[i % len(planets)],
+            Jsonb({name: rng.randint(1, 10 ** 4) for name in rng.sample(SHIP_CLASSES, 3)}),
+        ), args.batch_size)
+        logs = battle_logs(rng, min(volume["battles"], BATTLE_LOG_POOL))
+        now = (await (await conn.execute("SELECT now()::timestamp")).fetchone())[0]
+        await conn.execute(
+            "SELECT ensure_battle_partitions(%s, %s, %s)", (BATTLE_PARTITION_UNIT, now - timedelta(days=args.battle_days), now),
+        )
+        await conn.commit()
+
+        def battle_row(i):
+            attacker, defender = users[i % len(users)], users[-1 - i % len(users)]
+            log, winner = logs[i % len(logs)]
+            return (
+                ids["battles"][i], attacker, defender, planets[i % len(planets)],
+                {"attacker": attacker, "defender": defender}.get(winner), log,
+                now - timedelta(seconds=rng.uniform(0, args.battle_days * 86400)),
+            )
+
+        await copy_batches(conn, "battles", ("id", "attacker_id", "defender_id", "planet_id", "winner_id", "battle_log_packed", "created_at"), volume["battles"], battle_row, args.batch_size)
+
+        started = time.perf_counter()
+        await conn.execute("UPDATE planets SET production_rates = planet_production_rates(id), resources_updated_at = now()")
+        await conn.execute("SET session_replication_role = DEFAULT")
+        await conn.commit()
+        print(f"{'rates':>15} {'':>9}      {time.perf_counter() - started:>7.1f}s")
+        started = time.perf_counter()
+        await conn.execute("SELECT refresh_leaderboard_scores()")
+        await conn.commit()
+        print(f"{'leaderboards':>15} {'':>9}      {time.perf_counter() - started:>7.1f}s")
+        for table in TABLES:
+            await conn.execute(f"ANALYZE {table}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1000)
+    parser.add_argument("--buildings", type=int, default=200)
+    for table in ("users", "planets", "user_buildings", "user_fleets", "battles"):
+        parser.add_argument(f"--{table.replace('_', '-')}", dest=table, type=int, default=None)
+    parser.add_argument("--unowned", type=float, default=0.25, help="fraction of planets without an owner")
+    parser.add_argument("--battle-days", type=float, default=90, help="battles are spread over this many past days")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--reset", action="store_true", help="truncate every game table first")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""Serialization cost of list pages: stdlib json against the orjson codec.
+
+    python -m benchmarks.serialization --rows 10000 --page-size 1000
+
+Seeds planets and battles inside a transaction that is rolled back, fetches
+them with PLANET_COLUMNS / BATTLE_COLUMNS and the JSON columns left as raw
+text, then times decoding those columns, building the list page of dict
+rows and encoding the page. "stdlib" is the old path
+(json.loads on read, json.dumps on write); "orjson" is db.codec. Needs
+DATABASE_URL with migrations applied.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from uuid import uuid4
+
+import psycopg
+from psycopg.types.json import Jsonb
+from psycopg.types.string import TextLoader
+
+from battles.endpoints import BATTLE_COLUMNS
+from battles.engine import simulate
+from db import codec
+from db.pool import DATABASE_URL
+from planets.endpoints import PLANET_COLUMNS
+
+
+def _stdlib_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+CODECS = {
+    "stdlib": (json.loads, lambda value: json.dumps(value, default=_stdlib_default).encode()),
+    "orjson": (codec.loads, codec.dumps),
+}
+
+
+async def seed(conn, rows, rng):
+    planets = [
+        (str(uuid4()), f"Planet {i}", Jsonb({name: rng.randint(0, 10 ** 6) for name in ("metal", "crystal", "deuterium", "energy")}),
+         Jsonb({"metal": rng.randint(1, 500), "crystal": rng.randint(1, 300)}))
+        for i in range(rows)
+    ]
+    logs = [simulate({"fighter": rng.randint(1, 10 ** 4), "cruiser": rng.randint(1, 100)},
+                     {"frigate": rng.randint(1, 10 ** 3), "battleship": rng.randint(1, 50)}, seed)["battle_log"]
+            for seed in range(50)]
+    battles = [(str(uuid4()), Jsonb(logs[i % len(logs)])) for i in range(rows)]
+    async with conn.cursor() as cursor:
+        async with cursor.copy("COPY planets (id, name, resources, production_rates) FROM STDIN") as copy:
+            for row in planets:
+                await copy.write_row(row)
+        async with cursor.copy("COPY battles (id, battle_log) FROM STDIN") as copy:
+            for row in battles:
+                await copy.write_row(row)
+    return [row[0] for row in planets], [row[0] for row in battles]
+
+
+async def fetch_raw(conn, columns, table, ids):
+    # JSON columns come back as text so each codec does its own decoding.
+    async with conn.cursor() as cursor:
+        cursor.adapters.register_loader("jsonb", TextLoader)
+        cursor.adapters.register_loader("json", TextLoader)
+        await cursor.execute(f"SELECT {columns} FROM {table} WHERE id = ANY(%s::uuid[]) ORDER BY id", (ids,))
+        json_oids = {conn.adapters.types["jsonb"].oid, conn.adapters.types["json"].oid}
+        json_columns = [i for i, column in enumerate(cursor.description) if column.type_code in json_oids]
+        names = [column.name for column in cursor.description]
+        return await cursor.fetchall(), json_columns, names
+
+
+def measure(rows, json_columns, names, page_size, codec_name):
+    loads, dumps = CODECS[codec_name]
+    decode = encode = 0.0
+    size = 0
+    for start in range(0, len(rows), page_size):
+        page = rows[start:start + page_size]
+        started = time.perf_counter()
+        decoded = []
+        for row in page:
+            row = list(row)
+            for i in json_columns:
+                if row[i] is not None:
+                    row[i] = loads(row[i])
+            decoded.append(row)
+        decode += time.perf_counter() - started
+        started = time.perf_counter()
+        body = dumps({"items": [dict(zip(names, row)) for row in decoded], "next_cursor": None})
+        encode += time.perf_counter() - started
+        size += len(body)
+    return decode, encode, size
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        planet_ids, battle_ids = await seed(conn, args.rows, rng)
+        tables = {
+            "planets": await fetch_raw(conn, PLANET_COLUMNS, "planets", planet_ids),
+            "battles": await fetch_raw(conn, BATTLE_COLUMNS, "battles", battle_ids),
+        }
+        await conn.rollback()
+
+    print(f"{'table':>8} {'codec':>7} {'decode ms':>10} {'encode ms':>10} {'rows/s':>10} {'MB':>7}")
+    for table, (rows, json_columns, names) in tables.items():
+        for codec_name in args.codecs:
+            runs = [measure(rows, json_columns, names, args.page_size, codec_name) for _ in range(args.repeat)]
+            decode, encode, size = min(runs, key=lambda run: run[0] + run[1])
+            rate = len(rows) / (decode + encode)
+            print(f"{table:>8} {codec_name:>7} {decode * 1000:>10.1f} {encode * 1000:>10.1f} {rate:>10.0f} {size / 1e6:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""Proximity queries: the in-memory planet grid against a naive SQL scan.
+
+    python -m benchmarks.seed --scale 1000000 --reset
+    python -m benchmarks.spatial --queries 2000 --sql-queries 20
+
+Loads the grid from the seeded planets the way a worker does at startup, then
+answers the same random "within --radius" and "k nearest unowned" queries
+from the grid and from SQL over the planets table (no spatial index, so
+every query scans it). Reports the mean and p99 per query. Needs
+DATABASE_URL with migrations applied.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import summarize
+from db.pool import close_pool, connection, open_pool
+from planets.spatial import load_planet_index, planet_index
+
+NEARBY_SQL = """
+    SELECT id, x, y, owner_id IS NOT NULL, sqrt((x - %(x)s) ^ 2 + (y - %(y)s) ^ 2) AS distance
+    FROM planets
+    WHERE (x - %(x)s) ^ 2 + (y - %(y)s) ^ 2 <= %(radius)s ^ 2
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+NEAREST_UNOWNED_SQL = """
+    SELECT id, x, y, false, sqrt((x - %(x)s) ^ 2 + (y - %(y)s) ^ 2) AS distance
+    FROM planets
+    WHERE owner_id IS NULL AND x IS NOT NULL
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+
+async def time_sql(sql, points, params):
+    timings = []
+    async with connection() as conn:
+        for x, y in points:
+            started = time.perf_counter()
+            await (await conn.execute(sql, {"x": x, "y": y, **params})).fetchall()
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def time_index(query, points):
+    timings = []
+    for x, y in points:
+        started = time.perf_counter()
+        query(x, y)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def main(args):
+    await open_pool()
+    try:
+        started = time.perf_counter()
+        await load_planet_index()
+        print(f"loaded {len(planet_index.slot_of)} planets into {len(planet_index.cells)} cells "
+              f"in {time.perf_counter() - started:.1f}s")
+        if not planet_index.slot_of:
+            return
+        min_cx, max_cx, min_cy, max_cy = planet_index.bounds
+        size = planet_index.cell_size
+        rng = random.Random(args.seed)
+        points = [
+            (rng.uniform(min_cx * size, (max_cx + 1) * size), rng.uniform(min_cy * size, (max_cy + 1) * size))
+            for _ in range(args.queries)
+        ]
+
+        cases = [
+            (f"within r={args.radius:g}", NEARBY_SQL, {"radius": args.radius, "limit": args.limit},
+             lambda x, y: planet_index.within(x, y, args.radius, args.limit)),
+            (f"nearest k={args.k} unowned", NEAREST_UNOWNED_SQL, {"limit": args.k},
+             lambda x, y: planet_index.nearest(x, y, args.k, unowned=True)),
+        ]
+        print(f"{'query':>22} {'engine':>6} {'queries':>8} {'mean ms':>9} {'p99 ms':>9}")
+        for name, sql, params, query in cases:
+            for engine, timings in (
+                ("grid", time_index(query, points)),
+                ("sql", await time_sql(sql, points[:args.sql_queries], params)),
+            ):
+                mean, p99 = summarize(timings)
+                print(f"{name:>22} {engine:>6} {len(timings):>8} {mean:>9.3f} {p99:>9.3f}")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000, help="grid queries per case")
+    parser.add_argument("--sql-queries", type=int, default=20, help="SQL queries per case; each is a full scan")
+    parser.add_argument("--radius", type=float, default=100.0)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""Idle WebSocket subscribers per worker and fan-out latency to all of them.
+
+    python -m benchmarks.subscribers --base-url http://127.0.0.1:8000 --subscribers 10000 --updates 20
+
+Opens --subscribers sockets on /events/ws, every one subscribed to the same
+planet, and leaves them idle. It then updates a fleet on that planet
+--updates times and reports, per update, how long until every subscriber
+had the event. Run it against a single uvicorn worker to measure one
+worker's capacity; raise `ulimit -n` on both sides first.
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+import httpx
+import websockets
+
+from benchmarks.common import percentile
+
+
+async def setup(client):
+    suffix = uuid4().hex[:8]
+    user = (await client.post("/users/", json={
+        "username": f"ws_{suffix}",
+        "email": f"ws_{suffix}@example.com",
+        "password": "x",
+    })).json()
+    planet = (await client.post("/planets/", json={
+        "name": "Subscriber bench",
+        "owner_id": user["id"],
+        "resources": {},
+        "discovered_at": "2024-01-01T00:00:00",
+        "claimed_at": "2024-01-01T00:00:00",
+    })).json()
+    fleet = (await client.post("/user_fleets/", json={
+        "user_id": user["id"],
+        "planet_id": planet["id"],
+        "ships": {"fighter": 1},
+    })).json()
+    return user["id"], planet["id"], fleet["id"]
+
+
+async def subscribe(url):
+    # ping_interval=None keeps the sockets truly idle between events.
+    return await websockets.connect(url, ping_interval=None, open_timeout=60, max_queue=None)
+
+
+async def main(args):
+    ws_url = args.base_url.replace("http", "ws", 1)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        user_id, planet_id, fleet_id = await setup(client)
+        url = f"{ws_url}/events/ws?planet_id={planet_id}"
+
+        sockets = []
+        started = time.perf_counter()
+        for start in range(0, args.subscribers, args.connect_batch):
+            batch = min(args.connect_batch, args.subscribers - start)
+            sockets.extend(await asyncio.gather(*(subscribe(url) for _ in range(batch))))
+        print(f"connected {len(sockets)} subscribers in {time.perf_counter() - started:.1f}s")
+        print("server:", (await client.get("/events/stats")).json())
+
+        fan_out = []
+        try:
+            for update in range(args.updates):
+                await asyncio.sleep(args.idle)
+                sent = time.perf_counter()
+                response = await client.put(f"/user_fleets/{fleet_id}", json={
+                    "user_id": user_id,
+                    "planet_id": planet_id,
+                    "ships": {"fighter": update + 2},
+                })
+                response.raise_for_status()
+                await asyncio.gather(*(socket.recv() for socket in sockets))
+                fan_out.append((time.perf_counter() - sent) * 1000)
+        finally:
+            await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+
+    fan_out.sort()
+    print(f"{'updates':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    print(f"{len(fan_out):>8} {percentile(fan_out, 50):>9.1f} {percentile(fan_out, 99):>9.1f} {fan_out[-1]:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--idle", type=float, default=0.5, help="seconds between updates")
+    parser.add_argument("--connect-batch", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,246 @@
+"""End-to-end benchmark of every router, with a compare mode for regressions.
+
+    python -m benchmarks.seed --scale 100000 --reset
+    uvicorn app.main:app --workers 1 --log-level warning
+    python -m benchmarks.suite run --base-url http://127.0.0.1:8000 --out base.json
+    ... change the code, restart the server ...
+    python -m benchmarks.suite run --base-url http://127.0.0.1:8000 --out head.json
+    python -m benchmarks.suite compare base.json head.json --threshold 10
+
+`run` samples ids through the list routes. It then drives each router's
+list, read, create, update and delete routes, plus the filtered lists,
+/users/{id}/empire and the proximity queries, with --concurrency clients,
+one scenario at a time. It writes a JSON report with req/s, p50/p95/p99 and
+the share of request time spent in the database, read from /metrics.
+Background queries (catalog refreshes, battle workers) count too, so the
+share can pass 100% for writes that trigger them. `compare` flags every
+scenario whose throughput dropped or p99 rose by more than --threshold
+percent, and exits non-zero if there are any.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.common import percentile
+
+ROUTERS = ("users", "planets", "buildings", "user_buildings", "user_fleets", "battles")
+
+
+def payload(router, i, ids):
+    def pick(table):
+        return ids[table][i % len(ids[table])]
+
+    suffix = uuid4().hex[:12]
+    if router == "users":
+        return {"username": f"suite_{suffix}", "email": f"suite_{suffix}@example.com", "password": "x"}
+    if router == "planets":
+        return {"name": f"Suite {i}", "owner_id": pick("users"), "resources": {"metal": i, "crystal": i // 2},
+                "discovered_at": "2024-01-01T00:00:00", "claimed_at": "2024-01-01T00:00:00"}
+    if router == "buildings":
+        return {"name": f"Suite {suffix}", "type": "production", "resource_cost": {"metal": 100}, "production": {"metal": 10}}
+    if router == "user_buildings":
+        return {"user_id": pick("users"), "building_id": pick("buildings"), "planet_id": pick("planets"), "level": 1 + i % 10}
+    if router == "user_fleets":
+        return {"user_id": pick("users"), "planet_id": pick("planets"), "ships": {"fighter": 10 + i % 50, "cruiser": i % 5}}
+    return {"attacker_id": pick("users"), "defender_id": pick("users"), "planet_id": pick("planets"), "battle_log": {"rounds": i % 6}}
+
+
+def scenarios(ids, page_size):
+    # (name, request count or None for "one per created row", builder(i, created) -> (method, path, json))
+    plan = []
+    for router in ROUTERS:
+        sample = ids[router]
+        plan += [
+            (f"{router}.list", None, lambda i, created, r=router: ("GET", f"/{r}/?limit={page_size}", None)),
+            (f"{router}.read", None, lambda i, created, r=router, s=sample: ("GET", f"/{r}/{s[i % len(s)]}", None)),
+            (f"{router}.create", None, lambda i, created, r=router: ("POST", f"/{r}/", payload(r, i, ids))),
+            (f"{router}.update", None, lambda i, created, r=router: ("PUT", f"/{r}/{created[r][i % len(created[r])]}", payload(r, i, ids))),
+            (f"{router}.delete", "created", lambda i, created, r=router: ("DELETE", f"/{r}/{created[r][i]}", None)),
+        ]
+    # PUT and DELETE /users/{id} only take the user's own bearer token; benchmarks.auth covers signed-in
+    # requests. The users this run creates stay behind until the next seed --reset.
+    plan = [scenario for scenario in plan if scenario[0] not in ("users.update", "users.delete")]
+    users, planets, points = ids["users"], ids["planets"], ids["points"]
+    plan += [
+        ("planets.list_by_owner", None, lambda i, created: ("GET", f"/planets/?owner_id={users[i % len(users)]}", None)),
+        ("user_fleets.list_by_planet", None, lambda i, created: ("GET", f"/user_fleets/?planet_id={planets[i % len(planets)]}", None)),
+        ("users.empire", None, lambda i, created: ("GET", f"/users/{users[i % len(users)]}/empire", None)),
+        ("planets.nearby", None, lambda i, created: ("GET", "/planets/nearby?x={}&y={}&radius=100".format(*points[i % len(points)]), None)),
+        ("planets.nearest", None, lambda i, created: ("GET", "/planets/nearest?x={}&y={}&k=10".format(*points[i % len(points)]), None)),
+    ]
+    return plan
+
+
+async def sample_ids(client, count):
+    ids = {}
+    for router in ROUTERS:
+        response = await client.get(f"/{router}/", params={"limit": count})
+        response.raise_for_status()
+        items = response.json()["items"]
+        ids[router] = [item["id"] for item in items]
+        if router == "planets":
+            ids["points"] = [(item["x"], item["y"]) for item in items if item["x"] is not None] or [(0.0, 0.0)]
+        if not ids[router]:
+            sys.exit(f"/{router}/ is empty, seed the database first (python -m benchmarks.seed)")
+    return ids
+
+
+async def metric_sums(client):
+    # Total seconds spent in requests and in queries so far, or None if /metrics is off.
+    response = await client.get("/metrics")
+    if response.status_code != 200:
+        return None
+    sums = {"http": 0.0, "db": 0.0}
+    for family in text_string_to_metric_families(response.text):
+        for sample in family.samples:
+            if sample.name == "http_request_duration_seconds_sum" and sample.labels.get("route") != "/metrics":
+                sums["http"] += sample.value
+            elif sample.name == "db_query_duration_seconds_sum":
+                sums["db"] += sample.value
+    return sums
+
+
+async def run_scenario(client, build, count, concurrency, created, router):
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            method, path, body = build(i, created)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 400:
+                    errors += 1
+                elif method == "POST":
+                    created[router].append(response.json()["id"])
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        ids = await sample_ids(client, args.sample)
+        created = {router: [] for router in ROUTERS}
+        results = {}
+        for name, count, build in scenarios(ids, args.page_size):
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            router = name.split(".")[0]
+            if count == "created":
+                count = len(created[router])
+                if not count:
+                    continue
+            elif name.endswith(".update") and not created[router]:
+                continue
+            else:
+                count = args.requests
+            before = await metric_sums(client)
+            result = await run_scenario(client, build, count, args.concurrency, created, router)
+            after = await metric_sums(client)
+            result["db_time_share"] = None
+            if before and after and after["http"] > before["http"]:
+                result["db_time_share"] = (after["db"] - before["db"]) / (after["http"] - before["http"])
+            results[name] = result
+            share = f"{result['db_time_share'] * 100:.0f}%" if result["db_time_share"] is not None else "-"
+            print(f"{name:>27} {result['rps']:>9.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                  f"{result['errors']:>6} {share:>6}")
+
+    report = {
+        "meta": {
+            "base_url": args.base_url,
+            "revision": git_revision(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "page_size": args.page_size,
+        },
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    regressions = []
+    print(f"{'scenario':>27} {'base req/s':>11} {'head req/s':>11} {'change':>8} {'base p99':>9} {'head p99':>9} {'change':>8}")
+    for name, before in base["scenarios"].items():
+        after = head["scenarios"].get(name)
+        if after is None:
+            continue
+        rps_change = (after["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+        p99_change = (after["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+        flag = ""
+        if rps_change < -args.threshold or p99_change > args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print(f"{name:>27} {before['rps']:>11.1f} {after['rps']:>11.1f} {rps_change:>+7.1f}% "
+              f"{before['p99_ms']:>9.2f} {after['p99_ms']:>9.2f} {p99_change:>+7.1f}% {flag}")
+    print(f"{len(regressions)} regression(s) beyond {args.threshold}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="drive every router and write a JSON report")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--concurrency", type=int, default=50)
+    run_parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    run_parser.add_argument("--page-size", type=int, default=100)
+    run_parser.add_argument("--sample", type=int, default=1000, help="existing ids sampled per router")
+    run_parser.add_argument("--only", nargs="+", help="scenario name prefixes, e.g. planets users.read")
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--out", default="benchmark-report.json")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        print(f"{'scenario':>27} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'db %':>6}")
+        asyncio.run(run(args))
+    else:
+        sys.exit(compare(args))
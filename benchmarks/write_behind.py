@@ -0,0 +1,105 @@
+"""Hot fleet updates: synchronous PUT against FLEET_WRITE_BEHIND.
+
+    python -m benchmarks.write_behind --fleets 20 --concurrency 50 --updates 5000
+
+Starts two uvicorn servers on --port and --port + 1 against DATABASE_URL,
+one writing every PUT /user_fleets/{id} straight to Postgres and one
+buffering them. Each server gets its own --fleets fleets, then
+--concurrency clients send --updates PUTs spread over those fleets, so the
+same fleets change many times a second as in active play. Reports req/s
+and latency per mode, plus how many writes the buffer coalesced.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from uuid import uuid4
+
+import httpx
+
+from benchmarks.common import start_server, throughput, wait_ready
+
+
+async def seed(client, fleets):
+    suffix = uuid4().hex[:8]
+    user = (await client.post("/users/", json={
+        "username": f"wb_{suffix}",
+        "email": f"wb_{suffix}@example.com",
+        "password": "x",
+    })).json()
+    planet = (await client.post("/planets/", json={
+        "name": "Write-behind bench",
+        "owner_id": user["id"],
+        "resources": {},
+        "discovered_at": "2024-01-01T00:00:00",
+        "claimed_at": "2024-01-01T00:00:00",
+    })).json()
+    ids = []
+    for _ in range(fleets):
+        fleet = (await client.post("/user_fleets/", json={
+            "user_id": user["id"],
+            "planet_id": planet["id"],
+            "ships": {"fighter": 1},
+        })).json()
+        ids.append(fleet["id"])
+    return user["id"], planet["id"], ids
+
+
+async def hammer(client, user_id, planet_id, fleet_ids, concurrency, updates):
+    latencies = []
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < updates:
+            i = next_index
+            next_index += 1
+            started = time.perf_counter()
+            response = await client.put(f"/user_fleets/{fleet_ids[i % len(fleet_ids)]}", json={
+                "user_id": user_id,
+                "planet_id": planet_id,
+                "ships": {"fighter": i, "cruiser": i % 7},
+            })
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return throughput(latencies, time.perf_counter() - started)
+
+
+async def main(args):
+    settings = {"sync": (args.port, False), "buffered": (args.port + 1, True)}
+    with tempfile.TemporaryDirectory() as journal_dir:
+        servers = [
+            start_server(port, FLEET_WRITE_BEHIND="true" if write_behind else "false", FLEET_JOURNAL_DIR=journal_dir)
+            for port, write_behind in settings.values()
+        ]
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        results = {}
+        try:
+            for name, (port, _) in settings.items():
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+                    await wait_ready(client)
+                    user_id, planet_id, fleet_ids = await seed(client, args.fleets)
+                    results[name] = await hammer(client, user_id, planet_id, fleet_ids, args.concurrency, args.updates)
+                    stats = (await client.get("/user_fleets/write_behind/stats")).json()
+                    results[name]["coalesced"] = stats["coalesced"]
+        finally:
+            for server in servers:
+                server.terminate()
+            for server in servers:
+                server.wait()
+
+    print(f"{'mode':>9} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'coalesced':>10}")
+    for name, result in results.items():
+        print(f"{name:>9} {result['rps']:>10.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['coalesced']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fleets", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
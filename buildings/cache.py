@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db.pool import DATABASE_URL, connection
+
+logger = logging.getLogger(__name__)
+
+BUILDINGS_CHANNEL = "buildings_changed"
+# The catalog is small, but cap it so a runaway table can't eat the worker's memory.
+BUILDING_CACHE_MAX_ENTRIES = int(os.getenv("BUILDING_CACHE_MAX_ENTRIES", "10000"))
+LISTEN_RETRY_SECONDS = 5
+BUILDING_COLUMNS = "id, name, type, resource_cost, production"
+
+
+class BuildingCatalog:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # True while every row of the table is cached, so lists can be served from memory.
+        self.complete = False
+        self._sorted_ids = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, building_id: str):
+        entry = self.entries.get(building_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(building_id)
+        self.hits += 1
+        return entry
+
+    def put(self, building: dict):
+        building_id = str(building["id"])
+        if building_id not in self.entries:
+            self._sorted_ids = None
+        self.entries[building_id] = building
+        self.entries.move_to_end(building_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            self.complete = False
+            self._sorted_ids = None
+
+    def discard(self, building_id: str):
+        if self.entries.pop(building_id, None) is not None:
+            self._sorted_ids = None
+        self.invalidations += 1
+
+    def page(self, after_id: str | None, limit: int):
+        if not self.complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.entries)
+        ids = self._sorted_ids
+        start = 0
+        if after_id is not None:
+            start = bisect_right(ids, after_id)
+        return [self.entries[i] for i in ids[start:start + limit + 1]]
+
+    def replace_all(self, buildings: list, complete: bool):
+        self.entries = OrderedDict((str(b["id"]), b) for b in buildings)
+        self.complete = complete
+        self._sorted_ids = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "complete": self.complete,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+catalog = BuildingCatalog(BUILDING_CACHE_MAX_ENTRIES)
+_listener_task = None
+
+
+async def load_catalog():
+    async with connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(f"SELECT {BUILDING_COLUMNS} FROM buildings ORDER BY id LIMIT %s", (catalog.max_entries + 1,))
+            rows = await cursor.fetchall()
+    complete = len(rows) <= catalog.max_entries
+    catalog.replace_all(rows[:catalog.max_entries], complete)
+
+
+async def refresh_building(building_id: str):
+    async with connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(f"SELECT {BUILDING_COLUMNS} FROM buildings WHERE id = %s", (building_id,))
+            building = await cursor.fetchone()
+    if building:
+        catalog.put(building)
+    else:
+        catalog.discard(building_id)
+
+
+async def notify_building_changed(conn: psycopg.AsyncConnection, building_id: str):
+    # Sent inside the writer's transaction, so other workers only hear about committed changes.
+    await conn.execute("SELECT pg_notify(%s, %s)", (BUILDINGS_CHANNEL, building_id))
+
+
+async def _connect_listener():
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f"LISTEN {BUILDINGS_CHANNEL}")
+    return conn
+
+
+async def _listen(conn):
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = await _connect_listener()
+                    # Anything committed while we were not listening is unknown, so start from a fresh load.
+                    await load_catalog()
+                async for notify in conn.notifies():
+                    await refresh_building(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Building catalog listener failed, retrying in %s s", LISTEN_RETRY_SECONDS)
+                if conn is not None:
+                    await conn.close()
+                    conn = None
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+async def start_catalog():
+    global _listener_task
+    # LISTEN before the initial load so no change can slip in between the two.
+    conn = await _connect_listener()
+    await load_catalog()
+    _listener_task = asyncio.create_task(_listen(conn))
+
+
+async def stop_catalog():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
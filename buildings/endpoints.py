@@ -1,94 +1,100 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 import psycopg
 from pydantic import BaseModel
 from uuid import uuid4
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from db.pool import acquire, get_db
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, fetch_page, page_response, stream_ndjson
+from buildings.cache import BUILDING_COLUMNS, catalog, notify_building_changed
+from planets.production import planets_with_building, refresh_production
 
 class Building(BaseModel):
     name: str
     type: str
     resource_cost: dict
+    production: dict = {}  # per level, per hour, e.g. {"metal": 30}
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
-
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
-
-def get_building_by_id(building_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM buildings WHERE id = %s", (building_id,))
-            building = cursor.fetchone()
-        conn.close()
-        return building
-    return None
+async def get_building_by_id(conn: psycopg.AsyncConnection, building_id: str):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"SELECT {BUILDING_COLUMNS} FROM buildings WHERE id = %s", (building_id,))
+        return await cursor.fetchone()
 
 router = APIRouter()
 
 @router.post("/")
-def create_building(building: Building):
-    conn = connect_to_db()
-    if conn:
-        building_id = str(uuid4())
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO buildings (id, name, type, resource_cost) 
-                VALUES (%s, %s, %s, %s) 
-                RETURNING id;
-            """, (building_id, building.name, building.type, str(building.resource_cost)))
-            conn.commit()
-        conn.close()
-        return {"id": building_id, "name": building.name, "type": building.type, "resource_cost": building.resource_cost}
-    raise HTTPException(status_code=500, detail="Error creating building.")
+async def create_building(building: Building, conn: psycopg.AsyncConnection = Depends(get_db)):
+    building_id = str(uuid4())
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"""
+            INSERT INTO buildings (id, name, type, resource_cost, production)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING {BUILDING_COLUMNS};
+        """, (building_id, building.name, building.type, Jsonb(building.resource_cost), Jsonb(building.production)))
+        row = await cursor.fetchone()
+        await notify_building_changed(conn, building_id)
+        await conn.commit()
+    catalog.put(row)
+    return {"id": building_id, "name": building.name, "type": building.type, "resource_cost": building.resource_cost, "production": building.production}
 
+@router.get("/stream")
+async def stream_buildings(after: str | None = None):
+    return stream_ndjson(f"SELECT {BUILDING_COLUMNS} FROM buildings", [], [], after)
+
+@router.get("/cache/stats")
+async def read_building_cache_stats():
+    return catalog.stats()
+
+# Catalog reads only take a pooled connection on a cache miss.
 @router.get("/{building_id}")
-def read_building(building_id: str):
-    building = get_building_by_id(building_id)
+async def read_building(building_id: str):
+    building = catalog.get(building_id)
+    if building is None:
+        async with acquire() as conn:
+            building = await get_building_by_id(conn, building_id)
+        if building:
+            catalog.put(building)
     if building:
-        return {"id": building[0], "name": building[1], "type": building[2], "resource_cost": building[3]}
+        return building
     raise HTTPException(status_code=404, detail="Building not found")
 
 @router.get("/")
-def read_all_buildings():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM buildings")
-            buildings = cursor.fetchall()
-        conn.close()
-        return [{"id": b[0], "name": b[1], "type": b[2], "resource_cost": b[3]} for b in buildings]
-    raise HTTPException(status_code=500, detail="Error fetching buildings.")
+async def read_all_buildings(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+):
+    rows = catalog.page(decode_cursor(after) if after else None, limit)
+    if rows is not None:
+        return page_response(rows, limit)
+    async with acquire() as conn:
+        return await fetch_page(conn, f"SELECT {BUILDING_COLUMNS} FROM buildings", [], [], after, limit)
 
 @router.put("/{building_id}")
-def update_building(building_id: str, building: Building):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE buildings 
-                SET name = %s, type = %s, resource_cost = %s 
-                WHERE id = %s
-            """, (building.name, building.type, str(building.resource_cost), building_id))
-            conn.commit()
-        conn.close()
-        return {"message": "Building updated successfully"}
-    raise HTTPException(status_code=500, detail="Error updating building.")
+async def update_building(building_id: str, building: Building, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"""
+            UPDATE buildings
+            SET name = %s, type = %s, resource_cost = %s, production = %s
+            WHERE id = %s
+            RETURNING {BUILDING_COLUMNS}
+        """, (building.name, building.type, Jsonb(building.resource_cost), Jsonb(building.production), building_id))
+        row = await cursor.fetchone()
+        if row:
+            await refresh_production(conn, await planets_with_building(conn, building_id))
+            await notify_building_changed(conn, building_id)
+        await conn.commit()
+    if row:
+        catalog.put(row)
+    return {"message": "Building updated successfully"}
 
 @router.delete("/{building_id}")
-def delete_building(building_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM buildings WHERE id = %s", (building_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "Building deleted successfully"}
-    raise HTTPException(status_code=500, detail="Error deleting building.")
+async def delete_building(building_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    # user_buildings rows go with it (ON DELETE CASCADE), so note the planets whose rates change first.
+    planet_ids = await planets_with_building(conn, building_id)
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM buildings WHERE id = %s", (building_id,))
+        await refresh_production(conn, planet_ids)
+        await notify_building_changed(conn, building_id)
+        await conn.commit()
+    catalog.discard(building_id)
+    return {"message": "Building deleted successfully"}
@@ -0,0 +1,52 @@
+from uuid import UUID
+
+from fastapi import HTTPException
+import psycopg
+
+# Upper bound on items per bulk request, keeps a single transaction from holding locks for too long.
+MAX_BULK_ITEMS = 10000
+
+
+def check_bulk_size(items: list):
+    if not items:
+        raise HTTPException(status_code=422, detail="Bulk request must contain at least one item.")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Bulk request exceeds {MAX_BULK_ITEMS} items.")
+
+
+async def copy_rows(conn: psycopg.AsyncConnection, table: str, columns: list, rows: list):
+    query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    async with conn.cursor() as cursor:
+        async with cursor.copy(query) as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+
+async def execute_returning(conn: psycopg.AsyncConnection, query: str, params_seq: list):
+    # executemany pipelines the statements in one round trip; each parameter set
+    # gets its own result, so an UPDATE ... RETURNING id tells us which rows matched.
+    matched = []
+    async with conn.cursor() as cursor:
+        await cursor.executemany(query, params_seq, returning=True)
+        while True:
+            matched.append(await cursor.fetchone() is not None)
+            if not cursor.nextset():
+                break
+    return matched
+
+
+async def delete_ids(conn: psycopg.AsyncConnection, table: str, ids: list):
+    try:
+        ids = [str(UUID(i)) for i in ids]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Bulk delete ids must be UUIDs.")
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"DELETE FROM {table} WHERE id = ANY(%s::uuid[]) RETURNING id", (ids,))
+        deleted = {str(row[0]) for row in await cursor.fetchall()}
+    return [{"id": i, "status": "deleted" if i in deleted else "not_found"} for i in ids]
+
+
+def bulk_error(e: psycopg.Error):
+    # The whole batch is one transaction, so a single bad item rejects all of them.
+    status_code = 422 if isinstance(e, psycopg.DataError) else 409
+    return HTTPException(status_code=status_code, detail=f"Bulk write rejected, no rows were written: {e.diag.message_primary or e}")
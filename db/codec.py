@@ -0,0 +1,32 @@
+import orjson
+from fastapi.responses import JSONResponse
+from psycopg.types.json import set_json_dumps, set_json_loads
+
+# Every JSON value crossing the app goes through orjson: psycopg decodes json/jsonb
+# columns with it and encodes Jsonb parameters with it, and responses reuse dumps().
+# orjson handles UUID and datetime natively, so rows need no pre-conversion.
+
+
+def _default(value):
+    return str(value)
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+def register_json():
+    # Global adaptation: applies to pooled connections, the catalog listener and COPY.
+    set_json_dumps(dumps)
+    set_json_loads(loads)
+
+
+class ORJSONResponse(JSONResponse):
+    # The app's default response class. Handlers that return one directly also
+    # skip FastAPI's jsonable_encoder pass, which is what list routes do.
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,136 @@
+import logging
+import os
+from time import perf_counter
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from psycopg import AsyncConnection, AsyncCursor, AsyncServerCursor
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Queries slower than this are logged with their text; 0 turns slow-query logging off.
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_CHARS = 500
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time spent in cursor.execute/executemany.", ["statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_QUERY_ROWS = Counter("db_query_rows_total", "Rows returned or affected.", ["statement"])
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Queries that raised.", ["statement"])
+DB_CONNECT_SECONDS = Histogram(
+    "db_connect_duration_seconds", "Time to open a new server connection.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_CONNECT_ERRORS = Counter("db_connect_errors_total", "Failed attempts to open a server connection.")
+
+# Statement label per query string: first keyword only, so label cardinality stays tiny.
+_statements = {}
+STATEMENT_CACHE_SIZE = 4096
+
+
+def _statement(query) -> str:
+    if not isinstance(query, str):
+        return "OTHER"
+    statement = _statements.get(query)
+    if statement is None:
+        words = query.split(None, 1)
+        statement = words[0].upper() if words else "OTHER"
+        if len(_statements) < STATEMENT_CACHE_SIZE:
+            _statements[query] = statement
+    return statement
+
+
+def _record(query, elapsed: float, rowcount: int, failed: bool):
+    statement = _statement(query)
+    DB_QUERY_SECONDS.labels(statement).observe(elapsed)
+    if failed:
+        DB_QUERY_ERRORS.labels(statement).inc()
+    elif rowcount > 0:
+        DB_QUERY_ROWS.labels(statement).inc(rowcount)
+    if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms, %s rows): %s", elapsed * 1000, rowcount, str(query).strip()[:SLOW_QUERY_LOG_CHARS])
+
+
+class InstrumentedCursor(AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        started = perf_counter()
+        failed = True
+        try:
+            result = await super().execute(query, params, **kwargs)
+            failed = False
+            return result
+        finally:
+            _record(query, perf_counter() - started, self.rowcount, failed)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        started = perf_counter()
+        failed = True
+        try:
+            result = await super().executemany(query, params_seq, **kwargs)
+            failed = False
+            return result
+        finally:
+            _record(query, perf_counter() - started, self.rowcount, failed)
+
+
+class InstrumentedServerCursor(AsyncServerCursor):
+    # Times declaring the cursor; the fetches that follow are streamed to the client.
+    async def execute(self, query, params=None, **kwargs):
+        started = perf_counter()
+        failed = True
+        try:
+            result = await super().execute(query, params, **kwargs)
+            failed = False
+            return result
+        finally:
+            _record(query, perf_counter() - started, self.rowcount, failed)
+
+
+class InstrumentedConnection(AsyncConnection):
+    # Pool connection class: times connect and makes every cursor an instrumented one.
+    @classmethod
+    async def connect(cls, conninfo: str = "", **kwargs):
+        started = perf_counter()
+        try:
+            conn = await super().connect(conninfo, **kwargs)
+        except Exception as e:
+            DB_CONNECT_ERRORS.inc()
+            logger.error("Database connection failed after %.1f ms: %s", (perf_counter() - started) * 1000, e)
+            raise
+        DB_CONNECT_SECONDS.observe(perf_counter() - started)
+        conn.cursor_factory = InstrumentedCursor
+        conn.server_cursor_factory = InstrumentedServerCursor
+        return conn
+
+
+class PoolCollector:
+    # Reads psycopg_pool's own counters at scrape time, so the pool costs nothing per request.
+    def __init__(self, get_pool):
+        self.get_pool = get_pool
+
+    def collect(self):
+        pool = self.get_pool()
+        if pool is None:
+            return
+        stats = pool.get_stats()
+        gauges = {
+            "db_pool_size": ("Connections open in the pool.", stats.get("pool_size", 0)),
+            "db_pool_available": ("Idle connections in the pool.", stats.get("pool_available", 0)),
+            "db_pool_requests_waiting": ("Requests queued for a connection.", stats.get("requests_waiting", 0)),
+        }
+        for name, (documentation, value) in gauges.items():
+            yield GaugeMetricFamily(name, documentation, value=value)
+        counters = {
+            "db_pool_requests": ("Connections handed out.", stats.get("requests_num", 0)),
+            "db_pool_requests_queued": ("Requests that had to wait for a connection.", stats.get("requests_queued", 0)),
+            "db_pool_requests_wait_seconds": ("Total time requests waited for a connection.", stats.get("requests_wait_ms", 0) / 1000),
+            "db_pool_requests_errors": ("Requests that timed out or were rejected.", stats.get("requests_errors", 0)),
+            "db_pool_connections_lost": ("Connections found broken on check.", stats.get("connections_lost", 0)),
+        }
+        for name, (documentation, value) in counters.items():
+            yield CounterMetricFamily(name, documentation, value=value)
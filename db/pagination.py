@@ -0,0 +1,96 @@
+import base64
+from uuid import UUID
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from psycopg.rows import dict_row
+
+from db.codec import ORJSONResponse, dumps
+from db.pool import connection
+from db.replicas import acquire_read
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows pulled from the server-side cursor per round trip while streaming.
+STREAM_CHUNK_SIZE = 1000
+
+
+def encode_cursor(last_id) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> str:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return str(UUID(base64.urlsafe_b64decode(padded.encode()).decode()))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+
+def keyset_query(select: str, conditions: list, params: list, after: str | None, limit: int | None = None):
+    # Rows are always ordered by primary key so a page boundary is just "id > last id seen".
+    conditions = list(conditions)
+    params = list(params)
+    if after:
+        conditions.append("id > %s")
+        params.append(decode_cursor(after))
+    query = select
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+    if limit is not None:
+        # One extra row tells us whether another page exists without a COUNT(*).
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    return query, params
+
+
+def page_response(rows: list, limit: int, transform=None):
+    # rows holds up to limit + 1 dict rows; the extra one only signals another page.
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if transform is not None:
+        rows = [transform(row) for row in rows]
+    return ORJSONResponse({
+        "items": rows,
+        "next_cursor": encode_cursor(rows[-1]["id"]) if has_more else None,
+    })
+
+
+async def fetch_page(conn, select: str, conditions: list, params: list, after: str | None, limit: int, transform=None):
+    # select names the response fields, so dict rows are the items as-is unless transform reshapes them.
+    query, params = keyset_query(select, conditions, params, after, limit)
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(query, params)
+        return page_response(await cursor.fetchall(), limit, transform)
+
+
+def stream_ndjson(select: str, conditions: list, params: list, after: str | None, transform=None, replica=True):
+    # replica=False keeps the stream on the primary, for callers that have just written to it themselves.
+    query, params = keyset_query(select, conditions, params, after)
+
+    async def rows():
+        async with acquire_read() if replica else connection() as conn:
+            # Named cursors live on the server, so only one chunk is held in memory at a time.
+            async with conn.cursor(name="ndjson_stream", row_factory=dict_row) as cursor:
+                await cursor.execute(query, params)
+                while True:
+                    chunk = await cursor.fetchmany(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if transform is not None:
+                        chunk = [transform(row) for row in chunk]
+                    yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+def column_filters(**filters):
+    # Equality filters for the list routes; None means "not filtered".
+    conditions, params = [], []
+    for column, value in filters.items():
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+    return conditions, params
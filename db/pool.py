@@ -0,0 +1,104 @@
+import os
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool, PoolTimeout, TooManyRequests
+
+from db.codec import register_json
+from db.metrics import METRICS_ENABLED, InstrumentedConnection, PoolCollector
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+# Seconds a request waits for a free connection before giving up with a 503.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Requests allowed to queue for a connection; 0 means unbounded.
+DB_POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "0"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+# Ping connections before handing them out so a dropped server socket never reaches a handler.
+DB_POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() in ("1", "true", "yes")
+
+pool = None
+
+if METRICS_ENABLED:
+    REGISTRY.register(PoolCollector(lambda: pool))
+
+
+async def open_pool():
+    global pool
+    if pool is not None:
+        return pool
+    register_json()
+    pool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_waiting=DB_POOL_MAX_WAITING,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check=AsyncConnectionPool.check_connection if DB_POOL_HEALTH_CHECK else None,
+        name="crimson",
+        connection_class=InstrumentedConnection if METRICS_ENABLED else AsyncConnection,
+        open=False,
+    )
+    await pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    return pool
+
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def acquire():
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Database pool is not open.")
+    try:
+        async with pool.connection() as conn:
+            yield conn
+    except (PoolTimeout, TooManyRequests):
+        raise HTTPException(status_code=503, detail="Database busy, try again later.")
+
+
+async def get_db():
+    async with acquire() as conn:
+        yield conn
+
+
+def pool_stats():
+    if pool is None:
+        return {"open": False}
+    stats = pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    return {
+        "open": True,
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": size,
+        "available": available,
+        "in_use": size - available,
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": stats.get("requests_num", 0),
+        "requests_queued": stats.get("requests_queued", 0),
+        "requests_wait_ms": stats.get("requests_wait_ms", 0),
+        "requests_errors": stats.get("requests_errors", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+    }
+
+
+def connection():
+    if pool is None:
+        raise RuntimeError("Database pool is not open.")
+    return pool.connection()
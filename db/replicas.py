@@ -0,0 +1,325 @@
+import asyncio
+import itertools
+import logging
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+import psycopg
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool, PoolTimeout, TooManyRequests
+
+from db.metrics import METRICS_ENABLED, InstrumentedConnection
+from db.pool import (
+    DATABASE_URL, DB_POOL_HEALTH_CHECK, DB_POOL_MAX_IDLE, DB_POOL_MAX_LIFETIME, DB_POOL_MAX_SIZE, DB_POOL_MAX_WAITING,
+    DB_POOL_MIN_SIZE, DB_POOL_TIMEOUT, acquire,
+)
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated streaming replicas for read-only handlers; empty sends every read to DATABASE_URL.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_POOL_MAX_SIZE = int(os.getenv("REPLICA_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+# A replica further behind the primary than this leaves rotation until it catches up again.
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# Seconds between health checks, which is also the resolution of the lag they measure.
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+# Clients echo the value of this response header back on later requests to read their own writes.
+SESSION_LSN_HEADER = b"x-session-lsn"
+
+# A stand-in that is not in recovery is the primary's own server reached another way: its current
+# position is the primary's, so it is always caught up.
+REPLAY_LSN_SQL = "CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text"
+CHECK_SQL = f"SELECT pg_is_in_recovery(), {REPLAY_LSN_SQL}, (SELECT system_identifier FROM pg_control_system())"
+
+
+def parse_lsn(text):
+    # "16/B374D848" -> int; None for anything else.
+    high, _, low = (text or "").partition("/")
+    try:
+        return (int(high, 16) << 32) + int(low, 16)
+    except ValueError:
+        return None
+
+
+def format_lsn(lsn: int) -> str:
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.pool = AsyncConnectionPool(
+            url,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=REPLICA_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_waiting=DB_POOL_MAX_WAITING,
+            max_idle=DB_POOL_MAX_IDLE,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            check=AsyncConnectionPool.check_connection if DB_POOL_HEALTH_CHECK else None,
+            name=name,
+            connection_class=InstrumentedConnection if METRICS_ENABLED else AsyncConnection,
+            open=False,
+        )
+        self.check_conn = None
+        self.healthy = False
+        self.reason = "not checked yet"
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.reads = 0
+        self.ejections = 0
+
+    def eject(self, reason: str):
+        if self.healthy:
+            self.ejections += 1
+            logger.warning("Replica %s out of rotation: %s", self.name, reason)
+        self.healthy = False
+        self.reason = reason
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "reason": None if self.healthy else self.reason,
+            "replay_lsn": format_lsn(self.replay_lsn),
+            "lag_seconds": self.lag_seconds,
+            "reads": self.reads,
+            "ejections": self.ejections,
+            "pool": self.pool.get_stats(),
+        }
+
+
+replicas = [Replica(f"replica{i}", url) for i, url in enumerate(DATABASE_REPLICA_URLS)]
+# The caller's X-Session-LSN, set per request by ReplicaMiddleware.
+session_lsn: ContextVar = ContextVar("session_lsn", default=None)
+_round_robin = itertools.count()
+_stats = {"replica_reads": 0, "primary_reads": 0, "behind_session": 0, "session_tokens": 0}
+
+# One autocommit connection to the primary reads its WAL position, for session tokens and lag checks.
+_lsn_conn = None
+_lsn_lock = asyncio.Lock()
+_lsn_started = 0
+_lsn_finished = (0, 0)
+_system_identifier = None
+# (monotonic time, primary LSN) per health check, oldest first.
+_history = deque()
+_checker_task = None
+
+
+async def primary_lsn() -> int:
+    # The primary's current WAL position, at or past every commit made before the call. Concurrent
+    # callers share a query: whoever gets the lock reuses the last result if that query started
+    # after they asked, so a burst of writes costs a round trip or two, not one each.
+    global _lsn_conn, _lsn_started, _lsn_finished
+    asked = _lsn_started
+    async with _lsn_lock:
+        started, lsn = _lsn_finished
+        if started > asked:
+            return lsn
+        _lsn_started += 1
+        started = _lsn_started
+        try:
+            if _lsn_conn is None or _lsn_conn.closed:
+                _lsn_conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+            row = await (await _lsn_conn.execute("SELECT pg_current_wal_lsn()::text")).fetchone()
+        except psycopg.Error:
+            if _lsn_conn is not None:
+                await _lsn_conn.close()
+                _lsn_conn = None
+            raise
+        lsn = parse_lsn(row[0])
+        _lsn_finished = (started, lsn)
+        return lsn
+
+
+def _lag(replay_lsn: int, now: float) -> float:
+    # How long ago the primary was at the oldest position the replica has not replayed yet.
+    for sampled_at, lsn in _history:
+        if lsn > replay_lsn:
+            return now - sampled_at
+    return 0.0
+
+
+async def _check(replica: Replica):
+    try:
+        if replica.check_conn is None or replica.check_conn.closed:
+            replica.check_conn = await psycopg.AsyncConnection.connect(
+                replica.url, autocommit=True, connect_timeout=max(1, int(REPLICA_CHECK_INTERVAL * 2)),
+            )
+        in_recovery, lsn, system_identifier = await (await replica.check_conn.execute(CHECK_SQL)).fetchone()
+    except psycopg.Error as exc:
+        if replica.check_conn is not None:
+            await replica.check_conn.close()
+            replica.check_conn = None
+        replica.lag_seconds = None
+        replica.eject(f"unreachable: {exc.__class__.__name__}")
+        return
+    if system_identifier != _system_identifier:
+        # Another cluster's LSNs say nothing about ours, and its rows are not the primary's.
+        replica.eject("not a replica of DATABASE_URL")
+        return
+    replica.replay_lsn = parse_lsn(lsn) or 0
+    replica.lag_seconds = round(_lag(replica.replay_lsn, monotonic()), 3)
+    if replica.lag_seconds > REPLICA_MAX_LAG_SECONDS:
+        replica.eject(f"{replica.lag_seconds} s behind")
+    elif not replica.healthy:
+        logger.info("Replica %s in rotation (%s)", replica.name, "streaming" if in_recovery else "stand-in")
+        replica.healthy = True
+
+
+async def check_replicas():
+    now = monotonic()
+    try:
+        lsn = await primary_lsn()
+    except psycopg.Error:
+        logger.exception("Replica check could not read the primary's WAL position")
+        return
+    _history.append((now, lsn))
+    while len(_history) > 1 and _history[0][0] < now - REPLICA_MAX_LAG_SECONDS - 2 * REPLICA_CHECK_INTERVAL:
+        _history.popleft()
+    await asyncio.gather(*(_check(replica) for replica in replicas))
+
+
+async def _run_checks():
+    while True:
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+        try:
+            await check_replicas()
+        except Exception:
+            logger.exception("Replica check failed")
+
+
+async def _replica_connection():
+    # (replica, connection) for a healthy replica that has replayed the session's writes, else (None, None).
+    wanted = session_lsn.get()
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None, None
+    start = next(_round_robin)
+    candidates = [healthy[(start + i) % len(healthy)] for i in range(len(healthy))]
+    if wanted is not None:
+        # Prefer replicas the last check already saw past the token; the rest may have caught up since.
+        candidates.sort(key=lambda replica: replica.replay_lsn < wanted)
+    behind = False
+    for replica in candidates:
+        try:
+            conn = await replica.pool.getconn()
+        except (PoolTimeout, TooManyRequests):
+            continue
+        if wanted is None or replica.replay_lsn >= wanted:
+            return replica, conn
+        try:
+            row = await (await conn.execute(f"SELECT {REPLAY_LSN_SQL}")).fetchone()
+            await conn.rollback()
+        except psycopg.Error:
+            await replica.pool.putconn(conn)
+            continue
+        replay_lsn = parse_lsn(row[0])
+        if replay_lsn is not None:
+            replica.replay_lsn = max(replica.replay_lsn, replay_lsn)
+        if replica.replay_lsn >= wanted:
+            return replica, conn
+        await replica.pool.putconn(conn)
+        behind = True
+    if behind:
+        _stats["behind_session"] += 1
+    return None, None
+
+
+@asynccontextmanager
+async def acquire_read():
+    # Like acquire(), for handlers that only read: a replica connection when one is healthy and has
+    # replayed the caller's session LSN, otherwise the primary.
+    replica, conn = await _replica_connection() if replicas else (None, None)
+    if replica is None:
+        _stats["primary_reads"] += 1
+        async with acquire() as conn:
+            yield conn
+        return
+    _stats["replica_reads"] += 1
+    replica.reads += 1
+    try:
+        async with conn:
+            yield conn
+    finally:
+        await replica.pool.putconn(conn)
+
+
+async def get_read_db():
+    async with acquire_read() as conn:
+        yield conn
+
+
+class ReplicaMiddleware:
+    # Plain ASGI like MetricsMiddleware. Reads X-Session-LSN into session_lsn for acquire_read, and
+    # stamps successful writes with the primary's WAL position after their commit. Handlers commit
+    # before they return, so by the time the response starts the write is inside that position.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        for name, value in scope["headers"]:
+            if name == SESSION_LSN_HEADER:
+                session_lsn.set(parse_lsn(value.decode("latin-1")))
+                break
+        if scope["method"] in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+
+        async def send_with_lsn(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                try:
+                    lsn = await primary_lsn()
+                except psycopg.Error:
+                    logger.exception("Could not read the primary's WAL position for a session token")
+                else:
+                    _stats["session_tokens"] += 1
+                    message["headers"] = [*message.get("headers", []), (SESSION_LSN_HEADER, format_lsn(lsn).encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_lsn)
+
+
+async def start_replicas():
+    global _checker_task, _system_identifier
+    if not replicas:
+        return
+    async with acquire() as conn:
+        row = await (await conn.execute("SELECT system_identifier FROM pg_control_system()")).fetchone()
+        _system_identifier = row[0]
+    for replica in replicas:
+        # Not waiting: a replica that is down at startup stays out of rotation until a check reaches it.
+        await replica.pool.open(wait=False)
+    await check_replicas()
+    _checker_task = asyncio.create_task(_run_checks())
+
+
+async def stop_replicas():
+    global _checker_task, _lsn_conn
+    if _checker_task is not None:
+        _checker_task.cancel()
+        try:
+            await _checker_task
+        except asyncio.CancelledError:
+            pass
+        _checker_task = None
+    for replica in replicas:
+        if replica.check_conn is not None:
+            await replica.check_conn.close()
+            replica.check_conn = None
+        await replica.pool.close()
+    if _lsn_conn is not None:
+        await _lsn_conn.close()
+        _lsn_conn = None
+
+
+def replica_stats():
+    return {
+        **_stats,
+        "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+        "replicas": {replica.name: replica.stats() for replica in replicas},
+    }
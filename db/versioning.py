@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from fastapi import HTTPException, Response
+
+
+def etag_for(version) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: str | None, version) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag_for(version)
+    # Weak comparison, as RFC 9110 requires for If-None-Match.
+    return any(tag.strip().removeprefix("W/") == current for tag in if_none_match.split(","))
+
+
+def if_match_versions(if_match: str | None):
+    # Versions an If-Match header accepts, or None for any. Strong comparison
+    # (RFC 9110), so weak tags never match.
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith('"') and tag.endswith('"') and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+
+def if_match_filter(if_match: str | None):
+    # Conditions that make an UPDATE apply only at the versions If-Match names.
+    versions = if_match_versions(if_match)
+    if versions is None:
+        return [], []
+    return ["version = ANY(%s::bigint[])"], [versions]
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(status_code=412, detail="Version mismatch, refetch and retry")
+
+
+def not_modified(version) -> Response:
+    return Response(status_code=304, headers={"ETag": etag_for(version)})
+
+
+async def get_row_version(conn, table: str, row_id: str):
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"SELECT version FROM {table} WHERE id = %s", (row_id,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def reject_update(conn, table: str, row_id: str, if_match: str | None, not_found: str, conflict: str):
+    # Says why a guarded UPDATE matched no row: gone, stale If-Match, or the guard itself.
+    version = await get_row_version(conn, table, row_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    versions = if_match_versions(if_match)
+    if versions is not None and version not in versions:
+        raise precondition_failed()
+    raise HTTPException(status_code=409, detail=conflict)
+
+
+def since_filter(since: datetime | None):
+    if since is None:
+        return [], []
+    return ["updated_at > %s"], [since]
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+
+import psycopg
+
+from db.codec import loads
+from db.pool import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = "changes"
+# Messages a subscriber may have queued before it counts as too slow and is disconnected.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+LISTEN_RETRY_SECONDS = 5
+# Sent when the listener reconnects: changes made meanwhile were missed, so clients refetch with ?since=.
+RESYNC_MESSAGE = '{"type": "resync"}'
+
+
+class Subscriber:
+    def __init__(self, max_queue: int):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.topics = set()
+        self.overflowed = False
+
+    def offer(self, message: str) -> bool:
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            # Never block the fan-out on one client; its sender closes the socket instead.
+            self.overflowed = True
+            return False
+
+
+class Broker:
+    # In-process fan-out by topic ("user:<id>", "planet:<id>"). Fed by the
+    # Postgres listener below, but publish() works with any other source.
+    def __init__(self, max_queue: int):
+        self.max_queue = max_queue
+        self.topics = {}
+        self.subscribers = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def connect(self):
+        subscriber = Subscriber(self.max_queue)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber: Subscriber):
+        for topic in subscriber.topics:
+            members = self.topics.get(topic)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self.topics[topic]
+        subscriber.topics.clear()
+        self.subscribers.discard(subscriber)
+
+    def subscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.add(topic)
+        self.topics.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.discard(topic)
+        members = self.topics.get(topic)
+        if members is not None:
+            members.discard(subscriber)
+            if not members:
+                del self.topics[topic]
+
+    def publish(self, topics, message: str):
+        # A subscriber on several of the message's topics still gets it once.
+        recipients = set()
+        for topic in topics:
+            recipients.update(self.topics.get(topic, ()))
+        self._deliver(recipients, message)
+
+    def broadcast(self, message: str):
+        self._deliver(self.subscribers, message)
+
+    def _deliver(self, recipients, message: str):
+        self.published += 1
+        for subscriber in recipients:
+            if subscriber.offer(message):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "topics": len(self.topics),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+broker = Broker(EVENTS_QUEUE_SIZE)
+_listener_task = None
+
+
+def _dispatch(payload: str):
+    try:
+        event = loads(payload)
+    except ValueError:
+        logger.warning("Ignoring malformed change notification: %r", payload)
+        return
+    # The payload is forwarded as-is, so it is decoded once and never re-encoded.
+    broker.publish(event.get("topics", ()), payload)
+
+
+async def _connect_listener():
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f"LISTEN {CHANGES_CHANNEL}")
+    return conn
+
+
+async def _listen(conn):
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = await _connect_listener()
+                    broker.broadcast(RESYNC_MESSAGE)
+                async for notify in conn.notifies():
+                    _dispatch(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change listener failed, retrying in %s s", LISTEN_RETRY_SECONDS)
+                if conn is not None:
+                    await conn.close()
+                    conn = None
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+async def start_events():
+    global _listener_task
+    _listener_task = asyncio.create_task(_listen(await _connect_listener()))
+
+
+async def stop_events():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
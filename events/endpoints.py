@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from uuid import UUID
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
+
+from db.codec import dumps, loads
+from events.broker import broker
+
+logger = logging.getLogger(__name__)
+
+TOPIC_KINDS = ("user", "planet")
+# 1013 "try again later": the client fell behind, reconnects and catches up with ?since=.
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+router = APIRouter()
+
+def parse_topic(topic) -> str | None:
+    kind, _, topic_id = str(topic).partition(":")
+    if kind not in TOPIC_KINDS:
+        return None
+    try:
+        return f"{kind}:{UUID(topic_id)}"
+    except ValueError:
+        return None
+
+async def send_events(websocket: WebSocket, subscriber):
+    # The only writer on the socket: fan-out and replies both go through the subscriber's queue.
+    while True:
+        message = await subscriber.queue.get()
+        if subscriber.overflowed:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Subscriber too slow")
+            return
+        try:
+            await websocket.send_text(message)
+        except WebSocketDisconnect:
+            return
+
+async def receive_commands(websocket: WebSocket, subscriber):
+    # {"action": "subscribe" | "unsubscribe", "topic": "user:<id>" | "planet:<id>"}
+    while True:
+        try:
+            text = await websocket.receive_text()
+        except WebSocketDisconnect:
+            return
+        try:
+            command = loads(text)
+            action, topic = command.get("action"), parse_topic(command.get("topic"))
+        except (ValueError, AttributeError):
+            action, topic = None, None
+        if topic is None or action not in ("subscribe", "unsubscribe"):
+            subscriber.offer(dumps({"type": "error", "detail": "Expected {action: subscribe|unsubscribe, topic: user:<id>|planet:<id>}."}).decode())
+            continue
+        if action == "subscribe":
+            broker.subscribe(subscriber, topic)
+        else:
+            broker.unsubscribe(subscriber, topic)
+        subscriber.offer(dumps({"type": action + "d", "topic": topic}).decode())
+
+@router.websocket("/ws")
+async def events_socket(
+    websocket: WebSocket,
+    user_id: list[UUID] = Query([]),
+    planet_id: list[UUID] = Query([]),
+):
+    await websocket.accept()
+    subscriber = broker.connect()
+    for topic_id in user_id:
+        broker.subscribe(subscriber, f"user:{topic_id}")
+    for topic_id in planet_id:
+        broker.subscribe(subscriber, f"planet:{topic_id}")
+    tasks = [
+        asyncio.create_task(send_events(websocket, subscriber)),
+        asyncio.create_task(receive_commands(websocket, subscriber)),
+    ]
+    try:
+        # Whichever side ends first (disconnect, slow consumer) takes the other one down.
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                logger.warning("Event socket closed on error: %r", task.exception())
+    finally:
+        for task in tasks:
+            task.cancel()
+        broker.disconnect(subscriber)
+
+@router.get("/stats")
+async def read_events_stats():
+    return broker.stats()
@@ -0,0 +1,74 @@
+"""Fill battles.winner_id for battles stored before migration 010, then refresh every score.
+
+    python -m leaderboards.backfill --batch-size 5000
+
+Migration 010 backfills battles whose log is still JSONB. Packed logs can
+only be decoded here: this walks battles and battles_archive in id order,
+reads the winner out of each packed log that has no winner_id yet, and
+writes it back. Draws and logs without a winner stay NULL. Ends with
+refresh_leaderboard_scores(), which running workers pick up over
+LISTEN. Needs DATABASE_URL with migrations applied. As a superuser it runs
+with triggers off, so clients get no change event per battle.
+"""
+import argparse
+import asyncio
+import time
+
+import psycopg
+
+from battles.log_codec import unpack_log
+from db.pool import DATABASE_URL
+
+
+async def backfill(conn, table: str, batch_size: int) -> int:
+    last_id = None
+    filled = 0
+    while True:
+        cursor = await conn.execute(
+            f"SELECT id, attacker_id, defender_id, battle_log_packed FROM {table}"
+            " WHERE winner_id IS NULL AND battle_log_packed IS NOT NULL"
+            + (" AND id > %s" if last_id else "") + " ORDER BY id LIMIT %s",
+            (last_id, batch_size) if last_id else (batch_size,),
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            return filled
+        ids, winners = [], []
+        for battle_id, attacker_id, defender_id, packed in rows:
+            winner = {"attacker": attacker_id, "defender": defender_id}.get(unpack_log(packed).get("winner"))
+            if winner is not None:
+                ids.append(battle_id)
+                winners.append(winner)
+        await conn.execute(f"""
+            UPDATE {table} SET winner_id = w.winner_id
+            FROM unnest(%s::uuid[], %s::uuid[]) AS w(id, winner_id)
+            WHERE {table}.id = w.id
+        """, (ids, winners))
+        await conn.commit()
+        filled += len(ids)
+        last_id = rows[-1][0]
+
+
+async def main(args):
+    async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
+        try:
+            await conn.execute("SET session_replication_role = replica")
+        except psycopg.errors.InsufficientPrivilege:
+            await conn.rollback()
+            print("not a superuser: backfilling with triggers on")
+        await conn.commit()
+        for table in ("battles", "battles_archive"):
+            started = time.perf_counter()
+            filled = await backfill(conn, table, args.batch_size)
+            print(f"{table:>15} {filled:>9} winners {time.perf_counter() - started:>7.1f}s")
+        await conn.execute("SET session_replication_role = DEFAULT")
+        started = time.perf_counter()
+        changed = (await (await conn.execute("SELECT refresh_leaderboard_scores()")).fetchone())[0]
+        await conn.commit()
+        print(f"{'scores':>15} {changed:>9} changed {time.perf_counter() - started:>7.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+import psycopg
+
+from auth.tokens import current_user
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from db.replicas import get_read_db
+from leaderboards.ranking import BOARDS, boards
+
+router = APIRouter()
+
+def get_board(board: str):
+    index = boards.get(board)
+    if index is None:
+        raise HTTPException(status_code=404, detail=f"Unknown leaderboard, expected one of: {', '.join(BOARDS)}.")
+    return index
+
+def user_rank(board: str, user_id: str):
+    index = get_board(board)
+    try:
+        found = index.rank(UUID(user_id).int)
+    except ValueError:
+        found = None
+    if found is None:
+        raise HTTPException(status_code=404, detail="User not ranked")
+    rank, score = found
+    return {"user_id": user_id, "rank": rank, "score": score, "total": len(index)}
+
+@router.get("/stats")
+async def read_leaderboard_stats():
+    return {board: index.stats() for board, index in boards.items()}
+
+# Ranks and scores come from this worker's in-memory index; one primary key lookup adds the usernames.
+@router.get("/{board}")
+async def read_leaderboard(
+    board: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    index = get_board(board)
+    entries = [(str(UUID(int=user_id)), score, rank) for user_id, score, rank in index.top(limit, offset)]
+    async with conn.cursor() as cursor:
+        await cursor.execute(
+            "SELECT id::text, username FROM users WHERE id = ANY(%s::uuid[])", ([user_id for user_id, _, _ in entries],),
+        )
+        usernames = dict(await cursor.fetchall())
+    return {
+        "items": [
+            {"rank": rank, "user_id": user_id, "username": usernames.get(user_id), "score": score}
+            for user_id, score, rank in entries
+        ],
+        "total": len(index),
+    }
+
+@router.get("/{board}/me")
+async def read_my_rank(board: str, user_id: str = Depends(current_user)):
+    return user_rank(board, user_id)
+
+@router.get("/{board}/users/{user_id}")
+async def read_user_rank(board: str, user_id: str):
+    return user_rank(board, user_id)
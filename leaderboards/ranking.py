@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from uuid import UUID
+
+import psycopg
+
+from db.codec import loads
+from db.pool import DATABASE_URL, connection
+
+logger = logging.getLogger(__name__)
+
+SCORES_CHANNEL = "leaderboard_scores"
+BOARDS = ("strength", "wins")
+LISTEN_RETRY_SECONDS = 5
+LOAD_BATCH_SIZE = 100000
+# Entries per bucket; a bucket splits at twice this.
+BUCKET_SIZE = 1000
+
+# An entry is one int: the negated score above the user's 128-bit UUID, so ascending
+# order is highest score first, ties by user id, and every key of a score sorts
+# between (-score << ID_BITS) and the next score's.
+ID_BITS = 128
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def _key(score: int, user_id: int) -> int:
+    return (-score << ID_BITS) + user_id
+
+
+class RankIndex:
+    # Order-statistics list: entries sorted in buckets of BUCKET_SIZE to 2 * BUCKET_SIZE,
+    # with a Fenwick tree over the bucket sizes. Rank, position and update are O(log n)
+    # plus a memmove within one bucket; the tree is rebuilt only when a bucket splits
+    # or empties, once per BUCKET_SIZE updates at most.
+    def __init__(self):
+        self.queries = 0
+        self.updates = 0
+        self.replace_all({})
+
+    def replace_all(self, scores: dict):
+        self.scores = scores
+        keys = sorted(_key(score, user_id) for user_id, score in scores.items())
+        self.buckets = [keys[i:i + BUCKET_SIZE] for i in range(0, len(keys), BUCKET_SIZE)]
+        self._reindex()
+
+    def _reindex(self):
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        tree = [0] * (len(self.buckets) + 1)
+        for i, bucket in enumerate(self.buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _add_count(self, i: int, delta: int):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> int:
+        # Entries in buckets[:i].
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position: int):
+        # Bucket and offset of the entry at position; buckets are never empty.
+        i, remaining = 0, position
+        step = 1 << len(self.buckets).bit_length()
+        while step:
+            j = i + step
+            if j < len(self.tree) and self.tree[j] <= remaining:
+                i, remaining = j, remaining - self.tree[j]
+            step >>= 1
+        return i, remaining
+
+    def _insert(self, key: int):
+        if not self.buckets:
+            self.buckets.append([key])
+            self._reindex()
+            return
+        i = min(bisect_left(self.maxes, key), len(self.buckets) - 1)
+        bucket = self.buckets[i]
+        insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * BUCKET_SIZE:
+            self.buckets[i:i + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self._reindex()
+        else:
+            self._add_count(i, 1)
+
+    def _remove(self, key: int):
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self._add_count(i, -1)
+        else:
+            del self.buckets[i]
+            self._reindex()
+
+    def set(self, user_id: int, score: int):
+        previous = self.scores.get(user_id)
+        if previous == score:
+            return
+        self.updates += 1
+        if previous is not None:
+            self._remove(_key(previous, user_id))
+        self.scores[user_id] = score
+        self._insert(_key(score, user_id))
+
+    def discard(self, user_id: int):
+        previous = self.scores.pop(user_id, None)
+        if previous is not None:
+            self.updates += 1
+            self._remove(_key(previous, user_id))
+
+    def _higher(self, score: int) -> int:
+        # Entries with a strictly higher score.
+        key = -score << ID_BITS
+        i = bisect_left(self.maxes, key)
+        if i == len(self.buckets):
+            return len(self.scores)
+        return self._prefix(i) + bisect_left(self.buckets[i], key)
+
+    def rank(self, user_id: int):
+        # (rank, score), ranks shared by ties as in 1, 2, 2, 4; None for an unknown user.
+        self.queries += 1
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self._higher(score) + 1, score
+
+    def top(self, limit: int, offset: int = 0):
+        # (user id, score, rank) for positions offset .. offset + limit - 1.
+        self.queries += 1
+        if offset >= len(self.scores):
+            return []
+        i, j = self._locate(offset)
+        entries = []
+        position, previous, rank = offset, None, None
+        while i < len(self.buckets) and len(entries) < limit:
+            for key in self.buckets[i][j:j + limit - len(entries)]:
+                score = -(key >> ID_BITS)
+                if score != previous:
+                    rank = position + 1 if previous is not None else self._higher(score) + 1
+                    previous = score
+                entries.append((key & ID_MASK, score, rank))
+                position += 1
+            i, j = i + 1, 0
+        return entries
+
+    def __len__(self):
+        return len(self.scores)
+
+    def stats(self):
+        return {"users": len(self.scores), "buckets": len(self.buckets), "queries": self.queries, "updates": self.updates}
+
+
+boards = {board: RankIndex() for board in BOARDS}
+_listener_task = None
+
+
+async def load_leaderboards():
+    scores = {board: {} for board in BOARDS}
+    async with connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor(name="leaderboard_load") as cursor:
+                cursor.itersize = LOAD_BATCH_SIZE
+                await cursor.execute(f"SELECT user_id, {', '.join(BOARDS)} FROM leaderboard_scores")
+                while rows := await cursor.fetchmany(LOAD_BATCH_SIZE):
+                    for user_id, *values in rows:
+                        for board, value in zip(BOARDS, values):
+                            scores[board][user_id.int] = value
+    for board in BOARDS:
+        boards[board].replace_all(scores[board])
+    logger.info("Leaderboards loaded: %s users", len(boards[BOARDS[0]]))
+
+
+def _apply(payload: str):
+    try:
+        change = loads(payload)
+        user_id = UUID(change["id"]).int
+    except (ValueError, KeyError):
+        logger.warning("Ignoring malformed leaderboard score: %r", payload)
+        return
+    for board, index in boards.items():
+        if board in change:
+            index.set(user_id, change[board])
+        else:
+            index.discard(user_id)
+
+
+async def _connect_listener():
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f"LISTEN {SCORES_CHANNEL}")
+    return conn
+
+
+async def _listen(conn):
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = await _connect_listener()
+                    # Scores committed while we were not listening are unknown, so reload.
+                    await load_leaderboards()
+                async for notify in conn.notifies():
+                    _apply(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Leaderboard listener failed, retrying in %s s", LISTEN_RETRY_SECONDS)
+                if conn is not None:
+                    await conn.close()
+                    conn = None
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+async def start_leaderboards():
+    global _listener_task
+    # LISTEN before the initial load so no score change can slip in between the two.
+    conn = await _connect_listener()
+    await load_leaderboards()
+    _listener_task = asyncio.create_task(_listen(conn))
+
+
+async def stop_leaderboards():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -0,0 +1,18 @@
+-- Per-row version counters for conditional GETs (ETag / If-None-Match) and
+-- updated_at timestamps for the `since` filter on list routes.
+
+ALTER TABLE planets
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE user_fleets
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE battles
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS planets_updated_at_idx ON planets (updated_at);
+CREATE INDEX IF NOT EXISTS user_fleets_updated_at_idx ON user_fleets (updated_at);
+CREATE INDEX IF NOT EXISTS battles_updated_at_idx ON battles (updated_at);
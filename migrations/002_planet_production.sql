@@ -0,0 +1,42 @@
+-- Lazy resource production. Each planet stores its per-hour production rates
+-- and the time its resources blob was last materialized; current resources
+-- are derived on read instead of being rewritten by a periodic job.
+
+ALTER TABLE buildings
+    ADD COLUMN IF NOT EXISTS production JSONB NOT NULL DEFAULT '{}';  -- per level, per hour
+
+ALTER TABLE planets
+    ADD COLUMN IF NOT EXISTS production_rates JSONB NOT NULL DEFAULT '{}',  -- per hour
+    ADD COLUMN IF NOT EXISTS resources_updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS user_buildings_planet_id_idx ON user_buildings (planet_id);
+CREATE INDEX IF NOT EXISTS user_buildings_building_id_idx ON user_buildings (building_id);
+
+-- resources + rates * elapsed hours, for every resource that has a rate.
+CREATE OR REPLACE FUNCTION accrued_resources(resources JSONB, rates JSONB, since TIMESTAMPTZ, at TIMESTAMPTZ DEFAULT now())
+RETURNS JSONB
+LANGUAGE sql STABLE AS $$
+    SELECT coalesce(resources, '{}'::jsonb) || coalesce((
+        SELECT jsonb_object_agg(
+            r.key,
+            coalesce((resources ->> r.key)::numeric, 0)
+                + r.value::numeric * greatest(extract(epoch FROM at - since), 0) / 3600
+        )
+        FROM jsonb_each_text(rates) AS r
+    ), '{}'::jsonb)
+$$;
+
+-- Sum of building production * level over every building on the planet.
+CREATE OR REPLACE FUNCTION planet_production_rates(target_planet_id UUID)
+RETURNS JSONB
+LANGUAGE sql STABLE AS $$
+    SELECT coalesce(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT p.key, sum(p.value::numeric * ub.level) AS total
+        FROM user_buildings ub
+        JOIN buildings b ON b.id = ub.building_id
+        CROSS JOIN LATERAL jsonb_each_text(b.production) AS p
+        WHERE ub.planet_id = target_planet_id
+        GROUP BY p.key
+    ) AS totals
+$$;
@@ -0,0 +1,12 @@
+-- Indexes behind the owner/user/planet filters on list routes and the
+-- GET /users/{id}/empire aggregate. Each one ends in id so a filtered,
+-- keyset-paginated list is a single index range scan.
+
+CREATE INDEX IF NOT EXISTS planets_owner_id_idx ON planets (owner_id, id);
+CREATE INDEX IF NOT EXISTS user_fleets_user_id_idx ON user_fleets (user_id, id);
+CREATE INDEX IF NOT EXISTS user_fleets_planet_id_idx ON user_fleets (planet_id, id);
+CREATE INDEX IF NOT EXISTS user_buildings_user_id_idx ON user_buildings (user_id, id);
+
+-- Replaces the plain planet_id index from 002 with one that also serves the paginated filter.
+CREATE INDEX IF NOT EXISTS user_buildings_planet_id_id_idx ON user_buildings (planet_id, id);
+DROP INDEX IF EXISTS user_buildings_planet_id_idx;
@@ -0,0 +1,36 @@
+-- Store planets.resources and buildings.resource_cost as JSONB like the other
+-- JSON columns. planets.resources already holds JSON text. Older buildings
+-- rows hold a Python repr ({'metal': 100}) and are rewritten to JSON here.
+
+BEGIN;
+
+-- Valid JSON passes through untouched; otherwise quotes and the Python
+-- literals True/False/None are mapped to their JSON spelling.
+CREATE OR REPLACE FUNCTION pg_temp.repr_to_jsonb(value TEXT)
+RETURNS JSONB
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    IF value IS NULL OR btrim(value) = '' THEN
+        RETURN '{}'::jsonb;
+    END IF;
+    BEGIN
+        RETURN value::jsonb;
+    EXCEPTION WHEN invalid_text_representation THEN
+        RETURN regexp_replace(
+            regexp_replace(
+                regexp_replace(
+                    regexp_replace(value, '''', '"', 'g'),
+                    '\mTrue\M', 'true', 'g'),
+                '\mFalse\M', 'false', 'g'),
+            '\mNone\M', 'null', 'g')::jsonb;
+    END;
+END
+$$;
+
+ALTER TABLE buildings
+    ALTER COLUMN resource_cost TYPE JSONB USING pg_temp.repr_to_jsonb(resource_cost);
+
+ALTER TABLE planets
+    ALTER COLUMN resources TYPE JSONB USING coalesce(nullif(btrim(resources), ''), '{}')::jsonb;
+
+COMMIT;
@@ -0,0 +1,49 @@
+-- Publish every committed change to user_fleets and battles on the
+-- "changes" channel, whichever write path made it (single, bulk, COPY,
+-- battle resolution). Each API worker LISTENs once and fans the payload out
+-- to its WebSocket subscribers by topic. Payloads carry ids and the new
+-- version only, since NOTIFY caps them at 8000 bytes.
+
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed RECORD;
+    topics TEXT[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'user_fleets' THEN
+        topics := ARRAY['user:' || changed.user_id, 'planet:' || changed.planet_id];
+        IF TG_OP = 'UPDATE' THEN
+            -- A fleet that moved or changed hands is news to its old owner and planet too.
+            topics := topics || ARRAY['user:' || OLD.user_id, 'planet:' || OLD.planet_id];
+        END IF;
+    ELSE
+        topics := ARRAY['user:' || changed.attacker_id, 'user:' || changed.defender_id, 'planet:' || changed.planet_id];
+    END IF;
+
+    PERFORM pg_notify('changes', json_build_object(
+        'type', TG_TABLE_NAME,
+        'op', lower(TG_OP),
+        'id', changed.id,
+        'version', changed.version,
+        'topics', (SELECT coalesce(array_agg(DISTINCT t), '{}') FROM unnest(topics) AS t WHERE t IS NOT NULL)
+    )::text);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS user_fleets_notify_change ON user_fleets;
+CREATE TRIGGER user_fleets_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON user_fleets
+    FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS battles_notify_change ON battles;
+CREATE TRIGGER battles_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON battles
+    FOR EACH ROW EXECUTE FUNCTION notify_change();
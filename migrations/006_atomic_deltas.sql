@@ -0,0 +1,23 @@
+-- Counter deltas applied inside UPDATE, so PATCH /planets/{id} and
+-- PATCH /user_fleets/{id} never read-modify-write ships or resources in the app.
+
+-- base + delta per key; keys missing on either side count as 0.
+CREATE OR REPLACE FUNCTION jsonb_add_counts(base JSONB, delta JSONB)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(base, '{}'::jsonb) || coalesce((
+        SELECT jsonb_object_agg(d.key, coalesce((base ->> d.key)::numeric, 0) + d.value::numeric)
+        FROM jsonb_each_text(delta) AS d
+    ), '{}'::jsonb)
+$$;
+
+-- True if applying delta leaves no key it touches below zero.
+CREATE OR REPLACE FUNCTION jsonb_counts_cover(base JSONB, delta JSONB)
+RETURNS BOOLEAN
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT NOT EXISTS (
+        SELECT 1
+        FROM jsonb_each_text(delta) AS d
+        WHERE coalesce((base ->> d.key)::numeric, 0) + d.value::numeric < 0
+    )
+$$;
@@ -0,0 +1,37 @@
+-- Planet coordinates for proximity queries. Each API worker keeps an in-memory
+-- grid of (id, x, y, owned) and follows changes on the "planet_positions"
+-- channel, whichever write path made them. Planets without coordinates are
+-- not indexed.
+
+ALTER TABLE planets
+    ADD COLUMN IF NOT EXISTS x DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS y DOUBLE PRECISION;
+
+CREATE OR REPLACE FUNCTION notify_planet_position()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('planet_positions', json_build_object('id', OLD.id)::text);
+    ELSE
+        PERFORM pg_notify('planet_positions', json_build_object(
+            'id', NEW.id, 'x', NEW.x, 'y', NEW.y, 'owned', NEW.owner_id IS NOT NULL
+        )::text);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS planets_notify_position ON planets;
+CREATE TRIGGER planets_notify_position
+    AFTER INSERT OR DELETE ON planets
+    FOR EACH ROW EXECUTE FUNCTION notify_planet_position();
+
+-- Only moves and ownership changes matter to the index, not resource updates.
+DROP TRIGGER IF EXISTS planets_notify_position_update ON planets;
+CREATE TRIGGER planets_notify_position_update
+    AFTER UPDATE ON planets
+    FOR EACH ROW
+    WHEN (OLD.x IS DISTINCT FROM NEW.x OR OLD.y IS DISTINCT FROM NEW.y
+          OR (OLD.owner_id IS NULL) IS DISTINCT FROM (NEW.owner_id IS NULL))
+    EXECUTE FUNCTION notify_planet_position();
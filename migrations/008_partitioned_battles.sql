@@ -0,0 +1,168 @@
+-- Range-partition battles by created_at so old battles can leave the hot
+-- table a whole partition at a time. battles_archive has the same columns
+-- and collects the partitions that battles/partitions.py archives; reads by
+-- id fall back to it, list routes only see battles.
+--
+-- New battle logs are written to battle_log_packed (see battles/log_codec.py)
+-- and battle_log stays NULL. Rows copied here keep their JSONB battle_log
+-- until their partition is archived, which rewrites them packed.
+
+BEGIN;
+
+-- Creates every missing battles partition of one `unit` (day, week or
+-- month) from the one holding `first` through the one holding `through`.
+-- Names follow the start of the range, e.g. battles_p20241001. A range
+-- already covered by a partition of another unit is skipped, so the unit
+-- can change without touching existing partitions. Partitions are created
+-- in the schema of whichever battles the search_path resolves to.
+CREATE OR REPLACE FUNCTION ensure_battle_partitions(unit TEXT, first TIMESTAMP, through TIMESTAMP)
+RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+    parent_schema TEXT;
+    lower_bound TIMESTAMP := date_trunc(unit, first);
+    upper_bound TIMESTAMP;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    IF unit NOT IN ('day', 'week', 'month') THEN
+        RAISE EXCEPTION 'Unsupported battle partition unit: %', unit;
+    END IF;
+    SELECT n.nspname INTO parent_schema
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = 'battles'::regclass;
+    WHILE lower_bound <= through LOOP
+        upper_bound := lower_bound + ('1 ' || unit)::interval;
+        partition_name := 'battles_p' || to_char(lower_bound, 'YYYYMMDD');
+        -- An archived partition keeps its name, so its range is never recreated here.
+        IF to_regclass(format('%I.%I', parent_schema, partition_name)) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE %I.%I PARTITION OF battles FOR VALUES FROM (%L) TO (%L)',
+                    parent_schema, partition_name, lower_bound, upper_bound
+                );
+                created := created + 1;
+            EXCEPTION WHEN invalid_object_definition THEN
+                -- Overlaps a partition of another unit.
+                NULL;
+            END;
+        END IF;
+        lower_bound := upper_bound;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+-- Battles were the only other notify_change table, so it was told apart by
+-- TG_TABLE_NAME. On a partitioned table that is the partition's name, so the
+-- row type now comes from the trigger argument when there is one.
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed RECORD;
+    topics TEXT[];
+    row_type TEXT := coalesce(TG_ARGV[0], TG_TABLE_NAME);
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF row_type = 'user_fleets' THEN
+        topics := ARRAY['user:' || changed.user_id, 'planet:' || changed.planet_id];
+        IF TG_OP = 'UPDATE' THEN
+            -- A fleet that moved or changed hands is news to its old owner and planet too.
+            topics := topics || ARRAY['user:' || OLD.user_id, 'planet:' || OLD.planet_id];
+        END IF;
+    ELSE
+        topics := ARRAY['user:' || changed.attacker_id, 'user:' || changed.defender_id, 'planet:' || changed.planet_id];
+    END IF;
+
+    PERFORM pg_notify('changes', json_build_object(
+        'type', row_type,
+        'op', lower(TG_OP),
+        'id', changed.id,
+        'version', changed.version,
+        'topics', (SELECT coalesce(array_agg(DISTINCT t), '{}') FROM unnest(topics) AS t WHERE t IS NOT NULL)
+    )::text);
+    RETURN NULL;
+END
+$$;
+
+DO $$
+DECLARE
+    old_pkey TEXT;
+    foreign_keys TEXT[];
+    foreign_key TEXT;
+    copy_columns TEXT;
+    copy_values TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'battles'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    -- The live table is the template: its columns, defaults, NOT NULLs and
+    -- CHECKs carry over through LIKE, and its foreign keys are re-added
+    -- below exactly as they are declared now, ON DELETE actions included.
+    SELECT conname INTO old_pkey
+    FROM pg_constraint WHERE conrelid = 'battles'::regclass AND contype = 'p';
+    SELECT coalesce(array_agg(format('CONSTRAINT %I %s', conname, pg_get_constraintdef(oid)) ORDER BY conname), '{}')
+    INTO foreign_keys
+    FROM pg_constraint WHERE conrelid = 'battles'::regclass AND contype = 'f';
+
+    ALTER TABLE battles RENAME TO battles_unpartitioned;
+    IF old_pkey IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE battles_unpartitioned RENAME CONSTRAINT %I TO battles_unpartitioned_pkey', old_pkey);
+    END IF;
+    ALTER INDEX IF EXISTS battles_updated_at_idx RENAME TO battles_unpartitioned_updated_at_idx;
+
+    -- The partition key has to be part of the primary key; ids are random
+    -- UUIDs, so (id, created_at) is as unique as id alone.
+    CREATE TABLE battles (
+        LIKE battles_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    -- New logs go to battle_log_packed and leave battle_log NULL. Every row
+    -- needs a created_at to find its partition, so one is filled in if the
+    -- live table had no default for it.
+    ALTER TABLE battles
+        ADD COLUMN IF NOT EXISTS battle_log_packed BYTEA,
+        ALTER COLUMN battle_log DROP NOT NULL;
+    IF NOT (SELECT atthasdef FROM pg_attribute WHERE attrelid = 'battles'::regclass AND attname = 'created_at') THEN
+        ALTER TABLE battles ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+
+    PERFORM ensure_battle_partitions(
+        'month',
+        coalesce((SELECT min(coalesce(created_at, updated_at::timestamp)) FROM battles_unpartitioned), now()::timestamp),
+        now()::timestamp + interval '1 month'
+    );
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+           string_agg(CASE WHEN attname = 'created_at' THEN 'coalesce(created_at, updated_at::timestamp)'
+                           ELSE quote_ident(attname) END, ', ' ORDER BY attnum)
+    INTO copy_columns, copy_values
+    FROM pg_attribute
+    WHERE attrelid = 'battles_unpartitioned'::regclass AND attnum > 0 AND NOT attisdropped;
+    EXECUTE format('INSERT INTO battles (%s) SELECT %s FROM battles_unpartitioned', copy_columns, copy_values);
+    DROP TABLE battles_unpartitioned;
+
+    FOREACH foreign_key IN ARRAY foreign_keys LOOP
+        EXECUTE format('ALTER TABLE battles ADD %s', foreign_key);
+    END LOOP;
+    CREATE INDEX battles_updated_at_idx ON battles (updated_at);
+    -- Created after the copy so moving existing rows does not notify anyone.
+    CREATE TRIGGER battles_notify_change
+        AFTER INSERT OR UPDATE OR DELETE ON battles
+        FOR EACH ROW EXECUTE FUNCTION notify_change('battles');
+
+    -- Archived battles are history: no foreign keys, so they never block deleting a user or planet.
+    CREATE TABLE battles_archive (
+        LIKE battles INCLUDING DEFAULTS,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+END
+$$;
+
+COMMIT;
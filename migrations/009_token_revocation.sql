@@ -0,0 +1,45 @@
+-- Revocation for the JWTs issued by /auth. A token is only accepted if it
+-- was issued after its user's tokens_revoked_at. Logout moves the cutoff to
+-- now, and so does any change of password_hash, whichever path makes it.
+-- Workers cache each user's cutoff and drop the entry when the user id
+-- arrives on the "token_revocations" channel (cutoff moved or user deleted).
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS tokens_revoked_at TIMESTAMPTZ;
+
+CREATE OR REPLACE FUNCTION revoke_tokens_on_password_change()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.password_hash IS DISTINCT FROM OLD.password_hash THEN
+        NEW.tokens_revoked_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION notify_token_revocation()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('token_revocations', OLD.id::text);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS users_revoke_tokens_on_password_change ON users;
+CREATE TRIGGER users_revoke_tokens_on_password_change
+    BEFORE UPDATE OF password_hash ON users
+    FOR EACH ROW EXECUTE FUNCTION revoke_tokens_on_password_change();
+
+DROP TRIGGER IF EXISTS users_notify_token_revocation ON users;
+CREATE TRIGGER users_notify_token_revocation
+    AFTER UPDATE ON users
+    FOR EACH ROW
+    WHEN (OLD.tokens_revoked_at IS DISTINCT FROM NEW.tokens_revoked_at)
+    EXECUTE FUNCTION notify_token_revocation();
+
+DROP TRIGGER IF EXISTS users_notify_token_deletion ON users;
+CREATE TRIGGER users_notify_token_deletion
+    AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_token_revocation();
@@ -0,0 +1,267 @@
+-- Leaderboards. leaderboard_scores holds one row per user: empire strength
+-- (every building level plus every ship in their fleets) and battle wins.
+-- Statement-level triggers on user_buildings, user_fleets and battles add
+-- each write's net change per user in the same transaction, whichever path
+-- made it (single routes, bulk COPY, write-behind flushes, battle
+-- resolution), so nothing ever rescans a user's empire. Each API worker
+-- ranks users in memory and follows the table on the "leaderboard_scores"
+-- channel.
+--
+-- battles.winner_id records who won; the API fills it from the log's
+-- "winner". Rows with a JSONB log are backfilled here. Packed logs can only
+-- be read by the application: run `python -m leaderboards.backfill` once
+-- after this migration.
+
+ALTER TABLE battles ADD COLUMN IF NOT EXISTS winner_id UUID;
+ALTER TABLE battles_archive ADD COLUMN IF NOT EXISTS winner_id UUID;
+
+CREATE TABLE IF NOT EXISTS leaderboard_scores (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    strength BIGINT NOT NULL DEFAULT 0,
+    wins BIGINT NOT NULL DEFAULT 0
+);
+
+-- Ships in a fleet; anything that is not a number counts as none.
+CREATE OR REPLACE FUNCTION fleet_strength(ships JSONB)
+RETURNS BIGINT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT coalesce(sum(s.value::text::numeric), 0)::bigint
+    FROM jsonb_each(CASE WHEN jsonb_typeof(ships) = 'object' THEN ships ELSE '{}'::jsonb END) AS s
+    WHERE jsonb_typeof(s.value) = 'number'
+$$;
+
+-- Net change per user from one (user, strength, wins) triple per changed row;
+-- users whose scores end up where they started are left out.
+CREATE OR REPLACE FUNCTION leaderboard_deltas(user_ids UUID[], strength_deltas BIGINT[], win_deltas BIGINT[])
+RETURNS TABLE (user_id UUID, strength BIGINT, wins BIGINT)
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT d.user_id, sum(coalesce(d.strength, 0))::bigint, sum(coalesce(d.wins, 0))::bigint
+    FROM unnest(user_ids, strength_deltas, win_deltas) AS d(user_id, strength, wins)
+    WHERE d.user_id IS NOT NULL
+    GROUP BY d.user_id
+    HAVING sum(coalesce(d.strength, 0)) <> 0 OR sum(coalesce(d.wins, 0)) <> 0
+$$;
+
+-- Rows are locked in user id order first, so two transactions touching the
+-- same users in a different order wait for each other instead of deadlocking.
+CREATE OR REPLACE FUNCTION add_leaderboard_scores(user_ids UUID[], strength_deltas BIGINT[], win_deltas BIGINT[])
+RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF user_ids IS NULL THEN
+        RETURN;
+    END IF;
+    -- Most writes change one row: one UPDATE, nothing to order.
+    IF cardinality(user_ids) = 1 THEN
+        IF coalesce(strength_deltas[1], 0) <> 0 OR coalesce(win_deltas[1], 0) <> 0 THEN
+            UPDATE leaderboard_scores
+            SET strength = strength + coalesce(strength_deltas[1], 0), wins = wins + coalesce(win_deltas[1], 0)
+            WHERE user_id = user_ids[1];
+        END IF;
+        RETURN;
+    END IF;
+    PERFORM 1 FROM leaderboard_scores s
+    WHERE s.user_id IN (SELECT d.user_id FROM leaderboard_deltas(user_ids, strength_deltas, win_deltas) AS d)
+    ORDER BY s.user_id
+    FOR UPDATE;
+
+    UPDATE leaderboard_scores s
+    SET strength = s.strength + d.strength, wins = s.wins + d.wins
+    FROM leaderboard_deltas(user_ids, strength_deltas, win_deltas) AS d
+    WHERE s.user_id = d.user_id;
+END
+$$;
+
+-- Inserts and deletes fire once per statement with every row in a transition
+-- table, so a bulk COPY or a cascade moves each user's score once. Updates
+-- fire per row, and only when the score inputs change: most update a single
+-- row, where a transition table costs several times the UPDATE itself.
+CREATE OR REPLACE FUNCTION user_fleets_leaderboard()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids UUID[];
+    deltas BIGINT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(user_id), array_agg(fleet_strength(ships)) INTO ids, deltas FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(user_id), array_agg(-fleet_strength(ships)) INTO ids, deltas FROM old_rows;
+    ELSIF OLD.user_id = NEW.user_id THEN
+        ids := ARRAY[NEW.user_id];
+        deltas := ARRAY[fleet_strength(NEW.ships) - fleet_strength(OLD.ships)];
+    ELSE
+        ids := ARRAY[NEW.user_id, OLD.user_id];
+        deltas := ARRAY[fleet_strength(NEW.ships), -fleet_strength(OLD.ships)];
+    END IF;
+    PERFORM add_leaderboard_scores(ids, deltas, NULL);
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION user_buildings_leaderboard()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids UUID[];
+    deltas BIGINT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(user_id), array_agg(coalesce(level, 0)) INTO ids, deltas FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(user_id), array_agg(-coalesce(level, 0)) INTO ids, deltas FROM old_rows;
+    ELSIF OLD.user_id = NEW.user_id THEN
+        ids := ARRAY[NEW.user_id];
+        deltas := ARRAY[coalesce(NEW.level, 0) - coalesce(OLD.level, 0)];
+    ELSE
+        ids := ARRAY[NEW.user_id, OLD.user_id];
+        deltas := ARRAY[coalesce(NEW.level, 0), -coalesce(OLD.level, 0)];
+    END IF;
+    PERFORM add_leaderboard_scores(ids, deltas, NULL);
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION battles_leaderboard()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids UUID[];
+    deltas BIGINT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(winner_id), array_agg(1::bigint) INTO ids, deltas FROM new_rows WHERE winner_id IS NOT NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(winner_id), array_agg(-1::bigint) INTO ids, deltas FROM old_rows WHERE winner_id IS NOT NULL;
+    ELSE
+        ids := ARRAY[NEW.winner_id, OLD.winner_id];
+        deltas := ARRAY[1::bigint, -1::bigint];
+    END IF;
+    PERFORM add_leaderboard_scores(ids, NULL, deltas);
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION users_leaderboard()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO leaderboard_scores (user_id) SELECT id FROM new_rows ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION notify_leaderboard_score()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('leaderboard_scores', json_build_object('id', OLD.user_id)::text);
+    ELSE
+        PERFORM pg_notify('leaderboard_scores', json_build_object(
+            'id', NEW.user_id, 'strength', NEW.strength, 'wins', NEW.wins
+        )::text);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+-- Recomputes every user's scores from scratch and returns how many rows
+-- changed. For after bulk loads that ran with triggers off, or a backfill;
+-- writes that commit while it runs can be counted twice or not at all.
+CREATE OR REPLACE FUNCTION refresh_leaderboard_scores()
+RETURNS BIGINT
+LANGUAGE sql AS $$
+    WITH refreshed AS (
+        INSERT INTO leaderboard_scores (user_id, strength, wins)
+        SELECT u.id, coalesce(b.levels, 0) + coalesce(f.ships, 0), coalesce(w.wins, 0)
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, sum(coalesce(level, 0)) AS levels FROM user_buildings GROUP BY user_id
+        ) AS b ON b.user_id = u.id
+        LEFT JOIN (
+            SELECT user_id, sum(fleet_strength(ships)) AS ships FROM user_fleets GROUP BY user_id
+        ) AS f ON f.user_id = u.id
+        LEFT JOIN (
+            SELECT winner_id, count(*) AS wins
+            FROM (SELECT winner_id FROM battles UNION ALL SELECT winner_id FROM battles_archive) AS all_battles
+            WHERE winner_id IS NOT NULL
+            GROUP BY winner_id
+        ) AS w ON w.winner_id = u.id
+        ON CONFLICT (user_id) DO UPDATE SET strength = EXCLUDED.strength, wins = EXCLUDED.wins
+        WHERE (leaderboard_scores.strength, leaderboard_scores.wins) IS DISTINCT FROM (EXCLUDED.strength, EXCLUDED.wins)
+        RETURNING 1
+    )
+    SELECT count(*) FROM refreshed
+$$;
+
+-- Only rows that still carry a JSONB log; change notifications stay quiet,
+-- nothing a client can see changes.
+ALTER TABLE battles DISABLE TRIGGER battles_notify_change;
+UPDATE battles
+SET winner_id = CASE battle_log ->> 'winner' WHEN 'attacker' THEN attacker_id WHEN 'defender' THEN defender_id END
+WHERE winner_id IS NULL AND battle_log ->> 'winner' IN ('attacker', 'defender');
+ALTER TABLE battles ENABLE TRIGGER battles_notify_change;
+UPDATE battles_archive
+SET winner_id = CASE battle_log ->> 'winner' WHEN 'attacker' THEN attacker_id WHEN 'defender' THEN defender_id END
+WHERE winner_id IS NULL AND battle_log ->> 'winner' IN ('attacker', 'defender');
+
+DROP TRIGGER IF EXISTS user_fleets_leaderboard_insert ON user_fleets;
+CREATE TRIGGER user_fleets_leaderboard_insert
+    AFTER INSERT ON user_fleets REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_fleets_leaderboard();
+DROP TRIGGER IF EXISTS user_fleets_leaderboard_update ON user_fleets;
+CREATE TRIGGER user_fleets_leaderboard_update
+    AFTER UPDATE ON user_fleets
+    FOR EACH ROW
+    WHEN (OLD.ships IS DISTINCT FROM NEW.ships OR OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION user_fleets_leaderboard();
+DROP TRIGGER IF EXISTS user_fleets_leaderboard_delete ON user_fleets;
+CREATE TRIGGER user_fleets_leaderboard_delete
+    AFTER DELETE ON user_fleets REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_fleets_leaderboard();
+
+DROP TRIGGER IF EXISTS user_buildings_leaderboard_insert ON user_buildings;
+CREATE TRIGGER user_buildings_leaderboard_insert
+    AFTER INSERT ON user_buildings REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_buildings_leaderboard();
+DROP TRIGGER IF EXISTS user_buildings_leaderboard_update ON user_buildings;
+CREATE TRIGGER user_buildings_leaderboard_update
+    AFTER UPDATE ON user_buildings
+    FOR EACH ROW
+    WHEN (OLD.level IS DISTINCT FROM NEW.level OR OLD.user_id IS DISTINCT FROM NEW.user_id)
+    EXECUTE FUNCTION user_buildings_leaderboard();
+DROP TRIGGER IF EXISTS user_buildings_leaderboard_delete ON user_buildings;
+CREATE TRIGGER user_buildings_leaderboard_delete
+    AFTER DELETE ON user_buildings REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_buildings_leaderboard();
+
+-- On the partitioned table itself: rows written through battles reach the
+-- transition tables whichever partition holds them. Moving a partition to
+-- battles_archive attaches and detaches without firing anything, so wins stay.
+DROP TRIGGER IF EXISTS battles_leaderboard_insert ON battles;
+CREATE TRIGGER battles_leaderboard_insert
+    AFTER INSERT ON battles REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION battles_leaderboard();
+DROP TRIGGER IF EXISTS battles_leaderboard_update ON battles;
+CREATE TRIGGER battles_leaderboard_update
+    AFTER UPDATE ON battles
+    FOR EACH ROW
+    WHEN (OLD.winner_id IS DISTINCT FROM NEW.winner_id)
+    EXECUTE FUNCTION battles_leaderboard();
+DROP TRIGGER IF EXISTS battles_leaderboard_delete ON battles;
+CREATE TRIGGER battles_leaderboard_delete
+    AFTER DELETE ON battles REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION battles_leaderboard();
+
+DROP TRIGGER IF EXISTS users_leaderboard_insert ON users;
+CREATE TRIGGER users_leaderboard_insert
+    AFTER INSERT ON users REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users_leaderboard();
+
+DROP TRIGGER IF EXISTS leaderboard_scores_notify ON leaderboard_scores;
+CREATE TRIGGER leaderboard_scores_notify
+    AFTER INSERT OR UPDATE OR DELETE ON leaderboard_scores
+    FOR EACH ROW EXECUTE FUNCTION notify_leaderboard_score();
+
+SELECT refresh_leaderboard_scores();
@@ -0,0 +1,39 @@
+-- Timed game events: fleets arriving at a planet and building upgrades
+-- completing. A row is pending until it fires; the worker that fires it
+-- deletes it in the same transaction as its effects, so a claimed event is
+-- either applied once or left for another try, never both. Workers claim due
+-- rows with FOR UPDATE SKIP LOCKED and split a burst between them.
+--
+-- One pending move per fleet and one pending upgrade per building; deleting
+-- the fleet, planet or building cancels its events.
+
+CREATE TABLE IF NOT EXISTS scheduled_events (
+    id UUID PRIMARY KEY,
+    kind TEXT NOT NULL CHECK (kind IN ('fleet_arrival', 'building_upgrade')),
+    due_at TIMESTAMPTZ NOT NULL,
+    user_fleet_id UUID REFERENCES user_fleets(id) ON DELETE CASCADE,
+    planet_id UUID REFERENCES planets(id) ON DELETE CASCADE,
+    user_building_id UUID REFERENCES user_buildings(id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CHECK (CASE kind
+        WHEN 'fleet_arrival' THEN user_fleet_id IS NOT NULL AND planet_id IS NOT NULL AND user_building_id IS NULL
+        ELSE user_building_id IS NOT NULL AND user_fleet_id IS NULL AND planet_id IS NULL
+    END)
+);
+
+CREATE INDEX IF NOT EXISTS scheduled_events_due_at_idx ON scheduled_events (due_at);
+-- Each id column belongs to one kind, so these also serve the cascades.
+CREATE UNIQUE INDEX IF NOT EXISTS scheduled_events_fleet_idx ON scheduled_events (user_fleet_id);
+CREATE UNIQUE INDEX IF NOT EXISTS scheduled_events_building_idx ON scheduled_events (user_building_id);
+CREATE INDEX IF NOT EXISTS scheduled_events_planet_idx ON scheduled_events (planet_id);
+
+-- Every row is inserted once and deleted once, so the table is mostly dead
+-- tuples between vacuums; claims scan the head of the due_at index and slow
+-- down when it is full of them. Vacuum after a fixed number of deletes
+-- rather than a fraction of a table that is small one moment and huge the next.
+ALTER TABLE scheduled_events SET (
+    autovacuum_vacuum_scale_factor = 0,
+    autovacuum_vacuum_threshold = 10000,
+    autovacuum_vacuum_insert_scale_factor = 0,
+    autovacuum_vacuum_insert_threshold = 10000
+);
@@ -1,115 +1,181 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 import psycopg
 from pydantic import BaseModel
-from uuid import uuid4
-import json
+from uuid import UUID, uuid4
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from db.pool import get_db
+from db.replicas import get_read_db
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, column_filters, fetch_page, stream_ndjson
+from db.versioning import (
+    etag_for, etag_matches, get_row_version, if_match_filter, not_modified, precondition_failed, reject_update,
+    since_filter,
+)
+from planets.production import CURRENT_RESOURCES_SQL
+from planets.spatial import PLANET_NEARBY_MAX_RADIUS, planet_index
 
 class Planet(BaseModel):
     name: str
-    owner_id: str
+    owner_id: str | None = None  # unowned until a user claims it
     resources: dict
     discovered_at: str
     claimed_at: str
+    x: float | None = None
+    y: float | None = None
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
-
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
-
-def get_planet_by_id(planet_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM planets WHERE id = %s", (planet_id,))
-            planet = cursor.fetchone()
-        conn.close()
-        return planet
-    return None
+class PlanetDelta(BaseModel):
+    resources: dict[str, float]  # {"metal": 500, "crystal": -100}, added to the current amounts
+
+# Clients extrapolate resources between polls from production_rates and resources_updated_at.
+PLANET_COLUMNS = (
+    f"id, name, owner_id, {CURRENT_RESOURCES_SQL} AS resources, discovered_at, claimed_at, "
+    "x, y, version, updated_at, production_rates, resources_updated_at"
+)
+
+async def get_planet_by_id(conn: psycopg.AsyncConnection, planet_id: str):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"SELECT {PLANET_COLUMNS} FROM planets WHERE id = %s", (planet_id,))
+        return await cursor.fetchone()
+
+def planet_filters(owner_id: UUID | None, since: datetime | None):
+    conditions, params = column_filters(owner_id=owner_id)
+    since_conditions, since_params = since_filter(since)
+    return conditions + since_conditions, params + since_params
 
 router = APIRouter()
 
 @router.post("/")
-def create_planet(planet: Planet):
-    conn = connect_to_db()
-    if conn:
-        planet_id = str(uuid4())
-        resources_json = json.dumps(planet.resources)
-
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO planets (id, name, owner_id, resources, discovered_at, claimed_at) 
-                VALUES (%s, %s, %s, %s, %s, %s) 
-                RETURNING id;
-            """, (planet_id, planet.name, planet.owner_id, resources_json, planet.discovered_at, planet.claimed_at))
-            conn.commit()
-        conn.close()
-        return {"id": planet_id, "name": planet.name, "owner_id": planet.owner_id}
-    raise HTTPException(status_code=500, detail="Error creating planet.")
+async def create_planet(planet: Planet, conn: psycopg.AsyncConnection = Depends(get_db)):
+    planet_id = str(uuid4())
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO planets (id, name, owner_id, resources, discovered_at, claimed_at, x, y)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id;
+        """, (planet_id, planet.name, planet.owner_id, Jsonb(planet.resources), planet.discovered_at, planet.claimed_at, planet.x, planet.y))
+        await conn.commit()
+    # Other workers catch up through the planet_positions trigger; this one sees its own write at once.
+    planet_index.put(planet_id, planet.x, planet.y, planet.owner_id is not None)
+    return {"id": planet_id, "name": planet.name, "owner_id": planet.owner_id}
+
+@router.get("/stream")
+async def stream_planets(after: str | None = None, since: datetime | None = None, owner_id: UUID | None = None):
+    conditions, params = planet_filters(owner_id, since)
+    return stream_ndjson(f"SELECT {PLANET_COLUMNS} FROM planets", conditions, params, after)
+
+# Served from this worker's in-memory grid (planets/spatial.py); no database round trip.
+@router.get("/nearby")
+async def read_nearby_planets(
+    x: float,
+    y: float,
+    radius: float = Query(..., gt=0, le=PLANET_NEARBY_MAX_RADIUS),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    unowned: bool = False,
+):
+    return {"items": planet_index.within(x, y, radius, limit, unowned)}
+
+# k nearest planets, unowned only by default: the candidates for a fleet to claim.
+@router.get("/nearest")
+async def read_nearest_planets(
+    x: float,
+    y: float,
+    k: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    unowned: bool = True,
+):
+    return {"items": planet_index.nearest(x, y, k, unowned)}
+
+@router.get("/index/stats")
+async def read_planet_index_stats():
+    return planet_index.stats()
 
 @router.get("/{planet_id}")
-def read_planet(planet_id: str):
-    planet = get_planet_by_id(planet_id)
+async def read_planet(
+    planet_id: str,
+    response: Response,
+    if_none_match: str | None = Header(None),
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    if if_none_match:
+        version = await get_row_version(conn, "planets", planet_id)
+        if version is not None and etag_matches(if_none_match, version):
+            return not_modified(version)
+    planet = await get_planet_by_id(conn, planet_id)
     if planet:
-        return {
-            "id": planet[0],
-            "name": planet[1],
-            "owner_id": planet[2],
-            "resources": json.loads(planet[3]),
-            "discovered_at": planet[4],
-            "claimed_at": planet[5]
-        }
+        response.headers["ETag"] = etag_for(planet["version"])
+        return planet
     raise HTTPException(status_code=404, detail="Planet not found")
 
 @router.get("/")
-def read_all_planets():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM planets")
-            planets = cursor.fetchall()
-        conn.close()
-        return [{
-            "id": planet[0],
-            "name": planet[1],
-            "owner_id": planet[2],
-            "resources": json.loads(planet[3]),
-            "discovered_at": planet[4],
-            "claimed_at": planet[5]
-        } for planet in planets]
-    raise HTTPException(status_code=500, detail="Error fetching planets.")
+async def read_all_planets(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    since: datetime | None = None,
+    owner_id: UUID | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    conditions, params = planet_filters(owner_id, since)
+    return await fetch_page(conn, f"SELECT {PLANET_COLUMNS} FROM planets", conditions, params, after, limit)
 
 @router.put("/{planet_id}")
-def update_planet(planet_id: str, planet: Planet):
-    conn = connect_to_db()
-    if conn:
-        resources_json = json.dumps(planet.resources)
-
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE planets 
-                SET name = %s, owner_id = %s, resources = %s, discovered_at = %s, claimed_at = %s 
-                WHERE id = %s
-            """, (planet.name, planet.owner_id, resources_json, planet.discovered_at, planet.claimed_at, planet_id))
-            conn.commit()
-        conn.close()
-        return {"message": "Planet updated successfully"}
-    raise HTTPException(status_code=500, detail="Error updating planet.")
+async def update_planet(
+    planet_id: str,
+    planet: Planet,
+    response: Response,
+    if_match: str | None = Header(None),
+    conn: psycopg.AsyncConnection = Depends(get_db),
+):
+    conditions, params = if_match_filter(if_match)
+    where = " AND ".join(["id = %s"] + conditions)
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"""
+            UPDATE planets
+            SET name = %s, owner_id = %s, resources = %s, discovered_at = %s, claimed_at = %s, x = %s, y = %s,
+                resources_updated_at = now(), version = version + 1, updated_at = now()
+            WHERE {where}
+            RETURNING version
+        """, (planet.name, planet.owner_id, Jsonb(planet.resources), planet.discovered_at, planet.claimed_at,
+              planet.x, planet.y, planet_id, *params))
+        updated = await cursor.fetchone()
+        await conn.commit()
+    if updated:
+        response.headers["ETag"] = etag_for(updated[0])
+        planet_index.put(planet_id, planet.x, planet.y, planet.owner_id is not None)
+    elif if_match:
+        raise precondition_failed()
+    return {"message": "Planet updated successfully"}
+
+# Adds the deltas to the accrued amounts in one UPDATE, so concurrent writers never
+# overwrite each other. A delta that would take a resource below zero is rejected.
+@router.patch("/{planet_id}")
+async def patch_planet_resources(
+    planet_id: str,
+    delta: PlanetDelta,
+    response: Response,
+    if_match: str | None = Header(None),
+    conn: psycopg.AsyncConnection = Depends(get_db),
+):
+    conditions, params = if_match_filter(if_match)
+    where = " AND ".join(["id = %s", f"jsonb_counts_cover({CURRENT_RESOURCES_SQL}, %s)"] + conditions)
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"""
+            UPDATE planets
+            SET resources = jsonb_add_counts({CURRENT_RESOURCES_SQL}, %s),
+                resources_updated_at = now(), version = version + 1, updated_at = now()
+            WHERE {where}
+            RETURNING version, resources
+        """, (Jsonb(delta.resources), planet_id, Jsonb(delta.resources), *params))
+        updated = await cursor.fetchone()
+        await conn.commit()
+    if updated is None:
+        await reject_update(conn, "planets", planet_id, if_match, "Planet not found", "Not enough resources")
+    response.headers["ETag"] = etag_for(updated[0])
+    return {"id": planet_id, "resources": updated[1], "version": updated[0]}
 
 @router.delete("/{planet_id}")
-def delete_planet(planet_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM planets WHERE id = %s", (planet_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "Planet deleted successfully"}
-    raise HTTPException(status_code=500, detail="Error deleting planet.")
+async def delete_planet(planet_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM planets WHERE id = %s", (planet_id,))
+        await conn.commit()
+    planet_index.discard(planet_id)
+    return {"message": "Planet deleted successfully"}
@@ -0,0 +1,38 @@
+import psycopg
+
+# SQL expression for a planet's resources as of now. Production accrues lazily:
+# nothing rewrites resources on a timer, reads add rate * elapsed on the fly.
+CURRENT_RESOURCES_SQL = "accrued_resources(resources, production_rates, resources_updated_at)"
+
+
+async def refresh_production(conn: psycopg.AsyncConnection, planet_ids):
+    # Bank what was produced at the old rates, then switch to the new ones. Runs in
+    # the caller's transaction, so only planets whose buildings changed are touched.
+    planet_ids = sorted({str(planet_id) for planet_id in planet_ids if planet_id})
+    if not planet_ids:
+        return
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"""
+            UPDATE planets
+            SET resources = {CURRENT_RESOURCES_SQL},
+                production_rates = planet_production_rates(id),
+                resources_updated_at = now(),
+                version = version + 1,
+                updated_at = now()
+            WHERE id = ANY(%s::uuid[])
+        """, (planet_ids,))
+
+
+async def planets_with_building(conn: psycopg.AsyncConnection, building_id: str):
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT DISTINCT planet_id FROM user_buildings WHERE building_id = %s", (building_id,))
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def planets_of_user_buildings(conn: psycopg.AsyncConnection, user_building_ids: list):
+    async with conn.cursor() as cursor:
+        await cursor.execute(
+            "SELECT DISTINCT planet_id FROM user_buildings WHERE id = ANY(%s::uuid[])",
+            (user_building_ids,),
+        )
+        return [row[0] for row in await cursor.fetchall()]
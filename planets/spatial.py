@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import math
+import os
+
+import numpy as np
+import psycopg
+
+from db.codec import loads
+from db.pool import DATABASE_URL, connection
+
+logger = logging.getLogger(__name__)
+
+POSITIONS_CHANNEL = "planet_positions"
+# Side of a grid cell in map units. Queries are fastest with a few dozen planets per cell.
+PLANET_GRID_CELL = float(os.getenv("PLANET_GRID_CELL", "50"))
+# Bounds how many cells a single /planets/nearby query may walk.
+PLANET_NEARBY_MAX_RADIUS = float(os.getenv("PLANET_NEARBY_MAX_RADIUS", "1000"))
+LISTEN_RETRY_SECONDS = 5
+LOAD_BATCH_SIZE = 100000
+
+
+def _cell(cx: int, cy: int) -> int:
+    # Both cell coordinates packed into one int key, same layout as the numpy build in replace_all.
+    return (cx << 32) | (cy & 0xFFFFFFFF)
+
+
+class PlanetIndex:
+    # Uniform grid over planet coordinates. Positions live in numpy arrays indexed by
+    # slot and each cell lists the slots inside it, so a query only touches nearby cells.
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.queries = 0
+        self.updates = 0
+        self.full_scans = 0
+        self.replace_all([], np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+
+    def replace_all(self, ids: list, xs, ys, owned):
+        capacity = max(1024, len(ids))
+        self.ids = list(ids) + [None] * (capacity - len(ids))
+        self.slot_of = {planet_id: slot for slot, planet_id in enumerate(ids)}
+        self.free = list(range(capacity - 1, len(ids) - 1, -1))
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.owned = np.zeros(capacity, dtype=bool)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.cell_of = np.zeros(capacity, dtype=np.int64)
+        n = len(ids)
+        self.x[:n], self.y[:n], self.owned[:n], self.alive[:n] = xs, ys, owned, True
+        cx = np.floor(self.x[:n] / self.cell_size).astype(np.int64)
+        cy = np.floor(self.y[:n] / self.cell_size).astype(np.int64)
+        self.cell_of[:n] = (cx << 32) | (cy & 0xFFFFFFFF)
+        order = np.argsort(self.cell_of[:n], kind="stable")
+        keys = self.cell_of[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if n else np.empty(0, dtype=np.int64)
+        ends = np.r_[starts[1:], n]
+        self.cells = {int(keys[s]): order[s:e].tolist() for s, e in zip(starts, ends)}
+        # Occupied cell range; only grows between full loads, which keeps ring searches correct.
+        self.bounds = (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max())) if n else None
+
+    def _grow(self):
+        capacity = len(self.ids)
+        self.ids.extend([None] * capacity)
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+        for name in ("x", "y", "owned", "alive", "cell_of"):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+    def put(self, planet_id: str, x: float | None, y: float | None, owned: bool):
+        if x is None or y is None:
+            self.discard(planet_id)
+            return
+        self.updates += 1
+        cx, cy = math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+        key = _cell(cx, cy)
+        slot = self.slot_of.get(planet_id)
+        if slot is None:
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.slot_of[planet_id] = slot
+            self.ids[slot] = planet_id
+            self.alive[slot] = True
+            self.cells.setdefault(key, []).append(slot)
+        elif self.cell_of[slot] != key:
+            self._unlink(slot)
+            self.cells.setdefault(key, []).append(slot)
+        self.x[slot], self.y[slot], self.owned[slot], self.cell_of[slot] = x, y, owned, key
+        if self.bounds is None:
+            self.bounds = (cx, cx, cy, cy)
+        else:
+            min_cx, max_cx, min_cy, max_cy = self.bounds
+            self.bounds = (min(min_cx, cx), max(max_cx, cx), min(min_cy, cy), max(max_cy, cy))
+
+    def discard(self, planet_id: str):
+        slot = self.slot_of.pop(planet_id, None)
+        if slot is None:
+            return
+        self.updates += 1
+        self._unlink(slot)
+        self.ids[slot] = None
+        self.alive[slot] = False
+        self.free.append(slot)
+
+    def _unlink(self, slot: int):
+        key = int(self.cell_of[slot])
+        members = self.cells[key]
+        members.remove(slot)
+        if not members:
+            del self.cells[key]
+
+    def _candidates(self, slots, unowned: bool):
+        slots = np.fromiter(slots, dtype=np.intp)
+        if unowned:
+            slots = slots[~self.owned[slots]]
+        return slots
+
+    def _all_slots(self, unowned: bool):
+        self.full_scans += 1
+        mask = self.alive & ~self.owned if unowned else self.alive
+        return np.flatnonzero(mask)
+
+    def _distances(self, slots, x: float, y: float):
+        return (self.x[slots] - x) ** 2 + (self.y[slots] - y) ** 2
+
+    def _closest(self, slots, d2, limit: int):
+        if len(slots) > limit:
+            keep = np.argpartition(d2, limit - 1)[:limit]
+            slots, d2 = slots[keep], d2[keep]
+        order = np.argsort(d2, kind="stable")
+        slots, d2 = slots[order], d2[order]
+        return [
+            {"id": self.ids[slot], "x": px, "y": py, "owned": owned, "distance": math.sqrt(squared)}
+            for slot, px, py, owned, squared in zip(
+                slots.tolist(), self.x[slots].tolist(), self.y[slots].tolist(), self.owned[slots].tolist(), d2.tolist(),
+            )
+        ]
+
+    def within(self, x: float, y: float, radius: float, limit: int, unowned: bool = False):
+        # Planets within radius of (x, y), nearest first.
+        self.queries += 1
+        size = self.cell_size
+        x0, x1 = math.floor((x - radius) / size), math.floor((x + radius) / size)
+        y0, y1 = math.floor((y - radius) / size), math.floor((y + radius) / size)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            slots = self._all_slots(unowned)
+        else:
+            cells = self.cells
+            slots = self._candidates((
+                slot
+                for cx in range(x0, x1 + 1)
+                for cy in range(y0, y1 + 1)
+                for slot in cells.get(_cell(cx, cy), ())
+            ), unowned)
+        d2 = self._distances(slots, x, y)
+        inside = d2 <= radius * radius
+        return self._closest(slots[inside], d2[inside], limit)
+
+    def nearest(self, x: float, y: float, k: int, unowned: bool = False):
+        # k nearest planets to (x, y). Searches rings of cells outward and stops once
+        # the k-th best is closer than anything the next ring could hold.
+        self.queries += 1
+        if self.bounds is None:
+            return []
+        size = self.cell_size
+        cx, cy = math.floor(x / size), math.floor(y / size)
+        min_cx, max_cx, min_cy, max_cy = self.bounds
+        max_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy, 0)
+        cells = self.cells
+        found_slots, found_d2 = [], []
+        count = 0
+        for ring in range(max_ring + 1):
+            if 8 * ring > len(cells):
+                # Sparse matches far away: one pass over every planet beats walking empty rings.
+                slots = self._all_slots(unowned)
+                return self._closest(slots, self._distances(slots, x, y), k)
+            if ring == 0:
+                ring_cells = [(cx, cy)]
+            else:
+                ring_cells = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+                ring_cells += [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+            slots = self._candidates((slot for c in ring_cells for slot in cells.get(_cell(*c), ())), unowned)
+            if len(slots):
+                found_slots.append(slots)
+                found_d2.append(self._distances(slots, x, y))
+                count += len(slots)
+            if count >= k:
+                d2 = np.concatenate(found_d2)
+                kth = np.partition(d2, k - 1)[k - 1]
+                if kth <= (ring * size) ** 2:
+                    return self._closest(np.concatenate(found_slots), d2, k)
+                found_slots, found_d2 = [np.concatenate(found_slots)], [d2]
+        if not found_slots:
+            return []
+        return self._closest(np.concatenate(found_slots), np.concatenate(found_d2), k)
+
+    def stats(self):
+        return {
+            "planets": len(self.slot_of),
+            "cells": len(self.cells),
+            "cell_size": self.cell_size,
+            "queries": self.queries,
+            "updates": self.updates,
+            "full_scans": self.full_scans,
+        }
+
+
+planet_index = PlanetIndex(PLANET_GRID_CELL)
+_listener_task = None
+
+
+async def load_planet_index():
+    ids, xs, ys, owned = [], [], [], []
+    async with connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor(name="planet_index_load") as cursor:
+                cursor.itersize = LOAD_BATCH_SIZE
+                await cursor.execute(
+                    "SELECT id::text, x, y, owner_id IS NOT NULL FROM planets WHERE x IS NOT NULL AND y IS NOT NULL"
+                )
+                while rows := await cursor.fetchmany(LOAD_BATCH_SIZE):
+                    for planet_id, x, y, is_owned in rows:
+                        ids.append(planet_id)
+                        xs.append(x)
+                        ys.append(y)
+                        owned.append(is_owned)
+    planet_index.replace_all(ids, np.array(xs, dtype=float), np.array(ys, dtype=float), np.array(owned, dtype=bool))
+    logger.info("Planet index loaded: %s planets in %s cells", len(ids), len(planet_index.cells))
+
+
+def _apply(payload: str):
+    try:
+        change = loads(payload)
+    except ValueError:
+        logger.warning("Ignoring malformed planet position: %r", payload)
+        return
+    if "x" in change:
+        planet_index.put(change["id"], change["x"], change["y"], change["owned"])
+    else:
+        planet_index.discard(change["id"])
+
+
+async def _connect_listener():
+    conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    await conn.execute(f"LISTEN {POSITIONS_CHANNEL}")
+    return conn
+
+
+async def _listen(conn):
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = await _connect_listener()
+                    # Moves committed while we were not listening are unknown, so reload.
+                    await load_planet_index()
+                async for notify in conn.notifies():
+                    _apply(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Planet index listener failed, retrying in %s s", LISTEN_RETRY_SECONDS)
+                if conn is not None:
+                    await conn.close()
+                    conn = None
+                await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+async def start_planet_index():
+    global _listener_task
+    # LISTEN before the initial load so no move can slip in between the two.
+    conn = await _connect_listener()
+    await load_planet_index()
+    _listener_task = asyncio.create_task(_listen(conn))
+
+
+async def stop_planet_index():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -0,0 +1,162 @@
+import math
+from uuid import UUID, uuid4
+
+import psycopg
+from fastapi import APIRouter, Depends, HTTPException, Query
+from psycopg.rows import dict_row
+from pydantic import BaseModel
+
+from db.bulk import bulk_error, check_bulk_size
+from db.pool import get_db
+from db.replicas import get_read_db
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, column_filters, fetch_page
+from scheduler.runner import scheduler
+
+class FleetMove(BaseModel):
+    user_fleet_id: str
+    planet_id: str  # destination
+    travel_seconds: float
+
+class BuildingUpgrade(BaseModel):
+    user_building_id: str
+    build_seconds: float
+
+SCHEDULED_EVENT_COLUMNS = "id, kind, due_at, user_fleet_id, planet_id, user_building_id, created_at"
+
+# due_at comes from the database clock, the one the scheduler claims by.
+INSERT_MOVES_SQL = """
+    INSERT INTO scheduled_events (id, kind, due_at, user_fleet_id, planet_id)
+    SELECT m.id, 'fleet_arrival', now() + m.seconds * interval '1 second', m.user_fleet_id, m.planet_id
+    FROM unnest(%s::uuid[], %s::float8[], %s::uuid[], %s::uuid[]) AS m(id, seconds, user_fleet_id, planet_id)
+    RETURNING id, due_at, extract(epoch FROM due_at)::float8
+"""
+INSERT_UPGRADES_SQL = """
+    INSERT INTO scheduled_events (id, kind, due_at, user_building_id)
+    SELECT u.id, 'building_upgrade', now() + u.seconds * interval '1 second', u.user_building_id
+    FROM unnest(%s::uuid[], %s::float8[], %s::uuid[]) AS u(id, seconds, user_building_id)
+    RETURNING id, due_at, extract(epoch FROM due_at)::float8
+"""
+
+def check_duration(seconds: float):
+    if not math.isfinite(seconds) or seconds < 0:
+        raise HTTPException(status_code=422, detail="Durations must be finite and not negative.")
+
+async def insert_events(conn: psycopg.AsyncConnection, query: str, columns: list):
+    # Inserts and commits, then hands the due times to this worker's scheduler; returns {id: due_at}.
+    async with conn.cursor() as cursor:
+        await cursor.execute(query, columns)
+        rows = await cursor.fetchall()
+    await conn.commit()
+    scheduler.push([row[2] for row in rows])
+    return {str(row[0]): row[1] for row in rows}
+
+async def schedule_moves(conn: psycopg.AsyncConnection, moves: list[FleetMove]):
+    for move in moves:
+        check_duration(move.travel_seconds)
+    ids = [str(uuid4()) for _ in moves]
+    return ids, await insert_events(conn, INSERT_MOVES_SQL, [
+        ids, [move.travel_seconds for move in moves], [move.user_fleet_id for move in moves], [move.planet_id for move in moves],
+    ])
+
+async def schedule_upgrades(conn: psycopg.AsyncConnection, upgrades: list[BuildingUpgrade]):
+    for upgrade in upgrades:
+        check_duration(upgrade.build_seconds)
+    ids = [str(uuid4()) for _ in upgrades]
+    return ids, await insert_events(conn, INSERT_UPGRADES_SQL, [
+        ids, [upgrade.build_seconds for upgrade in upgrades], [upgrade.user_building_id for upgrade in upgrades],
+    ])
+
+router = APIRouter()
+
+@router.post("/fleet_moves")
+async def create_fleet_move(move: FleetMove, conn: psycopg.AsyncConnection = Depends(get_db)):
+    # The fleet stays where it is until it arrives; arriving at another user's planet starts a battle
+    # with the strongest fleet they keep there.
+    try:
+        ids, due = await schedule_moves(conn, [move])
+    except psycopg.errors.UniqueViolation:
+        raise HTTPException(status_code=409, detail="User fleet is already moving")
+    except psycopg.errors.ForeignKeyViolation:
+        raise HTTPException(status_code=404, detail="User fleet or planet not found")
+    except psycopg.DataError:
+        raise HTTPException(status_code=422, detail="Ids must be UUIDs.")
+    return {"id": ids[0], "kind": "fleet_arrival", "due_at": due[ids[0]], **move.model_dump()}
+
+@router.post("/fleet_moves/bulk")
+async def create_fleet_moves_bulk(moves: list[FleetMove], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(moves)
+    try:
+        ids, due = await schedule_moves(conn, moves)
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": event_id, "status": "scheduled", "due_at": due[event_id]} for event_id in ids]
+
+@router.post("/building_upgrades")
+async def create_building_upgrade(upgrade: BuildingUpgrade, conn: psycopg.AsyncConnection = Depends(get_db)):
+    # Completing raises the building's level by one and rebanks its planet's production.
+    try:
+        ids, due = await schedule_upgrades(conn, [upgrade])
+    except psycopg.errors.UniqueViolation:
+        raise HTTPException(status_code=409, detail="User building is already upgrading")
+    except psycopg.errors.ForeignKeyViolation:
+        raise HTTPException(status_code=404, detail="User building not found")
+    except psycopg.DataError:
+        raise HTTPException(status_code=422, detail="Ids must be UUIDs.")
+    return {"id": ids[0], "kind": "building_upgrade", "due_at": due[ids[0]], **upgrade.model_dump()}
+
+@router.post("/building_upgrades/bulk")
+async def create_building_upgrades_bulk(upgrades: list[BuildingUpgrade], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(upgrades)
+    try:
+        ids, due = await schedule_upgrades(conn, upgrades)
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": event_id, "status": "scheduled", "due_at": due[event_id]} for event_id in ids]
+
+@router.get("/stats")
+async def read_scheduler_stats(conn: psycopg.AsyncConnection = Depends(get_db)):
+    # overdue counts every worker's backlog, not just this one's: events due but not fired yet.
+    cursor = await conn.execute("""
+        SELECT count(*), extract(epoch FROM now() - min(due_at))::float8
+        FROM scheduled_events WHERE due_at <= now()
+    """)
+    overdue, oldest = await cursor.fetchone()
+    return {**scheduler.stats(), "overdue": overdue, "oldest_overdue_seconds": oldest}
+
+@router.get("/{event_id}")
+async def read_scheduled_event(event_id: str, conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    try:
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(f"SELECT {SCHEDULED_EVENT_COLUMNS} FROM scheduled_events WHERE id = %s", (event_id,))
+            event = await cursor.fetchone()
+    except psycopg.DataError:
+        event = None
+    if event:
+        return event
+    raise HTTPException(status_code=404, detail="Scheduled event not found")
+
+@router.get("/")
+async def read_all_scheduled_events(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    user_fleet_id: UUID | None = None,
+    planet_id: UUID | None = None,
+    user_building_id: UUID | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    conditions, params = column_filters(user_fleet_id=user_fleet_id, planet_id=planet_id, user_building_id=user_building_id)
+    return await fetch_page(conn, f"SELECT {SCHEDULED_EVENT_COLUMNS} FROM scheduled_events", conditions, params, after, limit)
+
+@router.delete("/{event_id}")
+async def cancel_scheduled_event(event_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    # Waits for a worker that is firing the event right now, then finds it gone.
+    try:
+        cursor = await conn.execute("DELETE FROM scheduled_events WHERE id = %s", (event_id,))
+    except psycopg.DataError:
+        raise HTTPException(status_code=404, detail="Scheduled event not found")
+    await conn.commit()
+    if not cursor.rowcount:
+        raise HTTPException(status_code=404, detail="Scheduled event not found (it may have fired)")
+    return {"message": "Scheduled event cancelled"}
@@ -0,0 +1,353 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+from collections import deque
+
+import psycopg
+from prometheus_client import Histogram
+
+from battles.batch import resolve_battles
+from db.pool import connection
+from planets.production import refresh_production
+from user_fleets.write_behind import fleet_buffer
+
+logger = logging.getLogger(__name__)
+
+# Fire scheduled_events (migration 011) from this worker; every worker can, SKIP LOCKED keeps them apart.
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Due times this far ahead are held in memory, so a worker sleeps until the next one instead of polling.
+SCHEDULER_HORIZON_SECONDS = float(os.getenv("SCHEDULER_HORIZON_SECONDS", "60"))
+# Due times are rounded up to ticks of this size: events in one tick fire together, and memory is
+# bounded by horizon / tick however many events there are.
+SCHEDULER_TICK_MS = float(os.getenv("SCHEDULER_TICK_MS", "10"))
+# Events claimed and applied per transaction, and transactions run at once per worker.
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "2"))
+# Longest a worker sleeps without claiming. Events another worker scheduled after this one last read
+# the table are that worker's to wake for; this bounds their lag if it died first.
+SCHEDULER_SWEEP_INTERVAL = float(os.getenv("SCHEDULER_SWEEP_INTERVAL", "1"))
+# Recent lags kept for the percentiles in /scheduler/stats.
+LAG_SAMPLES = 10000
+# How long a batch waits for a row lock before it gives its events back and tries again, so a lock
+# held elsewhere can stall the scheduler for a moment but never hang it.
+SCHEDULER_LOCK_TIMEOUT = "5s"
+
+EVENT_COLUMNS = """
+    id, kind, user_fleet_id, planet_id, user_building_id, extract(epoch FROM now() - due_at)::float8
+"""
+# Deletes the claimed rows in the transaction that applies them: a rollback puts them back.
+CLAIM_SQL = f"""
+    DELETE FROM scheduled_events
+    WHERE id IN (
+        SELECT id FROM scheduled_events
+        WHERE due_at <= now()
+        ORDER BY due_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING {EVENT_COLUMNS}
+"""
+CLAIM_ONE_SQL = f"""
+    DELETE FROM scheduled_events
+    WHERE id IN (SELECT id FROM scheduled_events WHERE id = %s AND due_at <= now() FOR UPDATE SKIP LOCKED)
+    RETURNING {EVENT_COLUMNS}
+"""
+# The arriving fleet fights the strongest fleet the planet's owner has there, if that is someone else.
+DEFENDERS_SQL = """
+    SELECT DISTINCT ON (a.id) a.id, d.id
+    FROM unnest(%s::uuid[]) AS a(id)
+    JOIN user_fleets f ON f.id = a.id
+    JOIN planets p ON p.id = f.planet_id
+    JOIN user_fleets d ON d.planet_id = p.id AND d.user_id = p.owner_id
+    WHERE p.owner_id <> f.user_id
+    ORDER BY a.id, fleet_strength(d.ships) DESC, d.id
+"""
+
+# Upgrades and battles add to their users' leaderboard rows statement by statement, in whatever order
+# the batch reaches them. Taking every row a batch can touch up front, in user order like
+# add_leaderboard_scores does, keeps two batches from deadlocking on each other's users.
+LOCK_SCORES_SQL = """
+    SELECT 1 FROM leaderboard_scores
+    WHERE user_id IN (
+        SELECT user_id FROM user_buildings WHERE id = ANY(%s::uuid[])
+        UNION SELECT user_id FROM user_fleets WHERE id = ANY(%s::uuid[])
+        UNION SELECT owner_id FROM planets WHERE id = ANY(%s::uuid[])
+    )
+    ORDER BY user_id
+    FOR UPDATE
+"""
+
+SCHEDULER_EVENT_LAG = Histogram(
+    "scheduler_event_lag_seconds", "Time from an event's due_at to the commit that fired it.", ["kind"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+async def apply_upgrades(conn: psycopg.AsyncConnection, events: list):
+    if not events:
+        return
+    async with conn.cursor() as cursor:
+        await cursor.execute(
+            "UPDATE user_buildings SET level = level + 1 WHERE id = ANY(%s::uuid[]) RETURNING planet_id",
+            ([event[4] for event in events],),
+        )
+        await refresh_production(conn, [row[0] for row in await cursor.fetchall()])
+
+
+async def apply_arrivals(conn: psycopg.AsyncConnection, events: list) -> int:
+    # Moves the fleets, then resolves the battles they arrive into; returns how many were fought.
+    # Buffered fleet writes must be flushed before the caller's transaction locks anything.
+    if not events:
+        return 0
+    planet_by_fleet = {str(event[2]): event[3] for event in events}
+    fleet_ids = sorted(planet_by_fleet)
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            UPDATE user_fleets f
+            SET planet_id = a.planet_id, version = f.version + 1, updated_at = now()
+            FROM unnest(%s::uuid[], %s::uuid[]) AS a(id, planet_id)
+            WHERE f.id = a.id
+        """, (fleet_ids, [planet_by_fleet[fleet_id] for fleet_id in fleet_ids]))
+        await cursor.execute(DEFENDERS_SQL, (fleet_ids,))
+        pairs = [(str(attacker), str(defender)) for attacker, defender in await cursor.fetchall()]
+
+    # resolve_battles lets a fleet fight once per call, so a fleet that several others arrive
+    # against meets them one round at a time, each round with what the last one left of it.
+    fought = 0
+    while pairs:
+        busy, battles, later = set(), [], []
+        for attacker, defender in pairs:
+            if attacker in busy or defender in busy:
+                later.append((attacker, defender))
+                continue
+            busy.update((attacker, defender))
+            battles.append((attacker, defender, None))
+        for (attacker, defender, _), result in zip(battles, await resolve_battles(conn, battles)):
+            if result["status"] == "resolved":
+                fought += 1
+            else:
+                logger.warning("Fleet %s arrived but could not fight %s: %s", attacker, defender, result["detail"])
+        pairs = later
+    return fought
+
+
+class Scheduler:
+    # Per worker: a min-heap of the ticks at which known events fall due, filled from the table a
+    # horizon at a time and by push() as this worker schedules new ones. The worker sleeps until the
+    # earliest tick, then claims every due row in batches, whoever scheduled it. Times are database
+    # epoch seconds, so due_at and the claim's now() agree whatever the local clock says.
+    def __init__(self, horizon: float, tick: float, batch_size: int, concurrency: int, sweep_interval: float):
+        self.horizon = horizon
+        self.tick = tick
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.sweep_interval = sweep_interval
+        self.ticks = []
+        self.known = set()
+        # Ticks before this one have been read from the table.
+        self.loaded_until = None
+        # Database clock minus local clock, measured at each refill.
+        self.clock_offset = 0.0
+        self.wake = None
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.fired = {"fleet_arrival": 0, "building_upgrade": 0}
+        self.battles = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_lag_seconds = 0.0
+
+    def now(self) -> float:
+        return time.time() + self.clock_offset
+
+    def tick_of(self, epoch: float) -> int:
+        return math.ceil(epoch / self.tick)
+
+    def _add(self, tick: int):
+        if tick not in self.known:
+            self.known.add(tick)
+            heapq.heappush(self.ticks, tick)
+
+    def push(self, due_epochs):
+        # Called by the routes once new events are committed. Anything past the horizon is left
+        # for a later refill, which keeps the heap bounded.
+        if self.wake is None:
+            return
+        earliest = self.ticks[0] if self.ticks else None
+        last = self.tick_of(self.now() + self.horizon)
+        for due in due_epochs:
+            tick = self.tick_of(due)
+            if tick <= last:
+                self._add(tick)
+        if self.ticks and (earliest is None or self.ticks[0] < earliest):
+            self.wake.set()
+
+    async def refill(self):
+        async with connection() as conn:
+            sent = time.time()
+            row = await (await conn.execute("SELECT extract(epoch FROM clock_timestamp())::float8")).fetchone()
+            self.clock_offset = row[0] - (sent + time.time()) / 2
+            start = self.loaded_until if self.loaded_until is not None else self.tick_of(self.now())
+            end = self.tick_of(self.now() + self.horizon)
+            if end <= start:
+                return
+            cursor = await conn.execute("""
+                SELECT DISTINCT ceil(extract(epoch FROM due_at) / %s)::bigint
+                FROM scheduled_events
+                WHERE due_at >= to_timestamp(%s) AND due_at < to_timestamp(%s)
+            """, (self.tick, start * self.tick, end * self.tick))
+            for (tick,) in await cursor.fetchall():
+                self._add(tick)
+        self.loaded_until = end
+
+    def _record(self, events: list, elapsed: float):
+        for event in events:
+            lag = event[5] + elapsed
+            self.fired[event[1]] += 1
+            self.lags.append(lag)
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            SCHEDULER_EVENT_LAG.labels(event[1]).observe(lag)
+
+    async def _apply(self, conn, query: str, params: tuple) -> int:
+        # The flush commits on conn and writes fleets this batch may lock, so it goes out before the
+        # transaction starts; resolve_battles then finds conn inside one and leaves the buffer alone.
+        await fleet_buffer.flush(conn)
+        started = time.monotonic()
+        await conn.execute(f"SET LOCAL lock_timeout = '{SCHEDULER_LOCK_TIMEOUT}'")
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            events = await cursor.fetchall()
+        if not events:
+            await conn.rollback()
+            return 0
+        await conn.execute(LOCK_SCORES_SQL, (
+            [event[4] for event in events if event[4]], [event[2] for event in events if event[2]],
+            [event[3] for event in events if event[3]],
+        ))
+        await apply_upgrades(conn, [event for event in events if event[1] == "building_upgrade"])
+        battles = await apply_arrivals(conn, [event for event in events if event[1] == "fleet_arrival"])
+        await conn.commit()
+        self.batches += 1
+        self.battles += battles
+        self._record(events, time.monotonic() - started)
+        return len(events)
+
+    async def _apply_one_by_one(self, conn):
+        # An event that can no longer apply must not block the rest forever: fire the due ones
+        # singly and drop the failures, like rejected write-behind updates.
+        cursor = await conn.execute(
+            "SELECT id FROM scheduled_events WHERE due_at <= now() ORDER BY due_at LIMIT %s", (self.batch_size,),
+        )
+        event_ids = [row[0] for row in await cursor.fetchall()]
+        await conn.rollback()
+        for event_id in event_ids:
+            try:
+                await self._apply(conn, CLAIM_ONE_SQL, (event_id,))
+            except (psycopg.IntegrityError, psycopg.DataError) as e:
+                await conn.rollback()
+                await conn.execute("DELETE FROM scheduled_events WHERE id = %s", (event_id,))
+                await conn.commit()
+                self.dropped += 1
+                logger.error("Dropping scheduled event %s: %s", event_id, e)
+
+    async def fire_batch(self) -> bool:
+        # True while there may be more due events to claim.
+        async with connection() as conn:
+            try:
+                return await self._apply(conn, CLAIM_SQL, (self.batch_size,)) == self.batch_size
+            except (psycopg.errors.DeadlockDetected, psycopg.errors.SerializationFailure, psycopg.errors.LockNotAvailable):
+                # Lost a lock race, or waited out the lock timeout; the events are back, go again.
+                await conn.rollback()
+                self.retries += 1
+                return True
+            except (psycopg.IntegrityError, psycopg.DataError):
+                await conn.rollback()
+                await self._apply_one_by_one(conn)
+                return True
+
+    async def _drain(self):
+        while await self.fire_batch():
+            pass
+
+    async def fire_due(self):
+        now = self.now()
+        await asyncio.gather(*(self._drain() for _ in range(self.concurrency)))
+        while self.ticks and self.ticks[0] * self.tick <= now:
+            self.known.discard(heapq.heappop(self.ticks))
+
+    async def sleep(self):
+        now = self.now()
+        wake_at = now + self.sweep_interval
+        if self.loaded_until is not None:
+            wake_at = min(wake_at, self.loaded_until * self.tick - self.horizon / 2)
+        if self.ticks:
+            wake_at = min(wake_at, self.ticks[0] * self.tick)
+        if wake_at > now:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+        self.wake.clear()
+
+    async def run(self):
+        while True:
+            try:
+                if self.loaded_until is None or self.now() + self.horizon / 2 >= self.loaded_until * self.tick:
+                    await self.refill()
+                await self.fire_due()
+            except Exception:
+                self.errors += 1
+                logger.exception("Scheduler run failed, retrying in %s s", self.sweep_interval)
+                await asyncio.sleep(self.sweep_interval)
+                continue
+            await self.sleep()
+
+    def stats(self):
+        lags = sorted(self.lags)
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "ticks_in_memory": len(self.ticks),
+            "next_tick_in_seconds": round(self.ticks[0] * self.tick - self.now(), 3) if self.ticks else None,
+            "fired": self.fired,
+            "battles": self.battles,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "lag_seconds": {
+                "p50": lags[len(lags) // 2] if lags else None,
+                "p99": lags[min(len(lags) - 1, len(lags) * 99 // 100)] if lags else None,
+                "max": self.max_lag_seconds,
+            },
+        }
+
+
+scheduler = Scheduler(
+    SCHEDULER_HORIZON_SECONDS, SCHEDULER_TICK_MS / 1000, SCHEDULER_BATCH_SIZE, SCHEDULER_CONCURRENCY, SCHEDULER_SWEEP_INTERVAL,
+)
+_runner_task = None
+
+
+async def start_scheduler():
+    global _runner_task
+    if not SCHEDULER_ENABLED:
+        return
+    scheduler.wake = asyncio.Event()
+    _runner_task = asyncio.create_task(scheduler.run())
+
+
+async def stop_scheduler():
+    global _runner_task
+    if _runner_task is None:
+        return
+    _runner_task.cancel()
+    try:
+        await _runner_task
+    except asyncio.CancelledError:
+        pass
+    _runner_task = None
+    scheduler.wake = None
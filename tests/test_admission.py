@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import app.admission
+from app.admission import ConcurrencyLimit, TokenBuckets, _reject, parse_rate, route_class
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/metrics", None),
+    ("GET", "/planets/", "list"),
+    ("GET", "/planets/abc", "point"),
+    ("GET", "/users/abc/empire", "list"),
+    ("GET", "/leaderboards/wins", "list"),
+    ("GET", "/battles/stream", "stream"),
+    ("GET", "/scheduler/stats", "point"),
+    ("POST", "/planets/", "write"),
+])
+def test_route_class(method, path, expected):
+    assert route_class(method, path) == expected
+
+
+def test_parse_rate():
+    assert parse_rate("") is None
+    assert parse_rate("0/10") is None
+    assert parse_rate("20") == (20.0, 20.0)
+    assert parse_rate("20/40") == (20.0, 40.0)
+
+
+def test_token_bucket_refills_and_says_how_long_to_wait(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.admission, "monotonic", lambda: now[0])
+    buckets = TokenBuckets(rate=2, burst=3, max_callers=2)
+    assert [buckets.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a") == pytest.approx(0.5)
+    now[0] += 0.25
+    # Half a token has come back, so the next one is a quarter second away.
+    assert buckets.take("a") == pytest.approx(0.25)
+    now[0] += 1
+    assert buckets.take("a") == 0.0
+    assert buckets.take("b") == 0.0
+
+
+def test_token_buckets_forget_the_least_recent_caller(monkeypatch):
+    monkeypatch.setattr(app.admission, "monotonic", lambda: 0.0)
+    buckets = TokenBuckets(rate=1, burst=1, max_callers=2)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.take("a")
+    buckets.take("c")
+    assert list(buckets.buckets) == ["a", "c"]
+
+
+def test_retry_after_rounds_up_to_whole_seconds():
+    assert _reject("point", "rate_limited", 429, 0.2, "x").headers["Retry-After"] == "1"
+    assert _reject("point", "rate_limited", 429, 2.01, "x").headers["Retry-After"] == "3"
+
+
+async def queue_in_order():
+    limit = ConcurrencyLimit(limit=1, max_queue=2, timeout=1)
+    assert await limit.acquire() is None
+    order = []
+
+    async def waiter(name):
+        assert await limit.acquire() is None
+        order.append(name)
+
+    tasks = [asyncio.create_task(waiter(name)) for name in ("first", "second")]
+    await asyncio.sleep(0)
+    # The queue is full, so a third caller is turned away without waiting.
+    assert await limit.acquire() == "queue_full"
+    limit.release(0.01)
+    await asyncio.sleep(0)
+    limit.release(0.01)
+    await asyncio.gather(*tasks)
+    limit.release(0.01)
+    return order, limit.stats()
+
+
+def test_concurrency_limit_hands_slots_to_waiters_in_order():
+    order, stats = asyncio.run(queue_in_order())
+    assert order == ["first", "second"]
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] == 3
+    assert stats["queued"] == 2
+
+
+async def time_out():
+    limit = ConcurrencyLimit(limit=1, max_queue=5, timeout=0.01)
+    await limit.acquire()
+    reason = await limit.acquire()
+    return reason, limit.stats()
+
+
+def test_concurrency_limit_times_out_waiters():
+    reason, stats = asyncio.run(time_out())
+    assert reason == "queue_timeout"
+    assert stats["waiting"] == 0
+    assert stats["in_flight"] == 1
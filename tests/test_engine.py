@@ -0,0 +1,30 @@
+import pytest
+
+from battles.engine import SHIP_CLASSES, simulate, ships_to_counts
+
+
+def test_counts_follow_class_order():
+    counts = ships_to_counts({"cruiser": 2, "fighter": 10})
+    assert counts[SHIP_CLASSES.index("fighter")] == 10
+    assert counts[SHIP_CLASSES.index("cruiser")] == 2
+    assert counts.sum() == 12
+
+
+@pytest.mark.parametrize("ships", [
+    {"fighter": "5"},
+    {"fighter": 5.0},
+    {"fighter": True},
+    {"fighter": None},
+    {"fighter": -1},
+    {"warp_whale": 1},
+])
+def test_bad_fleets_raise_value_error(ships):
+    with pytest.raises(ValueError):
+        ships_to_counts(ships)
+    with pytest.raises(ValueError):
+        simulate(ships, {"bomber": 1}, 1)
+
+
+def test_same_seed_replays_the_same_battle():
+    attacker, defender = {"fighter": 50, "bomber": 10}, {"frigate": 8, "cruiser": 3}
+    assert simulate(attacker, defender, 7) == simulate(attacker, defender, 7)
@@ -0,0 +1,46 @@
+import pytest
+
+from battles.engine import simulate
+from battles.log_codec import ENGINE_LOG, JSON_LOG, ZSTD, pack_log, unpack_log, unpack_row
+
+
+@pytest.mark.parametrize("attacker, defender", [
+    ({"fighter": 50, "bomber": 10}, {"frigate": 8, "cruiser": 3}),
+    ({"fighter": 300000}, {"cruiser": 1}),
+    ({"fighter": 1}, {"fighter": 1}),
+])
+def test_engine_logs_round_trip_as_binary(attacker, defender):
+    log = simulate(attacker, defender, 42)["battle_log"]
+    packed = pack_log(log)
+    assert packed[0] & ~ZSTD == ENGINE_LOG
+    assert unpack_log(packed) == log
+
+
+@pytest.mark.parametrize("log", [
+    {},
+    {"note": "skirmish", "rounds": 3},
+    # Engine-shaped but with a float seed, so it cannot use the binary layout.
+    {**simulate({"fighter": 5}, {"bomber": 1}, 1)["battle_log"], "seed": 1.5},
+])
+def test_other_logs_round_trip_as_json(log):
+    packed = pack_log(log)
+    assert packed[0] & ~ZSTD == JSON_LOG
+    assert unpack_log(packed) == log
+
+
+def test_large_logs_are_compressed():
+    log = {"events": ["volley"] * 1000}
+    packed = pack_log(log)
+    assert packed[0] & ZSTD
+    assert unpack_log(packed) == log
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        unpack_log(b"\x7f{}")
+
+
+def test_unpack_row_keeps_legacy_jsonb_logs():
+    log = {"rounds": 1}
+    assert unpack_row({"id": "b", "battle_log_packed": pack_log(log)}) == {"id": "b", "battle_log": log}
+    assert unpack_row({"id": "b", "battle_log_packed": None, "battle_log": log}) == {"id": "b", "battle_log": log}
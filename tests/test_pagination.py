@@ -0,0 +1,36 @@
+from uuid import uuid4
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from db.pagination import decode_cursor, encode_cursor, keyset_query, page_response
+
+
+def test_cursor_round_trips_an_id():
+    row_id = str(uuid4())
+    token = encode_cursor(row_id)
+    assert "=" not in token
+    assert decode_cursor(token) == row_id
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor", encode_cursor("42"), "//8"])
+def test_bad_cursors_are_a_400(token):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(token)
+    assert e.value.status_code == 400
+
+
+def test_keyset_query_pages_after_the_cursor():
+    after = str(uuid4())
+    query, params = keyset_query("SELECT id FROM planets", ["owner_id = %s"], ["u"], encode_cursor(after), 10)
+    assert query == "SELECT id FROM planets WHERE owner_id = %s AND id > %s ORDER BY id LIMIT %s"
+    assert params == ["u", after, 11]
+
+
+def test_page_response_hides_the_extra_row_behind_a_cursor():
+    rows = [{"id": str(uuid4())} for _ in range(3)]
+    body = orjson.loads(page_response(rows, 2).body)
+    assert body["items"] == rows[:2]
+    assert decode_cursor(body["next_cursor"]) == rows[1]["id"]
+    assert orjson.loads(page_response(rows, 3).body)["next_cursor"] is None
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+import leaderboards.ranking
+from leaderboards.ranking import RankIndex
+
+
+def expected_top(scores):
+    # (user id, score, rank) for every user, ranks shared by ties as in 1, 2, 2, 4.
+    entries = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    ranks = {}
+    for position, (_, score) in enumerate(entries, 1):
+        ranks.setdefault(score, position)
+    return [(user_id, score, ranks[score]) for user_id, score in entries]
+
+
+def test_ties_share_a_rank():
+    index = RankIndex()
+    index.replace_all({1: 50, 2: 40, 3: 40, 4: 10})
+    assert index.top(10) == [(1, 50, 1), (2, 40, 2), (3, 40, 2), (4, 10, 4)]
+    assert index.rank(3) == (2, 40)
+    assert index.rank(4) == (4, 10)
+    assert index.rank(99) is None
+    # A page that starts inside a tie still reports the tie's rank.
+    assert index.top(2, offset=2) == [(3, 40, 2), (4, 10, 4)]
+    assert index.top(5, offset=4) == []
+
+
+@pytest.mark.parametrize("bucket_size", [2, 1000])
+def test_updates_match_a_full_sort(monkeypatch, bucket_size):
+    # Small buckets make the index split and drop buckets constantly.
+    monkeypatch.setattr(leaderboards.ranking, "BUCKET_SIZE", bucket_size)
+    rng = random.Random(bucket_size)
+    index = RankIndex()
+    index.replace_all({user_id: rng.randrange(20) for user_id in range(50)})
+    scores = dict(index.scores)
+    for _ in range(2000):
+        user_id = rng.randrange(80)
+        if rng.random() < 0.2:
+            index.discard(user_id)
+            scores.pop(user_id, None)
+        else:
+            score = rng.randrange(-5, 20)
+            index.set(user_id, score)
+            scores[user_id] = score
+    expected = expected_top(scores)
+    assert len(index) == len(scores)
+    assert index.top(len(expected) + 5) == expected
+    for offset in (0, 1, 17, len(expected) - 1):
+        assert index.top(7, offset) == expected[offset:offset + 7]
+    for user_id, score, rank in expected:
+        assert index.rank(user_id) == (rank, score)
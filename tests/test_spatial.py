@@ -0,0 +1,70 @@
+import math
+import random
+
+import numpy as np
+
+from planets.spatial import PlanetIndex
+
+
+def random_index(count, seed=1):
+    rng = random.Random(seed)
+    planets = {f"p{i}": (rng.uniform(-500, 500), rng.uniform(-500, 500), rng.random() < 0.5) for i in range(count)}
+    index = PlanetIndex(50)
+    ids = list(planets)
+    index.replace_all(
+        ids,
+        np.array([planets[i][0] for i in ids]),
+        np.array([planets[i][1] for i in ids]),
+        np.array([planets[i][2] for i in ids]),
+    )
+    return index, planets
+
+
+def brute_force(planets, x, y, unowned=False):
+    # Every planet with its distance to (x, y), nearest first.
+    return sorted(
+        (math.dist((x, y), (px, py)), planet_id)
+        for planet_id, (px, py, owned) in planets.items()
+        if not (unowned and owned)
+    )
+
+
+def test_within_matches_brute_force():
+    index, planets = random_index(2000)
+    for x, y, radius in [(0, 0, 120), (480, -480, 60), (10, 20, 0.5), (0, 0, 2000)]:
+        for unowned in (False, True):
+            expected = [planet_id for d, planet_id in brute_force(planets, x, y, unowned) if d <= radius][:50]
+            assert [p["id"] for p in index.within(x, y, radius, 50, unowned)] == expected
+
+
+def test_nearest_matches_brute_force():
+    index, planets = random_index(2000)
+    for x, y in [(0, 0), (499, 499), (-3000, 0)]:
+        for unowned in (False, True):
+            expected = [planet_id for _, planet_id in brute_force(planets, x, y, unowned)[:10]]
+            assert [p["id"] for p in index.nearest(x, y, 10, unowned)] == expected
+
+
+def test_put_moves_claims_and_discards():
+    index = PlanetIndex(50)
+    assert index.nearest(0, 0, 1) == []
+    index.put("a", 0, 0, owned=False)
+    index.put("b", 300, 300, owned=False)
+    assert index.nearest(290, 290, 1)[0]["id"] == "b"
+    index.put("b", -300, -300, owned=False)
+    assert index.within(300, 300, 50, 10) == []
+    index.put("a", 0, 0, owned=True)
+    assert [p["id"] for p in index.nearest(0, 0, 1, unowned=True)] == ["b"]
+    # A planet without coordinates drops out of the index.
+    index.put("b", None, None, owned=False)
+    assert index.nearest(0, 0, 1, unowned=True) == []
+    index.discard("a")
+    assert index.stats()["planets"] == 0
+
+
+def test_index_grows_past_its_initial_capacity():
+    index = PlanetIndex(10)
+    for i in range(3000):
+        index.put(f"p{i}", i, -i, owned=False)
+    assert index.stats()["planets"] == 3000
+    assert [p["id"] for p in index.nearest(2999, -2999, 2)] == ["p2999", "p2998"]
@@ -0,0 +1,40 @@
+import pytest
+
+from db.versioning import etag_for, etag_matches, if_match_filter, if_match_versions
+
+
+def test_etag_is_the_quoted_version():
+    assert etag_for(7) == '"7"'
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ("", False),
+    ("*", True),
+    ('"7"', True),
+    ('W/"7"', True),
+    ('"6", "7"', True),
+    ('"6"', False),
+    ("7", False),
+])
+def test_if_none_match_compares_weakly(header, matches):
+    assert etag_matches(header, 7) is matches
+
+
+@pytest.mark.parametrize("header, versions", [
+    (None, None),
+    ("*", None),
+    ('"7"', [7]),
+    ('"6", "7"', [6, 7]),
+    ('W/"7"', []),
+    ('"v7"', []),
+])
+def test_if_match_compares_strongly(header, versions):
+    assert if_match_versions(header) == versions
+
+
+def test_if_match_filter_guards_on_the_listed_versions():
+    assert if_match_filter(None) == ([], [])
+    assert if_match_filter('"3", "5"') == (["version = ANY(%s::bigint[])"], [[3, 5]])
+    # A header naming no usable tag must match no row, not every row.
+    assert if_match_filter('W/"3"') == (["version = ANY(%s::bigint[])"], [[]])
@@ -0,0 +1,128 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+import db.pool
+from db.codec import dumps
+from db.pool import acquire, close_pool, open_pool
+from user_fleets.write_behind import FleetWriteBuffer
+
+pytestmark = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="needs DATABASE_URL")
+
+
+async def seed_fleet(conn):
+    user_id, planet_id, fleet_id = str(uuid4()), str(uuid4()), str(uuid4())
+    await conn.execute(
+        "INSERT INTO users (id, username, email, password_hash) VALUES (%s, %s, %s, 'x')",
+        (user_id, f"wb_{user_id[:8]}", f"wb_{user_id[:8]}@example.com"),
+    )
+    await conn.execute("INSERT INTO planets (id, name, owner_id) VALUES (%s, 'WB', %s)", (planet_id, user_id))
+    await conn.execute(
+        "INSERT INTO user_fleets (id, user_id, planet_id, ships) VALUES (%s, %s, %s, '{\"fighter\": 1}')",
+        (fleet_id, user_id, planet_id),
+    )
+    await conn.commit()
+    return user_id, planet_id, fleet_id
+
+
+async def fleet_ships(conn, fleet_id):
+    row = await (await conn.execute("SELECT ships FROM user_fleets WHERE id = %s", (fleet_id,))).fetchone()
+    await conn.rollback()
+    return row[0]
+
+
+async def flush_with_one_connection(journal_dir):
+    await open_pool()
+    try:
+        buffer = FleetWriteBuffer(journal_dir, 0.1, 1000, False)
+        buffer._rotate()
+        async with acquire() as conn:
+            user_id, planet_id, fleet_id = await seed_fleet(conn)
+            try:
+                # The pool's only connection is held here, as a handler holds its dependency's.
+                buffer.write(fleet_id, user_id, planet_id, {"fighter": 7}, 1)
+                await asyncio.wait_for(buffer.flush_ids([fleet_id], conn), timeout=db.pool.DB_POOL_TIMEOUT / 2)
+                assert await fleet_ships(conn, fleet_id) == {"fighter": 7}
+                assert not buffer.pending
+
+                # Without it the flush waits for a connection, gives up with a 503 and keeps the write.
+                buffer.write(fleet_id, user_id, planet_id, {"fighter": 9}, 2)
+                with pytest.raises(HTTPException) as error:
+                    await buffer.flush()
+                assert error.value.status_code == 503
+                assert fleet_id in buffer.pending
+            finally:
+                await conn.rollback()
+        # Once the connection is free again the same flush goes through.
+        await buffer.flush()
+        async with acquire() as conn:
+            assert await fleet_ships(conn, fleet_id) == {"fighter": 9}
+            await conn.execute("DELETE FROM user_fleets WHERE id = %s", (fleet_id,))
+            await conn.execute("DELETE FROM planets WHERE id = %s", (planet_id,))
+            await conn.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            await conn.commit()
+    finally:
+        await close_pool()
+
+
+def test_flush_with_a_single_pool_connection(monkeypatch, tmp_path):
+    monkeypatch.setattr(db.pool, "DB_POOL_MIN_SIZE", 1)
+    monkeypatch.setattr(db.pool, "DB_POOL_MAX_SIZE", 1)
+    monkeypatch.setattr(db.pool, "DB_POOL_TIMEOUT", 1.0)
+    asyncio.run(flush_with_one_connection(str(tmp_path)))
+
+
+async def fleet_row(conn, fleet_id):
+    row = await (await conn.execute("SELECT ships, version FROM user_fleets WHERE id = %s", (fleet_id,))).fetchone()
+    await conn.rollback()
+    return row[0], row[1]
+
+
+async def replay_after_committed_flush(journal_dir):
+    await open_pool()
+    try:
+        async with acquire() as conn:
+            user_id, planet_id, fleet_id = await seed_fleet(conn)
+        buffer = FleetWriteBuffer(journal_dir, 0.1, 1000, False)
+        buffer._rotate()
+        buffer.write(fleet_id, user_id, planet_id, {"fighter": 2}, 1)
+        buffer.write(fleet_id, user_id, planet_id, {"fighter": 3}, 2)
+        journal = {path: path.read_bytes() for path in buffer.journal_dir.glob("*.journal")}
+        await buffer.flush()
+        os.close(buffer.fd)
+        # The process dies after the flush commits but before its segments are deleted,
+        # and another writer changes the row before the restart.
+        for path, data in journal.items():
+            path.write_bytes(data)
+        async with acquire() as conn:
+            assert await fleet_row(conn, fleet_id) == ({"fighter": 3}, 3)
+            await conn.execute(
+                "UPDATE user_fleets SET ships = '{\"fighter\": 10}', version = version + 1 WHERE id = %s", (fleet_id,),
+            )
+            await conn.commit()
+
+        await FleetWriteBuffer(journal_dir, 0.1, 1000, False).replay()
+        async with acquire() as conn:
+            assert await fleet_row(conn, fleet_id) == ({"fighter": 10}, 4)
+
+        # A later record written over the current version is still applied, once.
+        for path, data in journal.items():
+            path.write_bytes(data)
+        with open(max(journal), "ab") as f:
+            f.write(dumps({"id": fleet_id, "user_id": user_id, "planet_id": planet_id, "ships": {"fighter": 20}, "base": 4}) + b"\n")
+        await FleetWriteBuffer(journal_dir, 0.1, 1000, False).replay()
+        async with acquire() as conn:
+            assert await fleet_row(conn, fleet_id) == ({"fighter": 20}, 5)
+            await conn.execute("DELETE FROM user_fleets WHERE id = %s", (fleet_id,))
+            await conn.execute("DELETE FROM planets WHERE id = %s", (planet_id,))
+            await conn.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            await conn.commit()
+    finally:
+        await close_pool()
+
+
+def test_replay_skips_changes_that_already_reached_the_database(tmp_path):
+    asyncio.run(replay_after_committed_flush(str(tmp_path)))
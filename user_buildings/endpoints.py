@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 import psycopg
 from pydantic import BaseModel
-from uuid import uuid4
+from uuid import UUID, uuid4
+from psycopg.rows import dict_row
+from db.pool import get_db
+from db.replicas import get_read_db
+from db.bulk import bulk_error, check_bulk_size, copy_rows, delete_ids, execute_returning
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, column_filters, fetch_page, stream_ndjson
+from planets.production import planets_of_user_buildings, refresh_production
 
 class UserBuilding(BaseModel):
     user_id: str
@@ -9,88 +15,118 @@ class UserBuilding(BaseModel):
     planet_id: str
     level: int
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
+class UserBuildingUpdate(UserBuilding):
+    id: str
 
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
+USER_BUILDING_COLUMNS = "id, user_id, building_id, planet_id, level"
 
 # Helper function to fetch user building by ID
-def get_user_building_by_id(user_building_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM user_buildings WHERE id = %s", (user_building_id,))
-            user_building = cursor.fetchone()
-        conn.close()
-        return user_building
-    return None
+async def get_user_building_by_id(conn: psycopg.AsyncConnection, user_building_id: str):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"SELECT {USER_BUILDING_COLUMNS} FROM user_buildings WHERE id = %s", (user_building_id,))
+        return await cursor.fetchone()
 
 router = APIRouter()
 
 @router.post("/")
-def create_user_building(user_building: UserBuilding):
-    conn = connect_to_db()
-    if conn:
-        user_building_id = str(uuid4())  # Generate unique ID
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO user_buildings (id, user_id, building_id, planet_id, level) 
-                VALUES (%s, %s, %s, %s, %s) 
-                RETURNING id;
-            """, (user_building_id, user_building.user_id, user_building.building_id, user_building.planet_id, user_building.level))
-            conn.commit()
-        conn.close()
-        return {"id": user_building_id, "user_id": user_building.user_id, "building_id": user_building.building_id, "planet_id": user_building.planet_id, "level": user_building.level}
-    raise HTTPException(status_code=500, detail="Error creating user building.")
+async def create_user_building(user_building: UserBuilding, conn: psycopg.AsyncConnection = Depends(get_db)):
+    user_building_id = str(uuid4())  # Generate unique ID
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO user_buildings (id, user_id, building_id, planet_id, level)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id;
+        """, (user_building_id, user_building.user_id, user_building.building_id, user_building.planet_id, user_building.level))
+        await refresh_production(conn, [user_building.planet_id])
+        await conn.commit()
+    return {"id": user_building_id, "user_id": user_building.user_id, "building_id": user_building.building_id, "planet_id": user_building.planet_id, "level": user_building.level}
+
+@router.post("/bulk")
+async def create_user_buildings_bulk(user_buildings: list[UserBuilding], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_buildings)
+    ids = [str(uuid4()) for _ in user_buildings]
+    try:
+        await copy_rows(conn, "user_buildings", ["id", "user_id", "building_id", "planet_id", "level"], [
+            (user_building_id, ub.user_id, ub.building_id, ub.planet_id, ub.level) for user_building_id, ub in zip(ids, user_buildings)
+        ])
+        await refresh_production(conn, [ub.planet_id for ub in user_buildings])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": user_building_id, "status": "created"} for user_building_id in ids]
+
+@router.patch("/bulk")
+async def update_user_buildings_bulk(user_buildings: list[UserBuildingUpdate], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_buildings)
+    try:
+        old_planet_ids = await planets_of_user_buildings(conn, [ub.id for ub in user_buildings])
+        matched = await execute_returning(conn, """
+            UPDATE user_buildings
+            SET user_id = %s, building_id = %s, planet_id = %s, level = %s
+            WHERE id = %s
+            RETURNING id
+        """, [(ub.user_id, ub.building_id, ub.planet_id, ub.level, ub.id) for ub in user_buildings])
+        await refresh_production(conn, old_planet_ids + [ub.planet_id for ub, found in zip(user_buildings, matched) if found])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": ub.id, "status": "updated" if found else "not_found"} for ub, found in zip(user_buildings, matched)]
+
+@router.delete("/bulk")
+async def delete_user_buildings_bulk(user_building_ids: list[str], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_building_ids)
+    try:
+        planet_ids = await planets_of_user_buildings(conn, user_building_ids)
+    except psycopg.DataError as e:
+        raise bulk_error(e)
+    results = await delete_ids(conn, "user_buildings", user_building_ids)
+    await refresh_production(conn, planet_ids)
+    await conn.commit()
+    return results
+
+@router.get("/stream")
+async def stream_user_buildings(after: str | None = None, user_id: UUID | None = None, planet_id: UUID | None = None):
+    conditions, params = column_filters(user_id=user_id, planet_id=planet_id)
+    return stream_ndjson(f"SELECT {USER_BUILDING_COLUMNS} FROM user_buildings", conditions, params, after)
 
 @router.get("/{user_building_id}")
-def read_user_building(user_building_id: str):
-    user_building = get_user_building_by_id(user_building_id)
+async def read_user_building(user_building_id: str, conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    user_building = await get_user_building_by_id(conn, user_building_id)
     if user_building:
-        return {"id": user_building[0], "user_id": user_building[1], "building_id": user_building[2], "planet_id": user_building[3], "level": user_building[4]}
+        return user_building
     raise HTTPException(status_code=404, detail="User building not found")
 
 @router.get("/")
-def read_all_user_buildings():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM user_buildings")
-            user_buildings = cursor.fetchall()
-        conn.close()
-        return [{"id": ub[0], "user_id": ub[1], "building_id": ub[2], "planet_id": ub[3], "level": ub[4]} for ub in user_buildings]
-    raise HTTPException(status_code=500, detail="Error fetching user buildings.")
+async def read_all_user_buildings(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    user_id: UUID | None = None,
+    planet_id: UUID | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    conditions, params = column_filters(user_id=user_id, planet_id=planet_id)
+    return await fetch_page(conn, f"SELECT {USER_BUILDING_COLUMNS} FROM user_buildings", conditions, params, after, limit)
 
 @router.put("/{user_building_id}")
-def update_user_building(user_building_id: str, user_building: UserBuilding):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE user_buildings 
-                SET user_id = %s, building_id = %s, planet_id = %s, level = %s 
-                WHERE id = %s
-            """, (user_building.user_id, user_building.building_id, user_building.planet_id, user_building.level, user_building_id))
-            conn.commit()
-        conn.close()
-        return {"message": "User building updated successfully"}
-    raise HTTPException(status_code=500, detail="Error updating user building.")
+async def update_user_building(user_building_id: str, user_building: UserBuilding, conn: psycopg.AsyncConnection = Depends(get_db)):
+    old_planet_ids = await planets_of_user_buildings(conn, [user_building_id])
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            UPDATE user_buildings
+            SET user_id = %s, building_id = %s, planet_id = %s, level = %s
+            WHERE id = %s
+        """, (user_building.user_id, user_building.building_id, user_building.planet_id, user_building.level, user_building_id))
+        if cursor.rowcount:
+            await refresh_production(conn, old_planet_ids + [user_building.planet_id])
+        await conn.commit()
+    return {"message": "User building updated successfully"}
 
 @router.delete("/{user_building_id}")
-def delete_user_building(user_building_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM user_buildings WHERE id = %s", (user_building_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "User building deleted successfully"}
-    raise HTTPException(status_code=500, detail="Error deleting user building.")
+async def delete_user_building(user_building_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM user_buildings WHERE id = %s RETURNING planet_id", (user_building_id,))
+        await refresh_production(conn, [row[0] for row in await cursor.fetchall()])
+        await conn.commit()
+    return {"message": "User building deleted successfully"}
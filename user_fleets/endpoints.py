@@ -1,95 +1,241 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 import psycopg
 from pydantic import BaseModel
-from uuid import uuid4
-from psycopg.types.json import Json
+from uuid import UUID, uuid4
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from db.pool import acquire, get_db
+from db.replicas import acquire_read, get_read_db
+from db.bulk import bulk_error, check_bulk_size, copy_rows, delete_ids, execute_returning
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, column_filters, fetch_page, stream_ndjson
+from db.versioning import (
+    etag_for, etag_matches, get_row_version, if_match_filter, if_match_versions, not_modified, precondition_failed,
+    reject_update, since_filter,
+)
+from user_fleets.write_behind import FLEET_WRITE_BEHIND, fleet_buffer
+
+# Reads flush buffered fleets to the primary first, and a replica would not have those writes yet.
+acquire_fleets = acquire if FLEET_WRITE_BEHIND else acquire_read
+get_fleets_db = get_db if FLEET_WRITE_BEHIND else get_read_db
 
 class UserFleet(BaseModel):
     user_id: str
     planet_id: str
-    ships: dict  # {"fighter": 10, "bomber": 5, "cruiser": 2}
+    ships: dict[str, int]  # {"fighter": 10, "bomber": 5, "cruiser": 2}
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
+class UserFleetUpdate(UserFleet):
+    id: str
 
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
-
-def get_user_fleet_by_id(user_fleet_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM user_fleets WHERE id = %s", (user_fleet_id,))
-            user_fleet = cursor.fetchone()
-        conn.close()
-        return user_fleet
-    return None
+class UserFleetDelta(BaseModel):
+    ships: dict[str, int]  # {"fighter": -10, "cruiser": 2}, added to the current counts
+
+USER_FLEET_COLUMNS = "id, user_id, planet_id, ships, version, updated_at"
+
+async def get_user_fleet_by_id(conn: psycopg.AsyncConnection, user_fleet_id: str):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"SELECT {USER_FLEET_COLUMNS} FROM user_fleets WHERE id = %s", (user_fleet_id,))
+        return await cursor.fetchone()
+
+# Row-locks the fleets until the caller's transaction ends, so combat can't race a concurrent fleet update.
+# Buffered writes are flushed on conn first. A caller already inside a transaction must flush before it
+# began: the flush would commit its work, and on another connection it could wait on the caller's own locks.
+async def get_user_fleets_for_update(conn: psycopg.AsyncConnection, user_fleet_ids: list):
+    if conn.info.transaction_status == TransactionStatus.IDLE:
+        await fleet_buffer.flush_ids(user_fleet_ids, conn)
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(
+            f"SELECT {USER_FLEET_COLUMNS} FROM user_fleets WHERE id = ANY(%s::uuid[]) ORDER BY id FOR UPDATE",
+            (user_fleet_ids,),
+        )
+        return {str(row["id"]): row for row in await cursor.fetchall()}
+
+async def set_user_fleet_ships(conn: psycopg.AsyncConnection, ships_by_id: dict):
+    async with conn.cursor() as cursor:
+        await cursor.executemany("""
+            UPDATE user_fleets
+            SET ships = %s, version = version + 1, updated_at = now()
+            WHERE id = %s
+        """, [(Jsonb(ships), user_fleet_id) for user_fleet_id, ships in ships_by_id.items()])
+
+def user_fleet_filters(user_id: UUID | None, planet_id: UUID | None, since: datetime | None):
+    conditions, params = column_filters(user_id=user_id, planet_id=planet_id)
+    since_conditions, since_params = since_filter(since)
+    return conditions + since_conditions, params + since_params
 
 router = APIRouter()
 
 @router.post("/")
-def create_user_fleet(user_fleet: UserFleet):
-    conn = connect_to_db()
-    if conn:
-        user_fleet_id = str(uuid4())
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO user_fleets (id, user_id, planet_id, ships) 
-                VALUES (%s, %s, %s, %s) 
-                RETURNING id;
-            """, (user_fleet_id, user_fleet.user_id, user_fleet.planet_id, psycopg.types.json.Json(user_fleet.ships)))
-            conn.commit()
-        conn.close()
-        return {"id": user_fleet_id, "user_id": user_fleet.user_id, "planet_id": user_fleet.planet_id, "ships": user_fleet.ships}
-    raise HTTPException(status_code=500, detail="Error creating user fleet.")
+async def create_user_fleet(user_fleet: UserFleet, conn: psycopg.AsyncConnection = Depends(get_db)):
+    user_fleet_id = str(uuid4())
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO user_fleets (id, user_id, planet_id, ships)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id;
+        """, (user_fleet_id, user_fleet.user_id, user_fleet.planet_id, Jsonb(user_fleet.ships)))
+        await conn.commit()
+    return {"id": user_fleet_id, "user_id": user_fleet.user_id, "planet_id": user_fleet.planet_id, "ships": user_fleet.ships}
+
+@router.post("/bulk")
+async def create_user_fleets_bulk(user_fleets: list[UserFleet], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_fleets)
+    ids = [str(uuid4()) for _ in user_fleets]
+    try:
+        await copy_rows(conn, "user_fleets", ["id", "user_id", "planet_id", "ships"], [
+            (user_fleet_id, uf.user_id, uf.planet_id, Jsonb(uf.ships)) for user_fleet_id, uf in zip(ids, user_fleets)
+        ])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": user_fleet_id, "status": "created"} for user_fleet_id in ids]
+
+@router.patch("/bulk")
+async def update_user_fleets_bulk(user_fleets: list[UserFleetUpdate], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_fleets)
+    await fleet_buffer.flush_ids([uf.id for uf in user_fleets], conn)
+    try:
+        matched = await execute_returning(conn, """
+            UPDATE user_fleets
+            SET user_id = %s, planet_id = %s, ships = %s, version = version + 1, updated_at = now()
+            WHERE id = %s
+            RETURNING id
+        """, [(uf.user_id, uf.planet_id, Jsonb(uf.ships), uf.id) for uf in user_fleets])
+        await conn.commit()
+    except (psycopg.IntegrityError, psycopg.DataError) as e:
+        await conn.rollback()
+        raise bulk_error(e)
+    return [{"id": uf.id, "status": "updated" if found else "not_found"} for uf, found in zip(user_fleets, matched)]
+
+@router.delete("/bulk")
+async def delete_user_fleets_bulk(user_fleet_ids: list[str], conn: psycopg.AsyncConnection = Depends(get_db)):
+    check_bulk_size(user_fleet_ids)
+    results = await delete_ids(conn, "user_fleets", user_fleet_ids)
+    await conn.commit()
+    for user_fleet_id in user_fleet_ids:
+        fleet_buffer.discard(user_fleet_id)
+    return results
+
+@router.get("/write_behind/stats")
+async def read_write_behind_stats():
+    return fleet_buffer.stats()
+
+@router.get("/stream")
+async def stream_user_fleets(
+    after: str | None = None,
+    since: datetime | None = None,
+    user_id: UUID | None = None,
+    planet_id: UUID | None = None,
+):
+    # Lists and streams come from Postgres, so buffered fleet writes go out first.
+    await fleet_buffer.flush()
+    conditions, params = user_fleet_filters(user_id, planet_id, since)
+    return stream_ndjson(f"SELECT {USER_FLEET_COLUMNS} FROM user_fleets", conditions, params, after, replica=not FLEET_WRITE_BEHIND)
 
 @router.get("/{user_fleet_id}")
-def read_user_fleet(user_fleet_id: str):
-    user_fleet = get_user_fleet_by_id(user_fleet_id)
+async def read_user_fleet(
+    user_fleet_id: str,
+    response: Response,
+    if_none_match: str | None = Header(None),
+):
+    # A fleet with buffered writes is served from memory, without a pooled connection.
+    user_fleet = fleet_buffer.get(user_fleet_id)
+    if user_fleet is None:
+        async with acquire_fleets() as conn:
+            if if_none_match:
+                version = await get_row_version(conn, "user_fleets", user_fleet_id)
+                if version is not None and etag_matches(if_none_match, version):
+                    return not_modified(version)
+            user_fleet = await get_user_fleet_by_id(conn, user_fleet_id)
+    elif etag_matches(if_none_match, user_fleet["version"]):
+        return not_modified(user_fleet["version"])
     if user_fleet:
-        return {"id": user_fleet[0], "user_id": user_fleet[1], "planet_id": user_fleet[2], "ships": user_fleet[3]}
+        response.headers["ETag"] = etag_for(user_fleet["version"])
+        return user_fleet
     raise HTTPException(status_code=404, detail="User fleet not found")
 
 @router.get("/")
-def read_all_user_fleets():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM user_fleets")
-            user_fleets = cursor.fetchall()
-        conn.close()
-        return [{"id": uf[0], "user_id": uf[1], "planet_id": uf[2], "ships": uf[3]} for uf in user_fleets]
-    raise HTTPException(status_code=500, detail="Error fetching user fleets.")
+async def read_all_user_fleets(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    since: datetime | None = None,
+    user_id: UUID | None = None,
+    planet_id: UUID | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_fleets_db),
+):
+    await fleet_buffer.flush(conn)
+    conditions, params = user_fleet_filters(user_id, planet_id, since)
+    return await fetch_page(conn, f"SELECT {USER_FLEET_COLUMNS} FROM user_fleets", conditions, params, after, limit)
 
 @router.put("/{user_fleet_id}")
-def update_user_fleet(user_fleet_id: str, user_fleet: UserFleet):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE user_fleets 
-                SET user_id = %s, planet_id = %s, ships = %s 
-                WHERE id = %s
-            """, (user_fleet.user_id, user_fleet.planet_id, psycopg.types.json.Json(user_fleet.ships), user_fleet_id))
-            conn.commit()
-        conn.close()
+async def update_user_fleet(
+    user_fleet_id: str,
+    user_fleet: UserFleet,
+    response: Response,
+    if_match: str | None = Header(None),
+):
+    if FLEET_WRITE_BEHIND:
+        # Acknowledged once journaled; Postgres sees it within FLEET_FLUSH_INTERVAL_MS.
+        version = await fleet_buffer.current_version(user_fleet_id)
+        versions = if_match_versions(if_match)
+        if version is None or (versions is not None and version not in versions):
+            if if_match:
+                raise precondition_failed()
+            return {"message": "User fleet updated successfully"}
+        version = fleet_buffer.write(user_fleet_id, user_fleet.user_id, user_fleet.planet_id, user_fleet.ships, version)
+        response.headers["ETag"] = etag_for(version)
         return {"message": "User fleet updated successfully"}
-    raise HTTPException(status_code=500, detail="Error updating user fleet.")
+    conditions, params = if_match_filter(if_match)
+    where = " AND ".join(["id = %s"] + conditions)
+    async with acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"""
+                UPDATE user_fleets
+                SET user_id = %s, planet_id = %s, ships = %s, version = version + 1, updated_at = now()
+                WHERE {where}
+                RETURNING version
+            """, (user_fleet.user_id, user_fleet.planet_id, Jsonb(user_fleet.ships), user_fleet_id, *params))
+            updated = await cursor.fetchone()
+            await conn.commit()
+    if updated:
+        response.headers["ETag"] = etag_for(updated[0])
+    elif if_match:
+        raise precondition_failed()
+    return {"message": "User fleet updated successfully"}
+
+# Adds the deltas to the current ship counts in one UPDATE, so concurrent writers
+# never overwrite each other. A delta that would take a count below zero is rejected.
+@router.patch("/{user_fleet_id}")
+async def patch_user_fleet_ships(
+    user_fleet_id: str,
+    delta: UserFleetDelta,
+    response: Response,
+    if_match: str | None = Header(None),
+    conn: psycopg.AsyncConnection = Depends(get_db),
+):
+    await fleet_buffer.flush_ids([user_fleet_id], conn)
+    conditions, params = if_match_filter(if_match)
+    where = " AND ".join(["id = %s", "jsonb_counts_cover(ships, %s)"] + conditions)
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"""
+            UPDATE user_fleets
+            SET ships = jsonb_add_counts(ships, %s), version = version + 1, updated_at = now()
+            WHERE {where}
+            RETURNING version, ships
+        """, (Jsonb(delta.ships), user_fleet_id, Jsonb(delta.ships), *params))
+        updated = await cursor.fetchone()
+        await conn.commit()
+    if updated is None:
+        await reject_update(conn, "user_fleets", user_fleet_id, if_match, "User fleet not found", "Not enough ships")
+    response.headers["ETag"] = etag_for(updated[0])
+    return {"id": user_fleet_id, "ships": updated[1], "version": updated[0]}
 
 @router.delete("/{user_fleet_id}")
-def delete_user_fleet(user_fleet_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM user_fleets WHERE id = %s", (user_fleet_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "User fleet deleted successfully"}
-    raise HTTPException(status_code=500, detail="Error deleting user fleet.")
+async def delete_user_fleet(user_fleet_id: str, conn: psycopg.AsyncConnection = Depends(get_db)):
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM user_fleets WHERE id = %s", (user_fleet_id,))
+        await conn.commit()
+    fleet_buffer.discard(user_fleet_id)
+    return {"message": "User fleet deleted successfully"}
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from db.codec import dumps, loads
+from db.pool import acquire
+from db.versioning import get_row_version
+
+logger = logging.getLogger(__name__)
+
+# PUT /user_fleets/{id} lands in memory and a local journal; a background task writes it to Postgres.
+FLEET_WRITE_BEHIND = os.getenv("FLEET_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+FLEET_JOURNAL_DIR = os.getenv("FLEET_JOURNAL_DIR", "fleet-journal")
+FLEET_FLUSH_INTERVAL_MS = float(os.getenv("FLEET_FLUSH_INTERVAL_MS", "100"))
+# Flush early once this many fleets have buffered changes.
+FLEET_FLUSH_MAX_PENDING = int(os.getenv("FLEET_FLUSH_MAX_PENDING", "1000"))
+# fsync every journal append: survives power loss, not just a crashed process, at a cost per write.
+FLEET_JOURNAL_FSYNC = os.getenv("FLEET_JOURNAL_FSYNC", "false").lower() in ("1", "true", "yes")
+
+# Every buffered change counts as one version bump, so ETags match what a synchronous write would give.
+# The row must still be at the version the first buffered change saw: a flush that already committed
+# (replayed after a crash) or a row another writer changed since is left alone.
+FLUSH_SQL = """
+    UPDATE user_fleets
+    SET user_id = %s, planet_id = %s, ships = %s, version = version + %s, updated_at = now()
+    WHERE id = %s AND version = %s
+"""
+
+
+class FleetWriteBuffer:
+    # Latest state per fleet, coalesced, plus an append-only journal split into
+    # numbered segments. A flush seals the current segment and deletes it once
+    # its transaction commits; whatever is left on disk is replayed at startup.
+    # Each record carries the version it was written over ("base"), which is
+    # what lets a replay skip changes that already reached the database.
+    def __init__(self, journal_dir: str, flush_interval: float, max_pending: int, fsync: bool):
+        self.journal_dir = Path(journal_dir)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.pending = {}
+        self.flushing = {}
+        self.segment = 0
+        self.fd = None
+        self.wake = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.replayed = 0
+        self.rejected = 0
+        self.conflicts = 0
+
+    def get(self, fleet_id: str):
+        entry = self.pending.get(fleet_id) or self.flushing.get(fleet_id)
+        if entry is None:
+            return None
+        return {name: entry[name] for name in ("id", "user_id", "planet_id", "ships", "version", "updated_at")}
+
+    async def current_version(self, fleet_id: str):
+        entry = self.get(fleet_id)
+        if entry is None:
+            async with acquire() as conn:
+                version = await get_row_version(conn, "user_fleets", fleet_id)
+            # Another write may have been buffered while we were waiting on the database.
+            entry = self.get(fleet_id)
+            if entry is None:
+                return version
+        return entry["version"]
+
+    def buffered(self, fleet_ids) -> bool:
+        return any(fleet_id in self.pending or fleet_id in self.flushing for fleet_id in fleet_ids)
+
+    def write(self, fleet_id: str, user_id: str, planet_id: str, ships: dict, current_version: int) -> int:
+        self._append({"id": fleet_id, "user_id": user_id, "planet_id": planet_id, "ships": ships, "base": current_version})
+        self.writes += 1
+        entry = self.pending.get(fleet_id)
+        if entry is None:
+            entry = self.pending[fleet_id] = {"id": fleet_id, "updates": 0, "base": current_version}
+        else:
+            self.coalesced += 1
+        entry.update(
+            user_id=user_id, planet_id=planet_id, ships=ships, version=current_version + 1,
+            updated_at=datetime.now(timezone.utc), updates=entry["updates"] + 1,
+        )
+        if len(self.pending) >= self.max_pending:
+            self.wake.set()
+        return entry["version"]
+
+    def discard(self, fleet_id: str):
+        # The row is gone; a flush of it would match nothing anyway, this just skips the work.
+        self.pending.pop(fleet_id, None)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.journal_dir / f"{segment:012d}.journal"
+
+    def _segments(self):
+        return sorted(int(path.stem) for path in self.journal_dir.glob("*.journal") if path.stem.isdigit())
+
+    def _append(self, record: dict):
+        os.write(self.fd, dumps(record) + b"\n")
+        if self.fsync:
+            os.fsync(self.fd)
+
+    def _rotate(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.segment += 1
+        self.fd = os.open(self._segment_path(self.segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _delete_segments(self, up_to: int):
+        for segment in self._segments():
+            if segment <= up_to:
+                self._segment_path(segment).unlink(missing_ok=True)
+
+    async def _execute(self, conn, entries):
+        async with conn.cursor() as cursor:
+            await cursor.executemany(FLUSH_SQL, [
+                (e["user_id"], e["planet_id"], Jsonb(e["ships"]), e["updates"], e["id"], e["base"]) for e in entries
+            ])
+            skipped = len(entries) - cursor.rowcount
+        await conn.commit()
+        if skipped:
+            # Deleted rows, or rows changed past their base by a writer that didn't flush first.
+            self.conflicts += skipped
+            logger.warning("%s buffered fleet updates matched no row at their base version", skipped)
+
+    async def _write_rows(self, entries, conn=None):
+        entries = list(entries)
+        if conn is None:
+            async with acquire() as conn:
+                return await self._write_rows(entries, conn)
+        try:
+            await self._execute(conn, entries)
+        except (psycopg.IntegrityError, psycopg.DataError):
+            await conn.rollback()
+            # A write that can no longer apply (its user or planet was deleted since)
+            # must not block the rest forever: retry row by row and drop the failures.
+            for entry in entries:
+                try:
+                    await self._execute(conn, [entry])
+                except (psycopg.IntegrityError, psycopg.DataError) as e:
+                    await conn.rollback()
+                    self.rejected += 1
+                    logger.error("Dropping buffered update of fleet %s: %s", entry["id"], e)
+
+    async def flush(self, conn=None):
+        # Handlers that already hold a pooled connection pass it in: taking a second one could wait
+        # forever once every connection is held by a request waiting here. The flush commits on it,
+        # so it must not be inside a transaction.
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            self.flushing = batch
+            sealed = self.segment
+            self._rotate()
+            try:
+                await self._write_rows(batch.values(), conn)
+            except BaseException:
+                # Failed or cancelled: put the batch back under anything written meanwhile.
+                # Its sealed segments stay on disk until a later flush commits it.
+                self.flush_errors += 1
+                for fleet_id, entry in batch.items():
+                    newer = self.pending.get(fleet_id)
+                    if newer is None:
+                        self.pending[fleet_id] = entry
+                    else:
+                        newer["updates"] += entry["updates"]
+                        newer["base"] = entry["base"]
+                raise
+            finally:
+                self.flushing = {}
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self._delete_segments(sealed)
+
+    async def flush_ids(self, fleet_ids, conn=None):
+        # Writers that bypass the buffer (PATCH, bulk, battles) call this first, so
+        # an older buffered state can never land on top of their change.
+        if self.buffered(fleet_ids):
+            await self.flush(conn)
+
+    async def replay(self):
+        segments = self._segments()
+        records = {}
+        for segment in segments:
+            with open(self._segment_path(segment), "rb") as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        # A torn last line from the crash; everything before it was acknowledged.
+                        logger.warning("Skipping unreadable fleet journal record in segment %s", segment)
+                        continue
+                    records.setdefault(record["id"], []).append(record)
+        latest = []
+        if records:
+            async with acquire() as conn:
+                cursor = await conn.execute(
+                    "SELECT id::text, version FROM user_fleets WHERE id = ANY(%s::uuid[])", (list(records),),
+                )
+                versions = dict(await cursor.fetchall())
+                # Records chain version to version; only those after the row's current version are new.
+                # A fleet whose version matches none of them was flushed already, changed or deleted.
+                for fleet_id, fleet_records in records.items():
+                    bases = [record["base"] for record in fleet_records]
+                    if versions.get(fleet_id) in bases:
+                        start = bases.index(versions[fleet_id])
+                        latest.append({**fleet_records[-1], "base": bases[start], "updates": len(bases) - start})
+                if latest:
+                    await self._write_rows(latest, conn)
+            logger.info("Replayed %s of %s journaled fleets from %s journal segments", len(latest), len(records), len(segments))
+        self.replayed += len(latest)
+        if segments:
+            self.segment = segments[-1]
+            self._delete_segments(segments[-1])
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Fleet write-behind flush failed, %s fleets still buffered", len(self.pending))
+
+    def stats(self):
+        return {
+            "enabled": FLEET_WRITE_BEHIND,
+            "pending": len(self.pending),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+            "conflicts": self.conflicts,
+        }
+
+
+fleet_buffer = FleetWriteBuffer(FLEET_JOURNAL_DIR, FLEET_FLUSH_INTERVAL_MS / 1000, FLEET_FLUSH_MAX_PENDING, FLEET_JOURNAL_FSYNC)
+_flusher_task = None
+
+
+async def start_write_behind():
+    global _flusher_task
+    if not FLEET_WRITE_BEHIND:
+        return
+    fleet_buffer.journal_dir.mkdir(parents=True, exist_ok=True)
+    await fleet_buffer.replay()
+    fleet_buffer._rotate()
+    _flusher_task = asyncio.create_task(fleet_buffer.run())
+
+
+async def stop_write_behind():
+    global _flusher_task
+    if _flusher_task is None:
+        return
+    _flusher_task.cancel()
+    try:
+        await _flusher_task
+    except asyncio.CancelledError:
+        pass
+    _flusher_task = None
+    try:
+        await fleet_buffer.flush()
+    except Exception:
+        logger.exception("Final fleet flush failed, the journal will be replayed on next start")
+    os.close(fleet_buffer.fd)
+    fleet_buffer.fd = None
+    fleet_buffer._delete_segments(fleet_buffer.segment if not fleet_buffer.pending else 0)
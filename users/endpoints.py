@@ -1,94 +1,149 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 import psycopg
 from pydantic import BaseModel
 from uuid import uuid4
+from psycopg.rows import dict_row
+from auth.passwords import hash_password
+from auth.tokens import current_user, forget_user
+from db.pool import acquire, get_db
+from db.replicas import get_read_db
+from db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, stream_ndjson
+from planets.production import CURRENT_RESOURCES_SQL
+from user_fleets.write_behind import FLEET_WRITE_BEHIND, fleet_buffer
 
 class User(BaseModel):
     username: str
     email: str
-    password_hash: str
+    password: str
 
-def connect_to_db():
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
+class UserUpdate(BaseModel):
+    username: str
+    email: str
+    password: str | None = None  # unchanged when left out
 
-    try:
-        conn = psycopg.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        return None
+# Response fields, in response order; password_hash never leaves the database.
+USER_COLUMNS = "id, username, email, created_at"
 
-def get_user_by_id(user_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
-        conn.close()
-        return user
-    return None
+async def get_user_by_id(conn: psycopg.AsyncConnection, user_id: str):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
+        return await cursor.fetchone()
+
+# One round trip for the whole empire: Postgres builds the JSON document, each
+# nested list is an index scan on the ownership indexes from migration 003.
+EMPIRE_SQL = f"""
+    SELECT json_build_object(
+        'id', u.id,
+        'username', u.username,
+        'email', u.email,
+        'created_at', u.created_at,
+        'planets', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', p.id,
+                'name', p.name,
+                'resources', {CURRENT_RESOURCES_SQL},
+                'production_rates', p.production_rates,
+                'discovered_at', p.discovered_at,
+                'claimed_at', p.claimed_at,
+                'version', p.version,
+                'buildings', COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'id', ub.id,
+                        'building_id', ub.building_id,
+                        'level', ub.level
+                    ) ORDER BY ub.id)
+                    FROM user_buildings ub
+                    WHERE ub.planet_id = p.id
+                ), '[]')
+            ) ORDER BY p.id)
+            FROM planets p
+            WHERE p.owner_id = u.id
+        ), '[]'),
+        'fleets', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', f.id,
+                'planet_id', f.planet_id,
+                'ships', f.ships,
+                'version', f.version
+            ) ORDER BY f.id)
+            FROM user_fleets f
+            WHERE f.user_id = u.id
+        ), '[]')
+    )::text
+    FROM users u
+    WHERE u.id = %s
+"""
 
 router = APIRouter()
 
 @router.post("/")
-def create_user(user: User):
-    conn = connect_to_db()
-    if conn:
-        user_id = str(uuid4())
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO users (id, username, email, password_hash) 
-                VALUES (%s, %s, %s, %s) 
-                RETURNING id;
-            """, (user_id, user.username, user.email, user.password_hash))
-            conn.commit()
-        conn.close()
-        return {"id": user_id, "username": user.username, "email": user.email}
-    raise HTTPException(status_code=500, detail="Error creating user.")
+async def create_user(user: User):
+    # Hashed here like /auth/signup, with no connection held while bcrypt runs.
+    password_hash = await hash_password(user.password)
+    user_id = str(uuid4())
+    async with acquire() as conn:
+        await conn.execute("""
+            INSERT INTO users (id, username, email, password_hash)
+            VALUES (%s, %s, %s, %s)
+        """, (user_id, user.username, user.email, password_hash))
+    return {"id": user_id, "username": user.username, "email": user.email}
+
+@router.get("/stream")
+async def stream_users(after: str | None = None):
+    return stream_ndjson(f"SELECT {USER_COLUMNS} FROM users", [], [], after)
 
 @router.get("/{user_id}")
-def read_user(user_id: str):
-    user = get_user_by_id(user_id)
+async def read_user(user_id: str, conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    user = await get_user_by_id(conn, user_id)
     if user:
-        return {"id": user[0], "username": user[1], "email": user[2], "created_at": user[4]}
+        return user
+    raise HTTPException(status_code=404, detail="User not found")
+
+# With write-behind the fleets just flushed are only certain to be on the primary.
+@router.get("/{user_id}/empire")
+async def read_user_empire(
+    user_id: str, conn: psycopg.AsyncConnection = Depends(get_db if FLEET_WRITE_BEHIND else get_read_db),
+):
+    await fleet_buffer.flush(conn)
+    async with conn.cursor() as cursor:
+        await cursor.execute(EMPIRE_SQL, (user_id,))
+        row = await cursor.fetchone()
+    if row:
+        return Response(content=row[0], media_type="application/json")
     raise HTTPException(status_code=404, detail="User not found")
 
 @router.get("/")
-def read_all_users():
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM users")
-            users = cursor.fetchall()
-        conn.close()
-        return [{"id": user[0], "username": user[1], "email": user[2], "created_at": user[4]} for user in users]
-    raise HTTPException(status_code=500, detail="Error fetching users.")
+async def read_all_users(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    conn: psycopg.AsyncConnection = Depends(get_read_db),
+):
+    return await fetch_page(conn, f"SELECT {USER_COLUMNS} FROM users", [], [], after, limit)
 
 @router.put("/{user_id}")
-def update_user(user_id: str, user: User):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                UPDATE users 
-                SET username = %s, email = %s, password_hash = %s 
-                WHERE id = %s
-            """, (user.username, user.email, user.password_hash, user_id))
-            conn.commit()
-        conn.close()
-        return {"message": "User updated successfully"}
-    raise HTTPException(status_code=500, detail="Error updating user.")
+async def update_user(user_id: str, user: UserUpdate, caller: str = Depends(current_user)):
+    # Only the signed-in user can change their own account. A new password revokes their tokens
+    # (migration 009's trigger), the caller's included.
+    if caller != user_id:
+        raise HTTPException(status_code=403, detail="You can only update your own account")
+    password_hash = await hash_password(user.password) if user.password is not None else None
+    async with acquire() as conn:
+        await conn.execute("""
+            UPDATE users
+            SET username = %s, email = %s, password_hash = COALESCE(%s, password_hash)
+            WHERE id = %s
+        """, (user.username, user.email, password_hash, user_id))
+    if password_hash is not None:
+        forget_user(user_id)
+    return {"message": "User updated successfully"}
 
 @router.delete("/{user_id}")
-def delete_user(user_id: str):
-    conn = connect_to_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            conn.commit()
-        conn.close()
-        return {"message": "User deleted successfully"}
-    raise HTTPException(status_code=500, detail="Error deleting user.")
+async def delete_user(user_id: str, caller: str = Depends(current_user), conn: psycopg.AsyncConnection = Depends(get_db)):
+    # Only the signed-in user can delete their own account.
+    if caller != user_id:
+        raise HTTPException(status_code=403, detail="You can only delete your own account")
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        await conn.commit()
+    forget_user(user_id)
+    return {"message": "User deleted successfully"}